@@ -0,0 +1,86 @@
+"""
+Mikrobenchmark for tilkoblingsprofilene i data.database: ventetid for én
+commit slik AddPasswordWidget.save_password gjør den, og for sletting av én
+oppføring, med SQLite sine standardverdier mot profilene.
+
+Kjør fra prosjektroten:
+    python benchmarks/bench_db.py [antall_oppføringer]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from data.database import CONNECTION_PROFILES, create_tables, get_engine, get_session
+from data.encryption import ColumnCipherSet, derive_keys_from_root
+from data.models import ENCRYPTED_ATTRIBUTES, PasswordEntry
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    median = timings[len(timings) // 2]
+    p95 = timings[int(len(timings) * 0.95)]
+    return median * 1000, p95 * 1000
+
+
+def run_profile(profile, ciphers, count):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        engine = get_engine(os.path.join(temp_dir, "bench.db"), profile=profile)
+        create_tables(engine)
+        session = get_session(engine)
+
+        # Som i save_password: krypter, legg til og commit én oppføring om gangen
+        commits = []
+        for number in range(count):
+            data = {
+                "service": f"tjeneste{number}",
+                "email": f"bruker{number}@example.com",
+                "username": f"bruker{number}",
+                "password": "hemmelig",
+                "link": "",
+                "tag": "jobb",
+            }
+            start = time.perf_counter()
+            encrypted = {
+                ENCRYPTED_ATTRIBUTES[column]: token
+                for column, token in ciphers.encrypt_fields(data).items()
+            }
+            encrypted.update(ciphers.derived_columns(data))
+            session.add(PasswordEntry(user_id=1, **encrypted))
+            session.commit()
+            commits.append(time.perf_counter() - start)
+
+        # Som i ShowPasswordWidget.delete_row: hent, slett og commit én oppføring
+        deletes = []
+        for entry_id in range(1, count + 1):
+            start = time.perf_counter()
+            session.delete(session.get(PasswordEntry, entry_id))
+            session.commit()
+            deletes.append(time.perf_counter() - start)
+
+        session.close()
+        engine.dispose()
+    return summarize(commits), summarize(deletes)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    ciphers = ColumnCipherSet(derive_keys_from_root(os.urandom(32)))
+
+    print(f"oppføringer: {count} (median / p95 i ms)")
+    for profile in [None, *CONNECTION_PROFILES]:
+        (commit_median, commit_p95), (delete_median, delete_p95) = run_profile(
+            profile, ciphers, count
+        )
+        print(
+            f"{profile or 'sqlite-standard':<16}"
+            f" lagre {commit_median:6.2f} / {commit_p95:6.2f}"
+            f"   slett {delete_median:6.2f} / {delete_p95:6.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
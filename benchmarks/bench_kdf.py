@@ -0,0 +1,55 @@
+"""
+Mikrobenchmark for opplåsing med gammelt nøkkelskjema: syv PBKDF2-kjøringer
+serielt mot parallelt, og én strekking med HKDF (skjema 2) til sammenligning.
+
+Kjør fra prosjektroten:
+    python benchmarks/bench_kdf.py [antall_runder]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from data.encryption import (
+    derive_keys_from_root,
+    derive_legacy_keys,
+    derive_root_key,
+    hash_root_key,
+)
+
+
+def measure(function, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, sum(timings) / len(timings) * 1000
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    password = "korrekt-hest-batteri-stift"
+    salt = os.urandom(16)
+
+    def unlock_hkdf():
+        root_key = derive_root_key(password, salt)
+        hash_root_key(root_key)
+        derive_keys_from_root(root_key)
+
+    cases = [
+        ("legacy, seriell", lambda: derive_legacy_keys(password, salt, workers=1)),
+        ("legacy, parallell", lambda: derive_legacy_keys(password, salt)),
+        ("skjema 2 (HKDF)", unlock_hkdf),
+    ]
+
+    print(f"CPU-kjerner: {os.cpu_count()}, runder: {rounds}")
+    for name, function in cases:
+        best, mean = measure(function, rounds)
+        print(f"{name:<20} min {best:8.1f} ms   snitt {mean:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Mikrobenchmark for postformatet: seks Fernet-tokens per oppføring mot én
+AES-GCM-post. Måler lagret størrelse per rad (sum av de krypterte kolonnene,
+og filstørrelsen etter VACUUM og checkpoint) og tiden decrypt_many bruker på hele hvelvet.
+
+Kjør fra prosjektroten:
+    python benchmarks/bench_records.py [antall_oppføringer]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from data.database import Database
+from data.encryption import (
+    ColumnCipherSet,
+    decrypt_many,
+    derive_keys_from_root,
+    derive_root_key,
+)
+from data.models import ENCRYPTED_ATTRIBUTES, PasswordEntry
+from data.records import migrate_records
+from data.repository import PasswordRepository
+
+
+def fill(database, ciphers, count):
+    # Gamle rader, som de ble lagret før postformatet
+    rows = []
+    for number in range(count):
+        data = {
+            "service": f"tjeneste{number}",
+            "email": f"bruker{number}@example.com",
+            "username": f"bruker{number}",
+            "password": f"hemmelig-{number:08d}",
+            "link": f"https://tjeneste{number}.example.com/login",
+            "tag": ("Jobb", "Privat", "Bank")[number % 3],
+        }
+        row = {
+            ENCRYPTED_ATTRIBUTES[column]: token
+            for column, token in ciphers.encrypt_fields(data).items()
+        }
+        row.update(ciphers.derived_columns(data))
+        row["user_id"] = 1
+        rows.append(row)
+    with database.engine.begin() as connection:
+        connection.execute(PasswordEntry.__table__.insert(), rows)
+
+
+def report(name, database, repository, ciphers):
+    rows = repository.fetch_rows(include_password=True)
+    stored = sum(len(value or "") for row in rows for value in row[1:]) / max(
+        len(rows), 1
+    )
+
+    start = time.perf_counter()
+    result = decrypt_many(ciphers, rows, tuple(ENCRYPTED_ATTRIBUTES))
+    elapsed = (time.perf_counter() - start) * 1000
+    assert not result.errors
+
+    with database.engine.connect() as connection:
+        connection.exec_driver_sql("VACUUM")
+        # Med WAL ligger sidene i -wal-filen til et checkpoint
+        connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    size = os.path.getsize(database.engine.url.database) / 2**20
+    print(
+        f"{name:<16} {stored:6.0f} byte/rad   fil {size:6.1f} MiB"
+        f"   dekryptering {elapsed:7.0f} ms"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    ciphers = ColumnCipherSet(derive_keys_from_root(derive_root_key("bench", b"salt")))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        database = Database(os.path.join(temp_dir, "bench.db"))
+        fill(database, ciphers, count)
+        repository = PasswordRepository(database, 1)
+
+        print(f"oppføringer: {count}")
+        report("Fernet-tokens", database, repository, ciphers)
+        start = time.perf_counter()
+        migrate_records(database.engine, 1, ciphers)
+        elapsed = (time.perf_counter() - start) * 1000
+        report("AES-GCM-post", database, repository, ciphers)
+        print(f"migrering        {elapsed:7.0f} ms")
+        database.dispose()
+
+
+if __name__ == "__main__":
+    main()
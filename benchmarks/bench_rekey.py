@@ -0,0 +1,116 @@
+"""
+Mikrobenchmark for passordbytte: krypterer et syntetisk hvelv på nytt med
+VaultRekey og måler total tid, lengste bit (hvor lenge skrivelåsen holdes
+om gangen) og topp minnebruk for ulike bitstørrelser.
+
+Kjør fra prosjektroten:
+    python benchmarks/bench_rekey.py [antall_oppføringer]
+"""
+
+import base64
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from data.database import Database
+from data.encryption import (
+    ColumnCipherSet,
+    derive_keys_from_root,
+    derive_root_key,
+    hash_root_key,
+    wrap_key,
+)
+from data.models import PasswordEntry, RekeyState, User
+from data.rekey import VaultRekey, rekey_label
+from data.repository import encrypt_entry
+
+
+def fill(database, root_key, count):
+    ciphers = ColumnCipherSet(derive_keys_from_root(root_key))
+    with database.session_scope() as session:
+        session.add(
+            User(id=1, username="bench", password_hash=hash_root_key(root_key), salt="")
+        )
+    rows = []
+    for number in range(count):
+        data = {
+            "service": f"tjeneste{number}",
+            "email": f"bruker{number}@example.com",
+            "username": f"bruker{number}",
+            "password": f"hemmelig-{number:08d}",
+            "link": f"https://tjeneste{number}.example.com/login",
+            "tag": ("Jobb", "Privat", "Bank")[number % 3],
+        }
+        row = encrypt_entry(ciphers, number + 1, data)
+        row.update(id=number + 1, user_id=1)
+        rows.append(row)
+    with database.engine.begin() as connection:
+        connection.execute(PasswordEntry.__table__.insert(), rows)
+
+
+def start(database, old_root, new_root):
+    with database.session_scope() as session:
+        session.add(
+            RekeyState(
+                user_id=1,
+                salt=base64.b64encode(os.urandom(16)).decode(),
+                password_hash=hash_root_key(new_root),
+                kdf_iterations=100000,
+                old_root=wrap_key(new_root, old_root, rekey_label(1)),
+                new_root=wrap_key(old_root, new_root, rekey_label(1)),
+            )
+        )
+    return VaultRekey(
+        database, 1, derive_keys_from_root(old_root), derive_keys_from_root(new_root)
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    sizes = (100, 500, 2000)
+    roots = [
+        derive_root_key(f"passord{number}", b"salt")
+        for number in range(2 * len(sizes) + 1)
+    ]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        database = Database(os.path.join(temp_dir, "bench.db"))
+        fill(database, roots[0], count)
+
+        print(f"oppføringer: {count}")
+        for number, batch_size in enumerate(sizes):
+            # Tid og minne måles i hvert sitt bytte, tracemalloc gjør målingen tregere
+            job = start(database, roots[2 * number], roots[2 * number + 1])
+            job.batch_size = batch_size
+            batches = []
+            last = [time.perf_counter()]
+
+            def on_progress(progress):
+                now = time.perf_counter()
+                batches.append(now - last[0])
+                last[0] = now
+
+            begin = time.perf_counter()
+            assert job.run(on_progress=on_progress)
+            elapsed = time.perf_counter() - begin
+
+            job = start(database, roots[2 * number + 1], roots[2 * number + 2])
+            job.batch_size = batch_size
+            tracemalloc.start()
+            assert job.run()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(
+                f"bit {batch_size:5d}   totalt {elapsed * 1000:7.0f} ms"
+                f"   lengste bit {max(batches) * 1000:6.1f} ms"
+                f"   topp {peak / 2**20:6.1f} MiB"
+            )
+        database.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Mikrobenchmark for lesing av listen: hele PasswordEntry-objekter fra ORM mot
+lette rader fra PasswordRepository.fetch_rows, med og uten passordkolonnen.
+Hvelvet er syntetisk, feltene er tilfeldige byte på størrelse med rå
+Fernet-tokens, så ingenting krypteres.
+
+Kjør fra prosjektroten:
+    python benchmarks/bench_rows.py [antall_oppføringer]
+"""
+
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from data.database import Database
+from data.models import ENCRYPTED_ATTRIBUTES, PasswordEntry
+from data.repository import PasswordRepository
+
+# Et rått Fernet-token for et felt på 16 til 31 byte: versjon, tidsstempel,
+# IV, to AES-blokker og HMAC
+TOKEN_BYTES = 89
+
+
+def fake_token():
+    return os.urandom(TOKEN_BYTES)
+
+
+def fill(database, count):
+    rows = [
+        {
+            "user_id": 1,
+            **{attribute: fake_token() for attribute in ENCRYPTED_ATTRIBUTES.values()},
+        }
+        for _ in range(count)
+    ]
+    with database.engine.begin() as connection:
+        connection.execute(PasswordEntry.__table__.insert(), rows)
+
+
+def measure(function):
+    # Tid og minne måles hver for seg, tracemalloc gjør målingen tregere
+    gc.collect()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    del result
+
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed * 1000, retained / 2**20, peak / 2**20
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        database = Database(os.path.join(temp_dir, "bench.db"))
+        fill(database, count)
+        repository = PasswordRepository(database, 1)
+
+        def orm_entities():
+            # Slik load_passwords og backup_csv leste før
+            session = database.session()
+            entries = session.query(PasswordEntry).filter_by(user_id=1).all()
+            return session, entries
+
+        cases = [
+            ("ORM-objekter", orm_entities),
+            ("rader, med passord", lambda: repository.fetch_rows(True)),
+            ("rader, uten passord", lambda: repository.fetch_rows()),
+        ]
+
+        print(f"oppføringer: {count}")
+        for name, function in cases:
+            elapsed, retained, peak = measure(function)
+            print(
+                f"{name:<20} {elapsed:8.0f} ms"
+                f"   beholdt {retained:7.1f} MiB   topp {peak:7.1f} MiB"
+            )
+        database.dispose()
+
+
+if __name__ == "__main__":
+    main()
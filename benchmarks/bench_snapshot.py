@@ -0,0 +1,94 @@
+"""
+Mikrobenchmark for snapshot av listen: hele listen dekryptert rad for rad
+(fetch_rows og decrypt_many, som søket bruker) mot ListingSnapshot.load (én
+AES-GCM-dekryptering og én JSON-deserialisering). Måler også størrelsen på
+snapshotfilen og hvor lang tid refresh bruker på å lage den.
+
+Kjør fra prosjektroten:
+    python benchmarks/bench_snapshot.py [antall_oppføringer]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from data.database import Database
+from data.encryption import (
+    ColumnCipherSet,
+    decrypt_many,
+    derive_keys_from_root,
+    derive_root_key,
+)
+from data.models import PasswordEntry, User
+from data.repository import LISTING_ATTRIBUTES, PasswordRepository, encrypt_entry
+from data.snapshot import ListingSnapshot
+
+
+def fill(database, ciphers, count):
+    rows = []
+    for number in range(count):
+        data = {
+            "service": f"tjeneste{number}",
+            "email": f"bruker{number}@example.com",
+            "username": f"bruker{number}",
+            "password": f"hemmelig-{number:08d}",
+            "link": f"https://tjeneste{number}.example.com/login",
+            "tag": ("Jobb", "Privat", "Bank")[number % 3],
+        }
+        row = encrypt_entry(ciphers, number + 1, data)
+        row["id"] = number + 1
+        row["user_id"] = 1
+        rows.append(row)
+    with database.engine.begin() as connection:
+        connection.execute(
+            User.__table__.insert(),
+            {"id": 1, "username": "bench", "password_hash": "", "salt": ""},
+        )
+        connection.execute(PasswordEntry.__table__.insert(), rows)
+
+
+def best_of(function, runs=3):
+    elapsed = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        run = time.perf_counter() - start
+        elapsed = run if elapsed is None else min(elapsed, run)
+    return elapsed * 1000, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    ciphers = ColumnCipherSet(derive_keys_from_root(derive_root_key("bench", b"salt")))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        database = Database(os.path.join(temp_dir, "bench.db"))
+        fill(database, ciphers, count)
+        repository = PasswordRepository(database, 1)
+        snapshot = ListingSnapshot(database, 1, ciphers)
+
+        def decrypt_rows():
+            rows = repository.fetch_rows()
+            return decrypt_many(ciphers, rows, LISTING_ATTRIBUTES)
+
+        rows_ms, result = best_of(decrypt_rows)
+        assert not result.errors
+        start = time.perf_counter()
+        assert snapshot.refresh()
+        refresh_ms = (time.perf_counter() - start) * 1000
+        load_ms, entries = best_of(snapshot.load)
+        assert len(entries) == count
+        size = os.path.getsize(snapshot.path) / 2**20
+
+        print(f"oppføringer: {count}")
+        print(f"rad for rad      {rows_ms:7.0f} ms")
+        print(f"snapshot         {load_ms:7.0f} ms   fil {size:5.1f} MiB")
+        print(f"lage snapshot    {refresh_ms:7.0f} ms")
+        database.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Mikrobenchmark for lagring av chiffertekst: base64-tekst (slik kolonnene var
+før de ble LargeBinary) mot rå byte. Hvelvet fylles med poster som tekst,
+måles, gjøres om med data.records.pack_text_columns og måles på nytt.
+Filstørrelsen måles etter VACUUM og checkpoint, og full lasting er
+fetch_rows med passord og decrypt_many over alle radene.
+
+Kjør fra prosjektroten:
+    python benchmarks/bench_storage.py [antall_oppføringer]
+"""
+
+import base64
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from data.database import Database
+from data.encryption import (
+    ColumnCipherSet,
+    decrypt_many,
+    derive_keys_from_root,
+    derive_root_key,
+)
+from data.models import ENCRYPTED_ATTRIBUTES
+from data.records import pack_text_columns
+from data.repository import PasswordRepository, encrypt_entry
+
+
+def fill(database, ciphers, count):
+    # Rå SQL, siden modellen bare tar byte i de krypterte kolonnene
+    rows = []
+    for number in range(count):
+        data = {
+            "service": f"tjeneste{number}",
+            "email": f"bruker{number}@example.com",
+            "username": f"bruker{number}",
+            "password": f"hemmelig-{number:08d}",
+            "link": f"https://tjeneste{number}.example.com/login",
+            "tag": ("Jobb", "Privat", "Bank")[number % 3],
+        }
+        row = encrypt_entry(ciphers, number + 1, data)
+        row["record"] = base64.urlsafe_b64encode(row["record"]).decode()
+        for attribute in ENCRYPTED_ATTRIBUTES.values():
+            row[attribute] = ""
+        row["id"] = number + 1
+        row["user_id"] = 1
+        rows.append(row)
+    names = ", ".join(rows[0])
+    marks = ", ".join("?" for _ in rows[0])
+    with database.engine.begin() as connection:
+        connection.exec_driver_sql(
+            f"INSERT INTO passwords ({names}) VALUES ({marks})",
+            [tuple(row.values()) for row in rows],
+        )
+
+
+def report(name, database, repository, ciphers):
+    with database.engine.connect() as connection:
+        connection.exec_driver_sql("VACUUM")
+        # Med WAL ligger sidene i -wal-filen til et checkpoint
+        connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    size = os.path.getsize(database.engine.url.database) / 2**20
+
+    timings = []
+    for _ in range(3):
+        start = time.perf_counter()
+        rows = repository.fetch_rows(include_password=True)
+        result = decrypt_many(ciphers, rows, tuple(ENCRYPTED_ATTRIBUTES))
+        timings.append((time.perf_counter() - start) * 1000)
+        assert not result.errors
+    print(f"{name:<12} fil {size:6.1f} MiB   full lasting {min(timings):7.0f} ms")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    ciphers = ColumnCipherSet(derive_keys_from_root(derive_root_key("bench", b"salt")))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        database = Database(os.path.join(temp_dir, "bench.db"))
+        fill(database, ciphers, count)
+        repository = PasswordRepository(database, 1)
+
+        print(f"oppføringer: {count}")
+        report("base64-tekst", database, repository, ciphers)
+        start = time.perf_counter()
+        pack_text_columns(database.engine)
+        elapsed = (time.perf_counter() - start) * 1000
+        report("rå byte", database, repository, ciphers)
+        print(f"omgjøring    {elapsed:7.0f} ms")
+        database.dispose()
+
+
+if __name__ == "__main__":
+    main()
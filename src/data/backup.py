@@ -0,0 +1,69 @@
+import os
+import sqlite3
+
+from .database import (
+    apply_attached_pragmas,
+    bulk_connection,
+    create_tables,
+    get_engine,
+)
+from .models import PasswordEntry
+
+
+def copy_database(source_path, target_path):
+    """Konsistent kopi av hele databasefilen med SQLite sin online backup-API."""
+    source = sqlite3.connect(source_path)
+    try:
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+
+def create_user_backup(engine, user_id, backup_path) -> int:
+    """
+    Skriv en backup med bare brukerens oppføringer til backup_path og returner
+    antall oppføringer. Skjemaet lages i en ny fil, og oppføringene kopieres med
+    ATTACH og én INSERT ... SELECT, så ingen rader går gjennom Python. Filen
+    skrives under et midlertidig navn ved siden av og flyttes på plass til
+    slutt, slik at en avbrutt backup aldri etterlater en halv fil.
+    """
+    temp_path = f"{backup_path}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    # Backupfilen får SQLite sine standardverdier (ingen WAL), så alt ligger
+    # i selve filen når den flyttes på plass
+    backup_engine = get_engine(temp_path, profile=None)
+    create_tables(backup_engine)
+    backup_engine.dispose()
+
+    columns = ", ".join(column.name for column in PasswordEntry.__table__.columns)
+    try:
+        with bulk_connection(engine) as connection:
+            connection.exec_driver_sql("ATTACH DATABASE ? AS backup", (temp_path,))
+            # Filen kastes hvis kopieringen feiler, så den skrives uten fsync
+            apply_attached_pragmas(connection, "backup")
+            try:
+                result = connection.exec_driver_sql(
+                    f"INSERT INTO backup.passwords ({columns}) "
+                    f"SELECT {columns} FROM main.passwords WHERE user_id = ?",
+                    (user_id,),
+                )
+                count = result.rowcount
+                connection.commit()
+            finally:
+                connection.rollback()
+                connection.exec_driver_sql("DETACH DATABASE backup")
+        # Én fsync før filen erstatter en eldre backup
+        with open(temp_path, "rb") as file:
+            os.fsync(file.fileno())
+        os.replace(temp_path, backup_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return count
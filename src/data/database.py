@@ -1,16 +1,203 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+import os
+import threading
+import weakref
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
-from .models import Base
+from .migrations import migrate
+
+# PRAGMA-profiler som settes på hver ny SQLite-tilkobling.
+# "desktop" er standard: WAL lar lesere og én skriver jobbe samtidig, og med
+# WAL er synchronous=NORMAL trygt mot korrupsjon (bare siste commit kan gå tapt
+# ved strømbrudd). "sikker" beholder fsync på hver commit. Profilene setter de
+# samme nøklene, slik at en tilkobling kan byttes fra én profil til en annen.
+CONNECTION_PROFILES = {
+    "desktop": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,  # 16 MB
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+    "sikker": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -16000,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+    # Brukes midlertidig av import, synkronisering og backup, med en stor
+    # cache. Synkronisering skriver i selve hvelvet (main), så fsync beholdes
+    # som i "desktop"; med WAL er NORMAL trygt mot korrupsjon.
+    "bulk": {
+        "synchronous": "NORMAL",
+        "cache_size": -64000,  # 64 MB
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 30000,
+    },
+}
+# PRAGMA-er for en database koblet til med ATTACH som bare skrives av én
+# bulk-jobb og kastes hvis jobben feiler, som en backup under arbeid. Uten
+# skjemanavn gjelder en PRAGMA bare main. Den som skriver filen tar én fsync
+# når den er ferdig, se data.backup.create_user_backup.
+ATTACHED_BULK_PRAGMAS = {
+    "synchronous": "OFF",
+    "cache_size": -64000,
+}
+DEFAULT_PROFILE = "desktop"
+BULK_PROFILE = "bulk"
+# Profilene brukeren kan velge i innstillingene
+USER_PROFILES = ("desktop", "sikker")
+
+# Gjeldende profil per engine, leses av connect-hooken
+_engine_profiles = weakref.WeakKeyDictionary()
+
+
+def apply_pragmas(dbapi_connection, profile):
+    # Ukjent profil eller None gir SQLite sine standardverdier
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in CONNECTION_PROFILES.get(profile, {}).items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+def apply_attached_pragmas(connection, schema, pragmas=ATTACHED_BULK_PRAGMAS):
+    """Sett PRAGMA-ene på en database som er koblet til med ATTACH ... AS schema."""
+    for name, value in pragmas.items():
+        connection.exec_driver_sql(f"PRAGMA {schema}.{name} = {value}")
+
+
+def get_engine(db_path="passwords.db", profile=DEFAULT_PROFILE):
+    engine = create_engine(f"sqlite:///{db_path}", echo=False)
+    _engine_profiles[engine] = profile
 
+    @event.listens_for(engine, "connect")
+    def apply_connection_profile(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, _engine_profiles.get(engine))
 
-def get_engine(db_path="passwords.db"):
-    return create_engine(f"sqlite:///{db_path}", echo=False)
+    return engine
+
+
+def get_connection_profile(engine):
+    return _engine_profiles.get(engine)
+
+
+def set_connection_profile(engine, profile):
+    """Bytt profil. Ledige tilkoblinger kastes og åpnes på nytt med den nye."""
+    if profile not in CONNECTION_PROFILES:
+        raise ValueError(f"Ukjent tilkoblingsprofil: {profile}")
+    if _engine_profiles.get(engine) == profile:
+        return
+    _engine_profiles[engine] = profile
+    engine.dispose()
+
+
+@contextmanager
+def bulk_connection(engine):
+    """
+    Tilkobling med bulk-profilen for import, synkronisering og backup.
+    Profilen til engine settes tilbake før tilkoblingen går tilbake i poolen.
+    """
+    with engine.connect() as connection:
+        dbapi_connection = connection.connection
+        apply_pragmas(dbapi_connection, BULK_PROFILE)
+        try:
+            yield connection
+        finally:
+            apply_pragmas(dbapi_connection, _engine_profiles.get(engine))
 
 
 def create_tables(engine):
-    Base.metadata.create_all(engine)
+    # Lager tabellene og kjører manglende migreringer, se data.migrations
+    migrate(engine)
 
 
 def get_session(engine):
     Session = sessionmaker(bind=engine)
     return Session()
+
+
+class Database:
+    """Én engine med tilkoblingspool og sesjonsfabrikk for en databasefil."""
+
+    def __init__(self, db_path, profile=DEFAULT_PROFILE):
+        self.db_path = db_path
+        self.engine = get_engine(db_path, profile)
+        create_tables(self.engine)
+        # Objekter beholder verdiene etter commit, så de kan brukes etter at
+        # sesjonen er lukket uten nye SELECT-er
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    def session(self):
+        return self.Session()
+
+    @contextmanager
+    def session_scope(self):
+        """Sesjon for én arbeidsoperasjon: commit ved suksess, ellers rollback."""
+        session = self.Session()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def dispose(self):
+        self.engine.dispose()
+
+
+class QueryCounter:
+    """
+    Teller SQL-setningene en engine sender mens blokken kjører, f.eks. for å
+    sjekke i tester hvor mange spørringer en handling i brukergrensesnittet
+    koster. executemany teller som én setning.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _record(self, connection, cursor, statement, parameters, context, many):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+        return False
+
+
+# Prosessens databaser, én per fil, slik at skjemasjekken kjøres én gang
+# og alle deler samme tilkoblingspool
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(db_path="passwords.db") -> Database:
+    key = os.path.abspath(db_path)
+    with _databases_lock:
+        database = _databases.get(key)
+        if database is None:
+            database = _databases[key] = Database(key)
+    return database
+
+
+def close_databases():
+    with _databases_lock:
+        for database in _databases.values():
+            database.dispose()
+        _databases.clear()
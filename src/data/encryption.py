@@ -1,11 +1,85 @@
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.backends import default_backend
-from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, MultiFernet
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import base64
+import hashlib
+import hmac
+import os
+import time
+import unicodedata
 
+# Nøkkelskjema som lagres på hver bruker (users.key_scheme)
+# 1: én PBKDF2-kjøring per kolonne (gammelt skjema)
+# 2: én PBKDF2-kjøring gir en rotnøkkel, kolonnenøkler utvides med HKDF
+KEY_SCHEME_LEGACY = 1
+KEY_SCHEME_HKDF = 2
 
-def derive_key_for_column(password, salt, column_name, iterations=100000):
+DEFAULT_ITERATIONS = 100000
+
+# Grenser og mål for kalibrering av PBKDF2-kostnaden per bruker
+MIN_ITERATIONS = DEFAULT_ITERATIONS
+MAX_ITERATIONS = 10000000
+TARGET_UNLOCK_MS = 300
+
+# Kolonnene som får hver sin krypteringsnøkkel
+ENCRYPTED_COLUMNS = ("service", "email", "username", "password", "link", "tag")
+
+# Kolonner med blind-indeks (HMAC av normalisert klartekst) for oppslag i SQL,
+# og navnet på undernøkkelen i nøkkelsettet fra derive_keys_from_root
+BLIND_INDEX_COLUMNS = ("service", "email", "tag")
+BLIND_INDEX_KEY = "blind_index"
+
+# Feltene som identifiserer en oppføring (f.eks. ved synkronisering), og
+# undernøkkelen for fingeravtrykket av dem
+IDENTITY_COLUMNS = ("service", "email", "username", "link", "tag")
+FINGERPRINT_KEY = "fingerprint"
+
+# Postformatet: alle feltene i én oppføring krypteres samlet med AES-GCM
+# under en egen undernøkkel, med oppføringens id som tilleggsdata. Posten er
+# version || nonce || chiffertekst med tag, lagret som rå byte.
+RECORD_KEY = "record"
+RECORD_VERSION = 1
+RECORD_NONCE_SIZE = 12
+
+# Snapshot av listen (se data.snapshot): én AES-GCM-blob under en egen
+# undernøkkel. Blobben er format || hvelvversjon (8 byte) || nonce ||
+# chiffertekst, med bruker og hvelvversjon i tilleggsdataene.
+SNAPSHOT_KEY = "snapshot"
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_HEADER_SIZE = 1 + 8
+
+# Undernøkler i nøkkelsettet som ikke er Fernet-nøkler
+SUBKEYS = (BLIND_INDEX_KEY, FINGERPRINT_KEY, RECORD_KEY, SNAPSHOT_KEY)
+
+# Nøkkelrotasjon: krypteringsnøklene (kolonnene og postnøkkelen) finnes i
+# generasjoner, utledet fra samme rotnøkkel. Nøkkelsettet har gjeldende
+# generasjon under KEY_GENERATION og nøklene til de eldre under
+# RETIRED_KEYS (nyeste først), så gamle tokens kan leses mens hvelvet
+# krypteres om. Blind-indeks- og fingeravtrykksnøklene roteres ikke, siden
+# oppslag i SQL krever at like verdier gir like indekser.
+KEY_GENERATION = "generation"
+RETIRED_KEYS = "retired"
+
+# Kolonnenøklene fra gammelt skjema for en bruker som er oppgradert. De
+# brukes bare til å dekryptere, f.eks. backuper tatt før oppgraderingen.
+LEGACY_KEYS = "legacy"
+KEY_RING_ENTRIES = (KEY_GENERATION, RETIRED_KEYS, LEGACY_KEYS)
+
+# Antall rader hver tråd dekrypterer om gangen i decrypt_many
+DECRYPT_CHUNK_SIZE = 500
+
+# Resultat fra decrypt_many: values har samme rekkefølge som radene inn,
+# med None for rader som feilet. errors er en liste med (indeks, unntak).
+DecryptResult = namedtuple("DecryptResult", ["values", "errors"])
+
+
+def derive_key_for_column(password, salt, column_name, iterations=DEFAULT_ITERATIONS):
     # Bruk navnet på kolonnen for å gjøre nøkler unike
     column_specific_salt = salt + column_name.encode()
     kdf = PBKDF2HMAC(
@@ -19,7 +93,7 @@ def derive_key_for_column(password, salt, column_name, iterations=100000):
     return base64.urlsafe_b64encode(key)
 
 
-def hash_password(password, salt, iterations=100000):
+def hash_password(password, salt, iterations=DEFAULT_ITERATIONS):
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(),
         length=32,
@@ -30,21 +104,617 @@ def hash_password(password, salt, iterations=100000):
     return base64.b64encode(kdf.derive(password.encode())).decode().strip()
 
 
-def encrypt_password(password: str, key: bytes) -> str:
-    """Krypter passordet med den gitte nøkkelen."""
+def _run_derivations(jobs: dict, workers=None) -> dict:
+    """
+    Kjør navngitte nøkkelutledninger (navn -> (funksjon, argumenter)).
+    OpenSSL slipper GIL under PBKDF2, så tråder gir ekte parallellitet.
+    workers=None bruker én tråd per kjerne, workers<=1 kjører serielt.
+    """
+    if workers is None:
+        workers = min(len(jobs), os.cpu_count() or 1)
+    if workers <= 1 or len(jobs) <= 1:
+        return {name: function(*args) for name, (function, args) in jobs.items()}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            name: executor.submit(function, *args)
+            for name, (function, args) in jobs.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
+def derive_column_keys(
+    password,
+    salt,
+    columns=ENCRYPTED_COLUMNS,
+    iterations=DEFAULT_ITERATIONS,
+    workers=None,
+) -> dict:
+    """Utled nøkler for hver kolonne med gammelt skjema, eventuelt parallelt."""
+    jobs = {
+        column: (derive_key_for_column, (password, salt, column, iterations))
+        for column in columns
+    }
+    return _run_derivations(jobs, workers)
+
+
+def derive_legacy_keys(
+    password,
+    salt,
+    columns=ENCRYPTED_COLUMNS,
+    iterations=DEFAULT_ITERATIONS,
+    workers=None,
+) -> tuple:
+    """
+    Kjør verifikatoren og alle kolonnenøklene for gammelt skjema samtidig.
+    Returnerer (password_hash, nøkler).
+    """
+    verifier = object()
+    jobs = {
+        column: (derive_key_for_column, (password, salt, column, iterations))
+        for column in columns
+    }
+    jobs[verifier] = (hash_password, (password, salt, iterations))
+    keys = _run_derivations(jobs, workers)
+    return keys.pop(verifier), keys
+
+
+def derive_root_key(password, salt, iterations=DEFAULT_ITERATIONS):
+    """Strekk hovedpassordet én gang og returner rotnøkkelen (32 byte)."""
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=iterations,
+        backend=default_backend(),
+    )
+    return kdf.derive(password.encode())
+
+
+def calibrate_iterations(
+    target_ms=TARGET_UNLOCK_MS,
+    probe_iterations=20000,
+    minimum=MIN_ITERATIONS,
+    maximum=MAX_ITERATIONS,
+) -> int:
+    """
+    Mål hvor raskt denne maskinen kjører PBKDF2 og velg antall iterasjoner
+    slik at én strekking av hovedpassordet tar omtrent target_ms.
+    """
+    salt = os.urandom(16)
+    elapsed = None
+    for _ in range(3):
+        start = time.perf_counter()
+        derive_root_key("kalibrering", salt, probe_iterations)
+        run = time.perf_counter() - start
+        elapsed = run if elapsed is None else min(elapsed, run)
+
+    iterations = int(probe_iterations / max(elapsed, 1e-6) * target_ms / 1000)
+    iterations = round(iterations, -3)
+    return max(minimum, min(maximum, iterations))
+
+
+def expand_key(root_key: bytes, label: str, length=32) -> bytes:
+    """Utled en undernøkkel fra rotnøkkelen med HKDF. Billig, ingen strekking."""
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=length,
+        salt=None,
+        info=f"passordskap/{label}".encode(),
+        backend=default_backend(),
+    )
+    return hkdf.derive(root_key)
+
+
+def hash_root_key(root_key: bytes) -> str:
+    """Verifikatoren som lagres i users.password_hash for skjema 2."""
+    return base64.b64encode(expand_key(root_key, "verifier")).decode()
+
+
+def generation_label(label: str, generation: int) -> str:
+    # Generasjon 0 har samme label som før rotasjon fantes
+    return label if generation == 0 else f"{label}/g{generation}"
+
+
+def derive_generation_keys(
+    root_key: bytes, generation: int, columns=ENCRYPTED_COLUMNS
+) -> dict:
+    """Krypteringsnøklene i én generasjon: Fernet per kolonne og postnøkkelen."""
+    keys = {
+        column: base64.urlsafe_b64encode(
+            expand_key(root_key, generation_label(f"column/{column}", generation))
+        )
+        for column in columns
+    }
+    keys[RECORD_KEY] = expand_key(root_key, generation_label("record", generation))
+    return keys
+
+
+def derive_keys_from_root(
+    root_key: bytes, columns=ENCRYPTED_COLUMNS, generation=0, oldest_generation=0
+) -> dict:
+    """
+    Utled Fernet-nøkler for hver kolonne fra rotnøkkelen, pluss egne
+    undernøkler for blind-indekser, fingeravtrykk, poster og snapshot (SUBKEYS).
+    Krypteringsnøklene er fra generasjon generation, med de eldre
+    generasjonene ned til oldest_generation under RETIRED_KEYS. Hver
+    generasjon er noen få HKDF-kall.
+    """
+    keys = derive_generation_keys(root_key, generation, columns)
+    keys[BLIND_INDEX_KEY] = expand_key(root_key, "blind-index")
+    keys[FINGERPRINT_KEY] = expand_key(root_key, "fingerprint")
+    keys[SNAPSHOT_KEY] = expand_key(root_key, "snapshot")
+    keys[KEY_GENERATION] = generation
+    keys[RETIRED_KEYS] = [
+        derive_generation_keys(root_key, older, columns)
+        for older in range(generation - 1, oldest_generation - 1, -1)
+    ]
+    return keys
+
+
+def normalize_for_index(value: str) -> str:
+    return unicodedata.normalize("NFC", value or "").strip().casefold()
+
+
+def blind_index(index_key: bytes, column: str, value: str) -> str:
+    """Nøklet HMAC av normalisert klartekst, lik for like verdier i samme kolonne."""
+    message = column.encode() + b"\x00" + normalize_for_index(value).encode()
+    return hmac.new(index_key, message, hashlib.sha256).hexdigest()
+
+
+def entry_fingerprint(fingerprint_key: bytes, fields) -> str:
+    """
+    Nøklet HMAC over de normaliserte identitetsfeltene til en oppføring
+    (IDENTITY_COLUMNS). Hvert felt lengdeprefikses så grensene er entydige.
+    """
+    mac = hmac.new(fingerprint_key, digestmod=hashlib.sha256)
+    for value in fields:
+        encoded = normalize_for_index(value).encode()
+        mac.update(len(encoded).to_bytes(4, "big") + encoded)
+    return mac.hexdigest()
+
+
+def encode_record_fields(data: dict) -> bytes:
+    """
+    Feltene i ENCRYPTED_COLUMNS-rekkefølge, hvert som lengde (varint) og
+    UTF-8. Manglende felt lagres som tomme.
+    """
+    encoded = bytearray()
+    for column in ENCRYPTED_COLUMNS:
+        value = (data.get(column) or "").encode()
+        length = len(value)
+        while length >= 0x80:
+            encoded.append(length & 0x7F | 0x80)
+            length >>= 7
+        encoded.append(length)
+        encoded += value
+    return bytes(encoded)
+
+
+def decode_record_fields(payload: bytes) -> dict:
+    """Motsatt av encode_record_fields."""
+    fields = {}
+    position = 0
     try:
-        f = Fernet(key)
-        encrypted = f.encrypt(password.encode()).decode()
+        for column in ENCRYPTED_COLUMNS:
+            length = shift = 0
+            while True:
+                byte = payload[position]
+                position += 1
+                length |= (byte & 0x7F) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+            end = position + length
+            if end > len(payload):
+                raise IndexError(column)
+            fields[column] = payload[position:end].decode()
+            position = end
+    except IndexError:
+        raise ValueError("Posten er avkortet.")
+    if position != len(payload):
+        raise ValueError("Posten har ukjente data etter feltene.")
+    return fields
+
+
+def record_associated_data(entry_id: int, version=RECORD_VERSION) -> bytes:
+    """Tilleggsdataene som binder en post til formatversjonen og oppføringens id."""
+    return b"passordskap/record" + bytes([version]) + entry_id.to_bytes(8, "big")
+
+
+def snapshot_associated_data(user_id: int, vault_version: int) -> bytes:
+    """Tilleggsdataene som binder et snapshot til brukeren og hvelvversjonen."""
+    return (
+        b"passordskap/snapshot"
+        + bytes([SNAPSHOT_FORMAT])
+        + user_id.to_bytes(8, "big")
+        + vault_version.to_bytes(8, "big")
+    )
+
+
+def snapshot_version(blob: bytes):
+    """Hvelvversjonen i hodet til et snapshot, eller None for ukjent format."""
+    if len(blob) < SNAPSHOT_HEADER_SIZE or blob[0] != SNAPSHOT_FORMAT:
+        return None
+    return int.from_bytes(blob[1:SNAPSHOT_HEADER_SIZE], "big")
+
+
+def wrap_key(wrapping_root: bytes, key: bytes, label: str) -> bytes:
+    """
+    Krypter en nøkkel med AES-GCM under en undernøkkel av wrapping_root.
+    label bindes inn som tilleggsdata og må være lik ved unwrap_key.
+    """
+    nonce = os.urandom(RECORD_NONCE_SIZE)
+    cipher = AESGCM(expand_key(wrapping_root, "wrap"))
+    return nonce + cipher.encrypt(nonce, key, f"passordskap/{label}".encode())
+
+
+def unwrap_key(wrapping_root: bytes, wrapped: bytes, label: str) -> bytes:
+    """Motsatt av wrap_key. Feiler (InvalidTag) med feil nøkkel eller label."""
+    cipher = AESGCM(expand_key(wrapping_root, "wrap"))
+    return cipher.decrypt(
+        wrapped[:RECORD_NONCE_SIZE],
+        wrapped[RECORD_NONCE_SIZE:],
+        f"passordskap/{label}".encode(),
+    )
+
+
+def pack_legacy_keys(keys: dict) -> bytes:
+    """Kolonnenøklene fra gammelt skjema som rå byte, for wrap_key."""
+    return b"".join(
+        base64.urlsafe_b64decode(keys[column]) for column in ENCRYPTED_COLUMNS
+    )
+
+
+def unpack_legacy_keys(packed: bytes) -> dict:
+    """Motsatt av pack_legacy_keys."""
+    return {
+        column: base64.urlsafe_b64encode(packed[number * 32 : (number + 1) * 32])
+        for number, column in enumerate(ENCRYPTED_COLUMNS)
+    }
+
+
+def verify_hash(computed_hash: str, stored_hash: str) -> bool:
+    """Sammenlign hasher i konstant tid."""
+    return hmac.compare_digest(computed_hash.encode(), stored_hash.encode())
+
+
+def pack_token(token) -> bytes:
+    """
+    Et kryptert felt som rå byte, slik BLOB-kolonnene lagrer det. Tekst fra
+    før kolonnene ble binære er urlsafe base64 og dekodes.
+    """
+    if isinstance(token, str):
+        return base64.urlsafe_b64decode(token)
+    return bytes(token)
+
+
+def _fernet_token(token) -> bytes:
+    # Fernet tar tokenet som base64, enten det er lagret som tekst eller rått
+    if isinstance(token, str):
+        return token.encode()
+    return base64.urlsafe_b64encode(token)
+
+
+def key_ring(key) -> MultiFernet:
+    """
+    MultiFernet for én nøkkel eller en liste med nøkler, nyeste først.
+    Krypterer med den første og prøver alle ved dekryptering.
+    """
+    keys = [key] if isinstance(key, (bytes, str)) else list(key)
+    return MultiFernet([Fernet(k) for k in keys])
+
+
+def encrypt_password(password: str, key) -> bytes:
+    """
+    Krypter passordet med den gitte nøkkelen, eller den første i en liste
+    med nøkler. Gir rå token-byte.
+    """
+    try:
+        f = key_ring(key)
+        encrypted = base64.urlsafe_b64decode(f.encrypt(password.encode()))
         return encrypted
     except Exception as e:
         raise e
 
 
-def decrypt_password(encrypted_password: str, key: bytes) -> str:
-    """Dekrypter passordet med den gitte nøkkelen."""
+def decrypt_password(encrypted_password, key) -> str:
+    """
+    Dekrypter passordet (rå byte eller base64-tekst) med den gitte nøkkelen,
+    eller med hvilken som helst nøkkel i en liste med nøkler.
+    """
     try:
-        f = Fernet(key)
-        decrypted = f.decrypt(encrypted_password.encode()).decode()
+        f = key_ring(key)
+        decrypted = f.decrypt(_fernet_token(encrypted_password)).decode()
         return decrypted
     except Exception as e:
         raise e
+
+
+def rotate_password(encrypted_password, keys) -> bytes:
+    """
+    Krypter et token på nytt med den første nøkkelen i keys, uten å endre
+    klarteksten. Tokenet kan være kryptert med hvilken som helst av dem.
+    """
+    token = key_ring(keys).rotate(_fernet_token(encrypted_password))
+    return base64.urlsafe_b64decode(token)
+
+
+class ColumnCipherSet:
+    """
+    Ett ferdig Fernet-objekt per kolonne, bygget én gang ved innlogging, og
+    AES-GCM-objektet for postformatet. Widgetene deler samme objekt, og
+    wipe() fjerner nøklene ved utlogging.
+
+    Med eldre nøkkelgenerasjoner (RETIRED_KEYS) er hver kolonne en
+    MultiFernet og postene prøves mot hver generasjon, nyeste først.
+    Det krypteres alltid med gjeldende generasjon.
+    """
+
+    def __init__(self, keys: dict):
+        self._ciphers = {}
+        self.rekey(keys)
+
+    def __bool__(self):
+        return bool(self._ciphers)
+
+    def rekey(self, keys: dict):
+        """Bytt til nye nøkler, f.eks. etter at nøkkelstyrken er justert."""
+        self._index_key = keys.get(BLIND_INDEX_KEY)
+        self._fingerprint_key = keys.get(FINGERPRINT_KEY)
+        snapshot_key = keys.get(SNAPSHOT_KEY)
+        self._snapshot_cipher = AESGCM(snapshot_key) if snapshot_key else None
+        self.generation = keys.get(KEY_GENERATION, 0)
+        retired = keys.get(RETIRED_KEYS, [])
+        legacy = keys.get(LEGACY_KEYS) or {}
+        record_key = keys.get(RECORD_KEY)
+        self._record_cipher = AESGCM(record_key) if record_key else None
+        # (generasjon, AES-GCM) for hver generasjon, nyeste først
+        self._record_ciphers = []
+        if record_key:
+            self._record_ciphers = [(self.generation, self._record_cipher)] + [
+                (self.generation - 1 - offset, AESGCM(older[RECORD_KEY]))
+                for offset, older in enumerate(retired)
+            ]
+        self._ciphers = {}
+        for column, key in keys.items():
+            if column in SUBKEYS or column in KEY_RING_ENTRIES:
+                continue
+            older_keys = [older[column] for older in retired]
+            if column in legacy:
+                older_keys.append(legacy[column])
+            self._ciphers[column] = (
+                MultiFernet([Fernet(key)] + [Fernet(k) for k in older_keys])
+                if older_keys
+                else Fernet(key)
+            )
+
+    def wipe(self):
+        self._ciphers = {}
+        self._index_key = None
+        self._fingerprint_key = None
+        self._record_cipher = None
+        self._record_ciphers = []
+        self._snapshot_cipher = None
+        self.generation = 0
+
+    @property
+    def has_blind_index(self):
+        return self._index_key is not None
+
+    @property
+    def has_fingerprint_key(self):
+        return self._fingerprint_key is not None
+
+    @property
+    def has_record_key(self):
+        return self._record_cipher is not None
+
+    @property
+    def has_snapshot_key(self):
+        return self._snapshot_cipher is not None
+
+    def blind_index(self, column: str, value: str):
+        """Blind-indeksen for verdien, eller None uten indeksnøkkel (gammelt skjema)."""
+        if self._index_key is None:
+            return None
+        return blind_index(self._index_key, column, value)
+
+    def blind_indexes(self, data: dict) -> dict:
+        """Blind-indeksene for feltene i data, med attributtnavn (f.eks. service_bidx)."""
+        return {
+            f"{column}_bidx": self.blind_index(column, data.get(column, ""))
+            for column in BLIND_INDEX_COLUMNS
+        }
+
+    def _cipher(self, column):
+        try:
+            return self._ciphers[column]
+        except KeyError:
+            raise ValueError(f"Ingen krypteringsnøkkel for kolonnen '{column}'.")
+
+    def fingerprint(self, data: dict):
+        """Fingeravtrykket til en oppføring, eller None uten nøkkel (gammelt skjema)."""
+        if self._fingerprint_key is None:
+            return None
+        return entry_fingerprint(
+            self._fingerprint_key,
+            [data.get(column, "") for column in IDENTITY_COLUMNS],
+        )
+
+    def derived_columns(self, data: dict) -> dict:
+        """Blind-indekser og fingeravtrykk for en oppføring, med attributtnavn."""
+        columns = self.blind_indexes(data)
+        columns["fingerprint"] = self.fingerprint(data)
+        return columns
+
+    def encrypt(self, column: str, value: str) -> bytes:
+        return base64.urlsafe_b64decode(self._cipher(column).encrypt(value.encode()))
+
+    def decrypt(self, column: str, token) -> str:
+        """
+        Dekrypter ett felt, lagret som rå byte eller base64-tekst. Tomme felt
+        (None, "" eller b"") gir tom streng.
+        """
+        if not token:
+            return ""
+        return self._cipher(column).decrypt(_fernet_token(token)).decode()
+
+    def encrypt_values(self, column: str, values) -> list:
+        cipher = self._cipher(column)
+        return [
+            base64.urlsafe_b64decode(cipher.encrypt(value.encode())) for value in values
+        ]
+
+    def decrypt_values(self, column: str, tokens) -> list:
+        cipher = self._cipher(column)
+        return [
+            cipher.decrypt(_fernet_token(token)).decode() if token else ""
+            for token in tokens
+        ]
+
+    def encrypt_fields(self, data: dict) -> dict:
+        """Krypter et sett med felt (kolonne -> klartekst)."""
+        return {column: self.encrypt(column, value) for column, value in data.items()}
+
+    def decrypt_fields(self, tokens: dict) -> dict:
+        """Dekrypter et sett med felt (kolonne -> token)."""
+        return {column: self.decrypt(column, token) for column, token in tokens.items()}
+
+    def encrypt_record(self, entry_id: int, data: dict) -> bytes:
+        """Krypter alle feltene i data (kolonne -> klartekst) til én post."""
+        if self._record_cipher is None:
+            raise ValueError("Nøkkelsettet mangler nøkkel for poster.")
+        nonce = os.urandom(RECORD_NONCE_SIZE)
+        ciphertext = self._record_cipher.encrypt(
+            nonce, encode_record_fields(data), record_associated_data(entry_id)
+        )
+        return bytes([RECORD_VERSION]) + nonce + ciphertext
+
+    def open_record(self, entry_id: int, record) -> tuple:
+        """
+        Som decrypt_record, men returnerer (felt, generasjon) med
+        nøkkelgenerasjonen posten var kryptert med.
+        """
+        if self._record_cipher is None:
+            raise ValueError("Nøkkelsettet mangler nøkkel for poster.")
+        raw = pack_token(record)
+        version = raw[0]
+        if version != RECORD_VERSION:
+            raise ValueError(f"Ukjent postversjon {version}.")
+        nonce = raw[1 : 1 + RECORD_NONCE_SIZE]
+        ciphertext = raw[1 + RECORD_NONCE_SIZE :]
+        associated_data = record_associated_data(entry_id, version)
+        for generation, cipher in self._record_ciphers:
+            try:
+                payload = cipher.decrypt(nonce, ciphertext, associated_data)
+            except InvalidTag:
+                continue
+            return decode_record_fields(payload), generation
+        raise InvalidTag()
+
+    def decrypt_record(self, entry_id: int, record) -> dict:
+        """
+        Alle feltene i posten (rå byte eller base64-tekst). Feiler
+        (InvalidTag) hvis posten er endret eller hører til en annen oppføring.
+        """
+        return self.open_record(entry_id, record)[0]
+
+    def encrypt_snapshot(self, user_id: int, vault_version: int, payload: bytes):
+        """Krypter et snapshot av brukerens hvelv ved hvelvversjonen vault_version."""
+        if self._snapshot_cipher is None:
+            raise ValueError("Nøkkelsettet mangler nøkkel for snapshot.")
+        nonce = os.urandom(RECORD_NONCE_SIZE)
+        ciphertext = self._snapshot_cipher.encrypt(
+            nonce, payload, snapshot_associated_data(user_id, vault_version)
+        )
+        return (
+            bytes([SNAPSHOT_FORMAT])
+            + vault_version.to_bytes(8, "big")
+            + nonce
+            + ciphertext
+        )
+
+    def decrypt_snapshot(self, user_id: int, blob: bytes) -> tuple:
+        """
+        (hvelvversjon, innhold) for et snapshot. Feiler (InvalidTag) hvis det
+        er endret, tilhører en annen bruker eller er laget med andre nøkler.
+        """
+        if self._snapshot_cipher is None:
+            raise ValueError("Nøkkelsettet mangler nøkkel for snapshot.")
+        vault_version = snapshot_version(blob)
+        if vault_version is None:
+            raise ValueError("Ukjent snapshotformat.")
+        nonce = blob[SNAPSHOT_HEADER_SIZE : SNAPSHOT_HEADER_SIZE + RECORD_NONCE_SIZE]
+        payload = self._snapshot_cipher.decrypt(
+            nonce,
+            blob[SNAPSHOT_HEADER_SIZE + RECORD_NONCE_SIZE :],
+            snapshot_associated_data(user_id, vault_version),
+        )
+        return vault_version, payload
+
+    def decrypt_entry(self, entry_id: int, record, tokens: dict) -> dict:
+        """
+        Dekrypter feltene i tokens (kolonne -> token) for én oppføring, fra
+        posten hvis den finnes og ellers fra ett Fernet-token per kolonne.
+        """
+        if record:
+            fields = self.decrypt_record(entry_id, record)
+            return {column: fields[column] for column in tokens}
+        return self.decrypt_fields(tokens)
+
+
+def _decrypt_chunk(ciphers, start, rows, columns):
+    values = []
+    errors = []
+    for offset, (entry_id, record, *tokens) in enumerate(rows):
+        try:
+            fields = ciphers.decrypt_entry(entry_id, record, dict(zip(columns, tokens)))
+            values.append(tuple(fields[column] for column in columns))
+        except Exception as e:
+            values.append(None)
+            errors.append((start + offset, e))
+    return values, errors
+
+
+def decrypt_many(
+    ciphers: ColumnCipherSet,
+    rows,
+    columns,
+    workers=None,
+    chunk_size=DECRYPT_CHUNK_SIZE,
+) -> DecryptResult:
+    """
+    Dekrypter mange rader på en gang. Hver rad er (id, post, tokens...) med
+    tokens i samme rekkefølge som columns; rader med post dekrypteres fra
+    den. Radene deles i biter som dekrypteres på en trådpool (AES i
+    cryptography slipper GIL). Rekkefølgen beholdes, og rader som ikke kan
+    dekrypteres stopper ikke resten.
+    """
+    rows = list(rows)
+    chunks = [
+        (start, rows[start : start + chunk_size])
+        for start in range(0, len(rows), chunk_size)
+    ]
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1 or len(chunks) <= 1:
+        results = [
+            _decrypt_chunk(ciphers, start, chunk, columns) for start, chunk in chunks
+        ]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            results = list(
+                executor.map(
+                    lambda chunk: _decrypt_chunk(ciphers, chunk[0], chunk[1], columns),
+                    chunks,
+                )
+            )
+
+    values = []
+    errors = []
+    for chunk_values, chunk_errors in results:
+        values.extend(chunk_values)
+        errors.extend(chunk_errors)
+    return DecryptResult(values, errors)
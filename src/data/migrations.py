@@ -0,0 +1,143 @@
+from .models import Base, RekeyState
+
+# Versjonerte skjemaendringer. Versjonen lagres i databasefilen med
+# PRAGMA user_version, så en database som er à jour koster én PRAGMA-lesing
+# ved oppstart. Nye endringer legges til nederst i MIGRATIONS med neste
+# nummer; gamle migreringer endres aldri.
+#
+# Nye tabeller lages av create_all i første migrering med dagens modeller,
+# så hver migrering må tåle at endringen allerede finnes (IF NOT EXISTS,
+# sjekk av table_info).
+
+
+def add_column(connection, table, column, ddl):
+    existing = {
+        row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table})")
+    }
+    if column not in existing:
+        connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def create_index(connection, name, table, columns):
+    connection.exec_driver_sql(
+        f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"
+    )
+
+
+def baseline(connection):
+    # Tabellene, og kolonner og indekser som kom før skjemaet fikk versjon.
+    # create_all legger ikke til kolonner i eksisterende tabeller.
+    Base.metadata.create_all(connection)
+    add_column(connection, "users", "key_scheme", "INTEGER NOT NULL DEFAULT 1")
+    add_column(connection, "users", "kdf_iterations", "INTEGER NOT NULL DEFAULT 100000")
+    add_column(connection, "passwords", "service_bidx", "VARCHAR")
+    add_column(connection, "passwords", "email_bidx", "VARCHAR")
+    add_column(connection, "passwords", "tag_bidx", "VARCHAR")
+    add_column(connection, "passwords", "fingerprint", "VARCHAR")
+    add_column(connection, "settings", "db_profile", "VARCHAR DEFAULT 'desktop'")
+    create_index(
+        connection,
+        "ix_passwords_user_service_bidx",
+        "passwords",
+        "user_id, service_bidx",
+    )
+    create_index(
+        connection, "ix_passwords_user_email_bidx", "passwords", "user_id, email_bidx"
+    )
+    create_index(
+        connection, "ix_passwords_user_tag_bidx", "passwords", "user_id, tag_bidx"
+    )
+    create_index(
+        connection, "ix_passwords_user_fingerprint", "passwords", "user_id, fingerprint"
+    )
+
+
+def index_passwords_user_id(connection):
+    # Lasting, telling, backup og eksport filtrerer på user_id. Et eget smalt
+    # indeks gir også radene sortert på id for hver bruker.
+    create_index(connection, "ix_passwords_user_id", "passwords", "user_id")
+
+
+def add_password_records(connection):
+    # Postformatet (én AES-GCM-post per oppføring). Eksisterende rader gjøres
+    # om i bakgrunnen av data.records, ikke her.
+    add_column(connection, "passwords", "record", "VARCHAR")
+
+
+def add_rekey_state(connection):
+    # Fremdriften til et passordbytte, så det kan fortsette etter et avbrudd
+    RekeyState.__table__.create(connection, checkfirst=True)
+
+
+def add_key_generations(connection):
+    # Nøkkelrotasjon. Alle eksisterende rader er kryptert med generasjon 0.
+    add_column(connection, "users", "key_generation", "INTEGER NOT NULL DEFAULT 0")
+    add_column(connection, "passwords", "key_generation", "INTEGER NOT NULL DEFAULT 0")
+    create_index(
+        connection,
+        "ix_passwords_user_key_generation",
+        "passwords",
+        "user_id, key_generation",
+    )
+
+
+def add_vault_version(connection):
+    # Endringsteller for snapshot av listen (data.snapshot)
+    add_column(connection, "users", "vault_version", "INTEGER NOT NULL DEFAULT 0")
+
+
+def add_legacy_keys(connection):
+    # Nøklene fra gammelt skjema for oppgraderte brukere, så eldre backuper
+    # kan gjenopprettes
+    add_column(connection, "users", "legacy_keys", "BLOB")
+    add_column(connection, "rekey_state", "legacy_keys", "BLOB")
+
+
+def add_oldest_key_generation(connection):
+    # Nøkkelringen tar bare med generasjonene som fortsatt har rader. Alle
+    # eksisterende brukere kan ha rader fra generasjon 0.
+    add_column(
+        connection, "users", "oldest_key_generation", "INTEGER NOT NULL DEFAULT 0"
+    )
+
+
+MIGRATIONS = [
+    (1, baseline),
+    (2, index_passwords_user_id),
+    (3, add_password_records),
+    (4, add_rekey_state),
+    (5, add_key_generations),
+    (6, add_vault_version),
+    (7, add_legacy_keys),
+    (8, add_oldest_key_generation),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(connection):
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def migrate(engine) -> int:
+    """Kjør migreringene databasen mangler og returner skjemaversjonen."""
+    with engine.connect() as connection:
+        version = get_schema_version(connection)
+        if version >= SCHEMA_VERSION:
+            return version
+
+        # pysqlite starter ikke selv en transaksjon før DDL. BEGIN IMMEDIATE
+        # gjør alle migreringene atomiske og holder andre skrivere ute.
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            # En annen prosess kan ha migrert mens vi ventet på låsen
+            version = get_schema_version(connection)
+            for number, migration in MIGRATIONS:
+                if number > version:
+                    migration(connection)
+                    connection.exec_driver_sql(f"PRAGMA user_version = {number}")
+                    version = number
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+    return version
@@ -1,9 +1,27 @@
-from sqlalchemy import Column, DateTime, Integer, String, ForeignKey
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    LargeBinary,
+    String,
+    ForeignKey,
+    Index,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
+# Kobler nøkkelnavnene fra data.encryption til attributtene på PasswordEntry
+ENCRYPTED_ATTRIBUTES = {
+    "service": "service",
+    "email": "email",
+    "username": "username",
+    "password": "encrypted_password",
+    "link": "link",
+    "tag": "tag",
+}
+
 
 class User(Base):
     __tablename__ = "users"
@@ -15,10 +33,31 @@ class User(Base):
     failed_attempts = Column(Integer, default=0)
     last_failed_attempt = Column(DateTime, default=None)
     lockout_until = Column(DateTime, default=None)
+    # Nøkkelskjema (se data.encryption). Eksisterende brukere får 1 og
+    # oppgraderes til 2 ved neste vellykkede innlogging.
+    key_scheme = Column(Integer, nullable=False, default=2, server_default="1")
+    # PBKDF2-iterasjoner for denne brukeren, kalibrert ved registrering
+    kdf_iterations = Column(
+        Integer, nullable=False, default=100000, server_default="100000"
+    )
+    # Gjeldende generasjon av krypteringsnøklene, se data.encryption.KEY_GENERATION
+    key_generation = Column(Integer, nullable=False, default=0, server_default="0")
+    # Den eldste generasjonen brukerens rader fortsatt er kryptert med. Bare
+    # generasjonene fra denne og opp utledes, se data.records.migrate_records.
+    oldest_key_generation = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+    # Kolonnenøklene fra gammelt skjema, kryptert under rotnøkkelen (wrap_key),
+    # for brukere som er oppgradert til skjema 2. Se LoginManager.user_keys.
+    legacy_keys = Column(LargeBinary)
+    # Øker for hver endring av brukerens oppføringer, se data.snapshot
+    vault_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Relasjon til Settings og PasswordEntry
     settings = relationship("Settings", back_populates="user", uselist=False)
     passwords = relationship("PasswordEntry", back_populates="user")
+    # Passordbytte som pågår eller ble avbrutt, se data.rekey
+    rekey_state = relationship("RekeyState", uselist=False)
 
 
 class Settings(Base):
@@ -28,6 +67,8 @@ class Settings(Base):
     user_id = Column(Integer, ForeignKey("users.id"), unique=True)
     theme = Column(String, default="default")
     font_size = Column(Integer, default=16)
+    # Tilkoblingsprofil for SQLite, se data.database.CONNECTION_PROFILES
+    db_profile = Column(String, default="desktop")
 
     # Relasjon til User
     user = relationship("User", back_populates="settings")
@@ -36,16 +77,68 @@ class Settings(Base):
 class PasswordEntry(Base):
     __tablename__ = "passwords"
 
+    # De krypterte kolonnene holder rå byte. Rader fra før kolonnene ble
+    # binære kan fortsatt ha base64-tekst (SQLite lagrer verdien med sin egen
+    # type), som leserne i data.encryption tåler og data.records gjør om.
     id = Column(Integer, primary_key=True)
-    service = Column(String, nullable=False)
-    email = Column(String, nullable=False)
-    username = Column(String)
-    encrypted_password = Column(String, nullable=False)
-    link = Column(String)
-    tag = Column(String)
+    service = Column(LargeBinary, nullable=False)
+    email = Column(LargeBinary, nullable=False)
+    username = Column(LargeBinary)
+    encrypted_password = Column(LargeBinary, nullable=False)
+    link = Column(LargeBinary)
+    tag = Column(LargeBinary)
+
+    # Alle feltene kryptert samlet som én post (se ColumnCipherSet.encrypt_record).
+    # Rader med post har tomme verdier i de seks kolonnene over; rader uten
+    # post er i det gamle formatet med ett Fernet-token per kolonne.
+    record = Column(LargeBinary)
+
+    # Blind-indekser (nøklet HMAC av normalisert klartekst) for eksakte oppslag
+    # i SQL uten dekryptering. Se data.encryption.blind_index.
+    service_bidx = Column(String)
+    email_bidx = Column(String)
+    tag_bidx = Column(String)
+
+    # Nøklet fingeravtrykk av identitetsfeltene, brukt til synkronisering
+    fingerprint = Column(String)
+
+    # Nøkkelgenerasjonen raden er kryptert med. Rader med lavere generasjon
+    # enn brukerens krypteres om etter en nøkkelrotasjon (data.records).
+    key_generation = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Fremmednøkkel til User
     user_id = Column(Integer, ForeignKey("users.id"))
 
     # Relasjon til User
     user = relationship("User", back_populates="passwords")
+
+    __table_args__ = (
+        Index("ix_passwords_user_id", "user_id"),
+        Index("ix_passwords_user_service_bidx", "user_id", "service_bidx"),
+        Index("ix_passwords_user_email_bidx", "user_id", "email_bidx"),
+        Index("ix_passwords_user_tag_bidx", "user_id", "tag_bidx"),
+        Index("ix_passwords_user_fingerprint", "user_id", "fingerprint"),
+        Index("ix_passwords_user_key_generation", "user_id", "key_generation"),
+    )
+
+
+class RekeyState(Base):
+    """
+    Et passordbytte som pågår for en bruker (se data.rekey.VaultRekey).
+    Oppføringer med id opp til og med checkpoint er kryptert med de nye
+    nøklene, resten med de gamle. Hver rotnøkkel ligger kryptert under den
+    andre, så hvelvet kan gjenopprettes med både gammelt og nytt passord.
+    """
+
+    __tablename__ = "rekey_state"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    # Verdiene users får når byttet er fullført
+    salt = Column(String, nullable=False)
+    password_hash = Column(String, nullable=False)
+    kdf_iterations = Column(Integer, nullable=False)
+    legacy_keys = Column(LargeBinary)
+    # Gammel rotnøkkel kryptert med den nye, og omvendt (se wrap_key)
+    old_root = Column(LargeBinary, nullable=False)
+    new_root = Column(LargeBinary, nullable=False)
+    checkpoint = Column(Integer, nullable=False, default=0)
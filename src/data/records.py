@@ -0,0 +1,212 @@
+import binascii
+from collections import namedtuple
+
+from sqlalchemy import bindparam, func, or_, select, update
+
+from .encryption import decrypt_many, pack_token
+from .models import ENCRYPTED_ATTRIBUTES, PasswordEntry, User
+from .repository import encrypt_entry
+
+# Antall rader som leses og skrives om per transaksjon
+RECORD_BATCH_SIZE = 200
+
+# Kolonnene som holder chiffertekst, se PasswordEntry
+CIPHERTEXT_COLUMNS = tuple(ENCRYPTED_ATTRIBUTES.values()) + ("record",)
+
+# done: rader som er poster med gjeldende nøkkelgenerasjon, total: alle radene
+RecordProgress = namedtuple("RecordProgress", ["done", "total"])
+
+
+def _outdated(table, generation):
+    # Rader i det gamle formatet, eller kryptert med en eldre nøkkelgenerasjon
+    return or_(table.c.record.is_(None), table.c.key_generation < generation)
+
+
+def pending_record_count(engine, user_id, generation=0) -> int:
+    """
+    Antall av brukerens oppføringer som fortsatt er i det gamle formatet,
+    eller kryptert med en eldre nøkkelgenerasjon enn generation.
+    """
+    table = PasswordEntry.__table__
+    statement = (
+        select(func.count())
+        .select_from(table)
+        .where(table.c.user_id == user_id, _outdated(table, generation))
+    )
+    with engine.connect() as connection:
+        return connection.execute(statement).scalar()
+
+
+def record_progress(engine, user_id, generation=0) -> RecordProgress:
+    """Hvor langt migrate_records har kommet, f.eks. etter en nøkkelrotasjon."""
+    table = PasswordEntry.__table__
+    statement = select(
+        func.count().filter(~_outdated(table, generation)), func.count()
+    ).where(table.c.user_id == user_id)
+    with engine.connect() as connection:
+        done, total = connection.execute(statement).one()
+    return RecordProgress(done, total)
+
+
+def update_oldest_generation(connection, user_id, generation):
+    """
+    Lagre den eldste nøkkelgenerasjonen brukerens rader er kryptert med i
+    users.oldest_key_generation, eller generation uten rader. Eldre
+    generasjoner utledes ikke lenger ved innlogging. MIN slås opp i
+    indeksen på passwords(user_id, key_generation).
+    """
+    table = PasswordEntry.__table__
+    users = User.__table__
+    oldest = (
+        select(func.min(table.c.key_generation))
+        .where(table.c.user_id == user_id)
+        .scalar_subquery()
+    )
+    connection.execute(
+        update(users)
+        .where(users.c.id == user_id)
+        .values(oldest_key_generation=func.coalesce(oldest, generation))
+    )
+
+
+def migrate_records(
+    engine, user_id, ciphers, batch_size=RECORD_BATCH_SIZE, should_stop=None
+) -> int:
+    """
+    Gjør om brukerens oppføringer fra ett Fernet-token per kolonne til én
+    post per oppføring, og krypter poster fra eldre nøkkelgenerasjoner med
+    gjeldende generasjon. Returnerer antall rader som ble gjort om.
+
+    Radene tas i biter sortert på id. Hver bit leses uten skrivelås og
+    skrives i en egen kort transaksjon, så appen kan brukes imens. Arbeidet
+    kan stoppes med should_stop() og fortsetter der det slapp neste gang.
+    Rader som ikke kan dekrypteres blir stående som de er. Til slutt lagres
+    den eldste generasjonen som fortsatt har rader (update_oldest_generation).
+    """
+    if not ciphers.has_record_key:
+        return 0
+
+    table = PasswordEntry.__table__
+    columns = tuple(ENCRYPTED_ATTRIBUTES)
+    select_rows = (
+        select(
+            table.c.id,
+            table.c.record,
+            *[table.c[attribute] for attribute in ENCRYPTED_ATTRIBUTES.values()],
+        )
+        .where(table.c.user_id == user_id, _outdated(table, ciphers.generation))
+        .order_by(table.c.id)
+        .limit(batch_size)
+    )
+    # En rad som er lagret på nytt etter at den ble lest, er allerede à jour
+    update_rows = update(table).where(
+        table.c.id == bindparam("entry_id"), _outdated(table, ciphers.generation)
+    )
+
+    converted = 0
+    after_id = 0
+    while should_stop is None or not should_stop():
+        with engine.connect() as connection:
+            rows = connection.execute(select_rows.where(table.c.id > after_id)).all()
+        if not rows:
+            break
+        after_id = rows[-1].id
+
+        result = decrypt_many(ciphers, rows, columns)
+        parameters = []
+        for row, values in zip(rows, result.values):
+            if values is None:
+                continue
+            attributes = encrypt_entry(ciphers, row.id, dict(zip(columns, values)))
+            attributes["entry_id"] = row.id
+            parameters.append(attributes)
+        if parameters:
+            with engine.begin() as connection:
+                converted += connection.execute(update_rows, parameters).rowcount
+    with engine.begin() as connection:
+        update_oldest_generation(connection, user_id, ciphers.generation)
+    return converted
+
+
+def pending_text_count(engine) -> int:
+    """Antall rader med chiffertekst som fortsatt er lagret som base64-tekst."""
+    table = PasswordEntry.__table__
+    statement = (
+        select(func.count())
+        .select_from(table)
+        .where(
+            or_(*[func.typeof(table.c[name]) == "text" for name in CIPHERTEXT_COLUMNS])
+        )
+    )
+    with engine.connect() as connection:
+        return connection.execute(statement).scalar()
+
+
+def _pack_text(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        return pack_token(value)
+    except (ValueError, binascii.Error):
+        # Tekst som ikke er base64 kan uansett ikke dekrypteres. Den lagres
+        # som UTF-8 så raden ikke stopper resten.
+        return value.encode()
+
+
+def pack_text_columns(engine, batch_size=RECORD_BATCH_SIZE, should_stop=None) -> int:
+    """
+    Gjør om chiffertekst lagret som base64-tekst til rå byte i alle rader,
+    og returner antall rader som ble endret. Trenger ingen nøkler, så det
+    gjelder også andre brukeres oppføringer. Hver bit leses og skrives i én
+    kort transaksjon, så en rad som lagres på nytt imens ikke overskrives.
+    """
+    table = PasswordEntry.__table__
+    columns = [table.c[name] for name in CIPHERTEXT_COLUMNS]
+    select_rows = (
+        select(table.c.id, *columns)
+        .where(or_(*[func.typeof(column) == "text" for column in columns]))
+        .order_by(table.c.id)
+        .limit(batch_size)
+    )
+    update_rows = update(table).where(table.c.id == bindparam("entry_id"))
+
+    packed = 0
+    after_id = 0
+    while should_stop is None or not should_stop():
+        with engine.connect() as connection:
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            try:
+                rows = connection.execute(
+                    select_rows.where(table.c.id > after_id)
+                ).all()
+                parameters = []
+                for row in rows:
+                    values = {
+                        name: _pack_text(value)
+                        for name, value in zip(CIPHERTEXT_COLUMNS, row[1:])
+                    }
+                    values["entry_id"] = row.id
+                    parameters.append(values)
+                if parameters:
+                    connection.execute(update_rows, parameters)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+        if not rows:
+            break
+        after_id = rows[-1].id
+        packed += len(rows)
+    return packed
+
+
+def upgrade_entries(
+    engine, user_id, ciphers, batch_size=RECORD_BATCH_SIZE, should_stop=None
+) -> int:
+    """
+    Bakgrunnsarbeidet etter innlogging og nøkkelrotasjon: brukerens gamle
+    rader gjøres om til poster med gjeldende nøkler, og gjenværende tekst i
+    tabellen til rå byte. Returnerer antall rader som ble endret.
+    """
+    converted = migrate_records(engine, user_id, ciphers, batch_size, should_stop)
+    return converted + pack_text_columns(engine, batch_size, should_stop)
@@ -0,0 +1,201 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from sqlalchemy import bindparam, delete, func, select, update
+
+from .encryption import ColumnCipherSet
+from .models import ENCRYPTED_ATTRIBUTES, PasswordEntry, RekeyState, User
+from .repository import encrypt_entry
+
+# Antall rader som krypteres på nytt og skrives per transaksjon
+REKEY_BATCH_SIZE = 500
+
+# done: antall rader som er kryptert med de nye nøklene, total: alle radene
+RekeyProgress = namedtuple("RekeyProgress", ["done", "total"])
+
+# Verdiene som flyttes fra rekey_state til users når byttet er fullført
+CREDENTIAL_COLUMNS = ("salt", "password_hash", "kdf_iterations", "legacy_keys")
+
+
+def rekey_label(user_id) -> str:
+    """Label for wrap_key/unwrap_key av rotnøklene i rekey_state."""
+    return f"rekey/{user_id}"
+
+
+def _reencrypt_chunk(source, target, rows):
+    parameters = []
+    skipped = 0
+    for row in rows:
+        tokens = {
+            column: getattr(row, attribute)
+            for column, attribute in ENCRYPTED_ATTRIBUTES.items()
+        }
+        try:
+            plaintext = source.decrypt_entry(row.id, row.record, tokens)
+        except Exception:
+            # En ødelagt rad kan ikke krypteres på nytt, men stopper ikke resten
+            skipped += 1
+            continue
+        attributes = encrypt_entry(target, row.id, plaintext)
+        attributes["entry_id"] = row.id
+        parameters.append(attributes)
+    return parameters, skipped
+
+
+class VaultRekey:
+    """
+    Krypterer én brukers oppføringer på nytt med nye nøkler, i biter.
+
+    Fremdriften ligger i rekey_state: rader med id opp til og med checkpoint
+    er kryptert med de nye nøklene, resten med de gamle. Hver bit krypteres
+    på en trådpool og skrives i én transaksjon sammen med nytt checkpoint,
+    så et avbrudd aldri etterlater rader ingen av nøkkelsettene kan lese.
+    run() går fremover og flytter til slutt det nye saltet og verifikatoren
+    til brukeren; rollback() går bakover og fjerner tilstanden. Minnet er
+    begrenset av batch_size.
+    """
+
+    def __init__(
+        self,
+        database,
+        user_id,
+        old_keys,
+        new_keys,
+        batch_size=REKEY_BATCH_SIZE,
+        workers=None,
+    ):
+        self.database = database
+        self.user_id = user_id
+        self.old_keys = old_keys
+        self.new_keys = new_keys
+        self.old_ciphers = ColumnCipherSet(old_keys)
+        self.new_ciphers = ColumnCipherSet(new_keys)
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 1
+        # Rader som ikke kunne dekrypteres og ble stående som de var
+        self.skipped = 0
+        # Verdiene brukeren fikk i users da byttet ble fullført
+        self.credentials = None
+
+    def progress(self) -> RekeyProgress:
+        table = PasswordEntry.__table__
+        state = RekeyState.__table__
+        checkpoint = (
+            select(state.c.checkpoint)
+            .where(state.c.user_id == self.user_id)
+            .scalar_subquery()
+        )
+        statement = select(
+            func.count().filter(table.c.id <= checkpoint), func.count()
+        ).where(table.c.user_id == self.user_id)
+        with self.database.engine.connect() as connection:
+            done, total = connection.execute(statement).one()
+        return RekeyProgress(done, total)
+
+    def run(self, should_stop=None, on_progress=None) -> bool:
+        """
+        Krypter resten av radene med de nye nøklene og fullfør byttet.
+        Returnerer False hvis should_stop() stoppet arbeidet først.
+        """
+        return self._walk(True, should_stop, on_progress)
+
+    def rollback(self, should_stop=None, on_progress=None) -> bool:
+        """Krypter radene som er byttet med de gamle nøklene igjen og avbryt byttet."""
+        return self._walk(False, should_stop, on_progress)
+
+    def _walk(self, forward, should_stop, on_progress):
+        done, total = self.progress()
+        with ThreadPoolExecutor(
+            max_workers=self.workers
+        ) as executor, self.database.engine.connect() as connection:
+            while should_stop is None or not should_stop():
+                count = self._step(connection, executor, forward)
+                if count is None:
+                    return True
+                done += count if forward else -count
+                if on_progress is not None:
+                    on_progress(RekeyProgress(done, total))
+        return False
+
+    def _step(self, connection, executor, forward):
+        """Én bit i én transaksjon. Returnerer antall rader, eller None når alt er gjort."""
+        table = PasswordEntry.__table__
+        state = RekeyState.__table__
+        # pysqlite starter ikke transaksjonen før første skriving. BEGIN
+        # IMMEDIATE holder checkpoint og radene uendret mens biten skrives.
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            checkpoint = connection.execute(
+                select(state.c.checkpoint).where(state.c.user_id == self.user_id)
+            ).scalar()
+            if checkpoint is None:
+                raise ValueError("Ingen passordbytte pågår for brukeren.")
+
+            statement = select(
+                table.c.id,
+                table.c.record,
+                *[table.c[attribute] for attribute in ENCRYPTED_ATTRIBUTES.values()],
+            ).where(table.c.user_id == self.user_id)
+            if forward:
+                statement = statement.where(table.c.id > checkpoint).order_by(
+                    table.c.id
+                )
+            else:
+                statement = statement.where(table.c.id <= checkpoint).order_by(
+                    table.c.id.desc()
+                )
+            rows = connection.execute(statement.limit(self.batch_size)).all()
+
+            if not rows:
+                self._finish(connection, forward)
+                connection.commit()
+                return None
+
+            source, target = (self.old_ciphers, self.new_ciphers)
+            if not forward:
+                source, target = target, source
+            chunk_size = -(-len(rows) // self.workers)
+            chunks = [
+                rows[start : start + chunk_size]
+                for start in range(0, len(rows), chunk_size)
+            ]
+            parameters = []
+            for chunk_parameters, skipped in executor.map(
+                lambda chunk: _reencrypt_chunk(source, target, chunk), chunks
+            ):
+                parameters.extend(chunk_parameters)
+                self.skipped += skipped
+            if parameters:
+                connection.execute(
+                    update(table).where(table.c.id == bindparam("entry_id")),
+                    parameters,
+                )
+
+            checkpoint = rows[-1].id if forward else rows[-1].id - 1
+            connection.execute(
+                update(state)
+                .where(state.c.user_id == self.user_id)
+                .values(checkpoint=checkpoint)
+            )
+            connection.commit()
+            return len(rows)
+        except Exception:
+            connection.rollback()
+            raise
+
+    def _finish(self, connection, forward):
+        state = RekeyState.__table__
+        if forward:
+            row = connection.execute(
+                select(*[state.c[name] for name in CREDENTIAL_COLUMNS]).where(
+                    state.c.user_id == self.user_id
+                )
+            ).one()
+            self.credentials = dict(zip(CREDENTIAL_COLUMNS, row))
+            connection.execute(
+                update(User.__table__)
+                .where(User.__table__.c.id == self.user_id)
+                .values(**self.credentials)
+            )
+        connection.execute(delete(state).where(state.c.user_id == self.user_id))
@@ -0,0 +1,273 @@
+from collections import namedtuple
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload, selectinload
+
+from .models import ENCRYPTED_ATTRIBUTES, PasswordEntry, Settings, User
+
+# Kolonnene tabellen i visningen trenger, i rekkefølgen modellen bruker
+LISTING_ATTRIBUTES = ("service", "email", "username", "link", "tag")
+
+# Antall rader per side når listen lastes etter hvert, se fetch_page
+PAGE_SIZE = 200
+
+# Lette rader for lesing, uten ORM-objekter og endringssporing. Feltene er
+# kolonnenavn i passwords: id, posten og de krypterte kolonnene i samme
+# rekkefølge som ENCRYPTED_ATTRIBUTES. Se ColumnCipherSet.decrypt_entry.
+ListingRow = namedtuple("ListingRow", ("id", "record") + LISTING_ATTRIBUTES)
+EntryRow = namedtuple(
+    "EntryRow", ("id", "record") + tuple(ENCRYPTED_ATTRIBUTES.values())
+)
+
+
+def encrypt_entry(ciphers, entry_id, data) -> dict:
+    """
+    Attributtene som lagrer klartekstfeltene i data på oppføringen entry_id,
+    med blind-indekser, fingeravtrykk og nøkkelgenerasjon. Med postnøkkel
+    krypteres alt som én post og de gamle kolonnene tømmes, ellers får hver
+    kolonne sitt token.
+    """
+    if ciphers.has_record_key:
+        attributes = dict.fromkeys(ENCRYPTED_ATTRIBUTES.values(), b"")
+        attributes["record"] = ciphers.encrypt_record(entry_id, data)
+    else:
+        attributes = {
+            ENCRYPTED_ATTRIBUTES[column]: token
+            for column, token in ciphers.encrypt_fields(data).items()
+        }
+        attributes["record"] = None
+    attributes.update(ciphers.derived_columns(data))
+    attributes["key_generation"] = ciphers.generation
+    return attributes
+
+
+def bump_vault_version(connection, user_id) -> int:
+    """
+    Øk brukerens hvelvversjon og returner den nye. Kalles i samme transaksjon
+    som endringen av oppføringene, så et snapshot aldri ser ut som gyldig
+    for et hvelv det ikke stemmer med. Tar en Connection eller Session.
+    """
+    table = User.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == user_id)
+        .values(vault_version=table.c.vault_version + 1)
+        .returning(table.c.vault_version)
+    )
+    return connection.execute(statement).scalar()
+
+
+def find_entries(session, user_id, ciphers, service=None, email=None, tag=None):
+    """
+    Finn brukerens oppføringer med eksakt tjeneste, e-post og/eller emne.
+    Oppslaget går mot blind-indeksene i databasen, ingenting dekrypteres.
+    Sammenligningen ignorerer store/små bokstaver og mellomrom i endene.
+    """
+    if not ciphers.has_blind_index:
+        raise ValueError("Nøkkelsettet mangler nøkkel for blind-indekser.")
+
+    query = session.query(PasswordEntry).filter(PasswordEntry.user_id == user_id)
+    for column, value in (("service", service), ("email", email), ("tag", tag)):
+        if value is not None:
+            attribute = getattr(PasswordEntry, f"{column}_bidx")
+            query = query.filter(attribute == ciphers.blind_index(column, value))
+    return query.all()
+
+
+def load_user(session, **criteria):
+    """
+    Hent en bruker med innstillingene lastet i samme omgang, og et eventuelt
+    avbrutt passordbytte i samme spørring som brukeren.
+    """
+    return (
+        session.query(User)
+        .options(selectinload(User.settings), joinedload(User.rekey_state))
+        .filter_by(**criteria)
+        .first()
+    )
+
+
+def save_user_settings(database, user_id, **values) -> Settings:
+    """Lagre brukerens innstillinger og returner dem frakoblet sesjonen."""
+    with database.session_scope() as session:
+        settings = session.query(Settings).filter_by(user_id=user_id).first()
+        if settings is None:
+            settings = Settings(user_id=user_id)
+            session.add(settings)
+        for name, value in values.items():
+            setattr(settings, name, value)
+    return settings
+
+
+class PasswordRepository:
+    """
+    Dataaksess for én brukers oppføringer. Hver metode er én arbeidsoperasjon
+    med en egen kort sesjon og returnerer verdier eller frakoblede objekter,
+    så identitetskartet ikke vokser med alt som er lest siden innlogging.
+    """
+
+    def __init__(self, database, user_id):
+        self.database = database
+        self.user_id = user_id
+
+    def count(self) -> int:
+        with self.database.session_scope() as session:
+            return (
+                session.query(PasswordEntry.id).filter_by(user_id=self.user_id).count()
+            )
+
+    def _select_rows(self, include_password):
+        row_type = EntryRow if include_password else ListingRow
+        table = PasswordEntry.__table__
+        statement = (
+            select(*[table.c[name] for name in row_type._fields])
+            .where(table.c.user_id == self.user_id)
+            .order_by(table.c.id)
+        )
+        return row_type, statement
+
+    def fetch_rows(self, include_password=False) -> list:
+        """
+        Brukerens oppføringer som kompakte rader fra en Core-select, sortert på
+        id. Uten include_password får man ListingRow, som tabellen trenger,
+        ellers EntryRow med alle krypterte felt.
+        """
+        row_type, statement = self._select_rows(include_password)
+        with self.database.engine.connect() as connection:
+            return [row_type._make(row) for row in connection.execute(statement)]
+
+    def fetch_page(self, after_id=0, limit=PAGE_SIZE, include_password=False) -> list:
+        """
+        Opptil limit rader med id større enn after_id, som fetch_rows. Keyset-
+        paginering over indeksen på passwords(user_id): hver side koster det
+        samme uansett hvor langt ut i hvelvet den ligger.
+        """
+        row_type, statement = self._select_rows(include_password)
+        statement = statement.where(PasswordEntry.__table__.c.id > after_id).limit(
+            limit
+        )
+        with self.database.engine.connect() as connection:
+            return [row_type._make(row) for row in connection.execute(statement)]
+
+    def fetch_row(self, entry_id, include_password=False):
+        """Én rad som fetch_rows, eller None om oppføringen ikke finnes."""
+        row_type, statement = self._select_rows(include_password)
+        statement = statement.where(PasswordEntry.__table__.c.id == entry_id)
+        with self.database.engine.connect() as connection:
+            row = connection.execute(statement).first()
+        return row_type._make(row) if row is not None else None
+
+    def get(self, entry_id):
+        with self.database.session_scope() as session:
+            return (
+                session.query(PasswordEntry)
+                .filter_by(id=entry_id, user_id=self.user_id)
+                .first()
+            )
+
+    def get_fields(self, ciphers, entry_id):
+        """Alle feltene til oppføringen dekryptert (kolonne -> klartekst), eller None."""
+        row = self.fetch_row(entry_id, include_password=True)
+        if row is None:
+            return None
+        tokens = {
+            column: getattr(row, attribute)
+            for column, attribute in ENCRYPTED_ATTRIBUTES.items()
+        }
+        return self._read_entry(ciphers, row.id, row.record, tokens)
+
+    def get_password(self, ciphers, entry_id):
+        """Det dekrypterte passordet, eller None om oppføringen ikke finnes."""
+        table = PasswordEntry.__table__
+        statement = select(table.c.record, table.c.encrypted_password).where(
+            table.c.id == entry_id, table.c.user_id == self.user_id
+        )
+        with self.database.engine.connect() as connection:
+            row = connection.execute(statement).first()
+        if row is None:
+            return None
+        tokens = {"password": row.encrypted_password}
+        return self._read_entry(ciphers, entry_id, row.record, tokens)["password"]
+
+    def _read_entry(self, ciphers, entry_id, record, tokens) -> dict:
+        """
+        decrypt_entry for én oppføring. En post kryptert med en eldre
+        nøkkelgenerasjon krypteres samtidig om med gjeldende, så rader som
+        leses blir rotert før bakgrunnsjobben kommer til dem.
+        """
+        if not record:
+            return ciphers.decrypt_entry(entry_id, record, tokens)
+        fields, generation = ciphers.open_record(entry_id, record)
+        if generation < ciphers.generation:
+            self._rotate(ciphers, entry_id, fields)
+        return {column: fields[column] for column in tokens}
+
+    def _rotate(self, ciphers, entry_id, fields):
+        table = PasswordEntry.__table__
+        # Raden kan ha blitt lagret med nye nøkler etter at den ble lest
+        statement = (
+            update(table)
+            .where(
+                table.c.id == entry_id,
+                table.c.user_id == self.user_id,
+                table.c.key_generation < ciphers.generation,
+            )
+            .values(**encrypt_entry(ciphers, entry_id, fields))
+        )
+        try:
+            with self.database.engine.begin() as connection:
+                connection.execute(statement)
+        except SQLAlchemyError:
+            # Lesingen skal ikke feile fordi skrivingen gjorde det (f.eks. en
+            # låst database); bakgrunnsjobben tar raden senere
+            pass
+
+    def find(self, ciphers, service=None, email=None, tag=None) -> list:
+        """Id-ene til oppføringene find_entries finner."""
+        with self.database.session_scope() as session:
+            entries = find_entries(
+                session, self.user_id, ciphers, service=service, email=email, tag=tag
+            )
+            return [entry.id for entry in entries]
+
+    def add(self, ciphers, data) -> int:
+        """
+        Lagre en ny oppføring med klartekstfeltene i data og returner id-en.
+        Posten bindes til id-en, så den krypteres etter at raden er satt inn.
+        """
+        with self.database.session_scope() as session:
+            entry = PasswordEntry(
+                user_id=self.user_id,
+                **dict.fromkeys(ENCRYPTED_ATTRIBUTES.values(), b""),
+            )
+            session.add(entry)
+            session.flush()
+            for name, value in encrypt_entry(ciphers, entry.id, data).items():
+                setattr(entry, name, value)
+            session.flush()
+            bump_vault_version(session, self.user_id)
+            return entry.id
+
+    def update(self, ciphers, entry_id, data) -> bool:
+        attributes = encrypt_entry(ciphers, entry_id, data)
+        with self.database.session_scope() as session:
+            updated = (
+                session.query(PasswordEntry)
+                .filter_by(id=entry_id, user_id=self.user_id)
+                .update(attributes, synchronize_session=False)
+            )
+            if updated:
+                bump_vault_version(session, self.user_id)
+        return bool(updated)
+
+    def delete(self, entry_id) -> bool:
+        with self.database.session_scope() as session:
+            deleted = (
+                session.query(PasswordEntry)
+                .filter_by(id=entry_id, user_id=self.user_id)
+                .delete(synchronize_session=False)
+            )
+            if deleted:
+                bump_vault_version(session, self.user_id)
+        return bool(deleted)
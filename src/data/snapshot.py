@@ -0,0 +1,194 @@
+import json
+import os
+import tempfile
+
+from sqlalchemy import select
+
+from .encryption import decrypt_many, snapshot_version
+from .models import PasswordEntry, User
+from .repository import LISTING_ATTRIBUTES
+
+# Rader som leses og dekrypteres mellom hver sjekk av should_stop i refresh.
+# Hver bit deles videre på trådpoolen i decrypt_many.
+SNAPSHOT_BATCH_SIZE = 2000
+
+
+def snapshot_path(db_path, user_id):
+    """Filen snapshotet lagres i, ved siden av databasen. None for :memory:."""
+    if not db_path or db_path == ":memory:":
+        return None
+    return f"{db_path}.{user_id}.snapshot"
+
+
+def encode_listing(entries) -> bytes:
+    """(entry_id, felt)-par som kompakt JSON, én liste per oppføring."""
+    rows = [
+        [entry_id] + [fields.get(name, "") for name in LISTING_ATTRIBUTES]
+        for entry_id, fields in entries
+    ]
+    return json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def decode_listing(payload: bytes) -> list:
+    """Motsatt av encode_listing."""
+    return [
+        (row[0], dict(zip(LISTING_ATTRIBUTES, row[1:]))) for row in json.loads(payload)
+    ]
+
+
+class ListingSnapshot:
+    """
+    Den dekrypterte listen (tjeneste, e-post, brukernavn, link og emne for
+    hver oppføring, aldri passordet) lagret som én kryptert blob ved siden
+    av databasen. Et snapshot er gyldig så lenge hvelvversjonen det ble laget
+    ved er lik users.vault_version, som øker ved hver endring av
+    oppføringene. Da gir det hele listen med én dekryptering og én
+    deserialisering i stedet for én per rad.
+    """
+
+    def __init__(self, database, user_id, ciphers, path=None):
+        self.database = database
+        self.user_id = user_id
+        self.ciphers = ciphers
+        self.path = path or snapshot_path(database.db_path, user_id)
+
+    @property
+    def enabled(self):
+        return self.path is not None and self.ciphers.has_snapshot_key
+
+    def vault_version(self) -> int:
+        table = User.__table__
+        statement = select(table.c.vault_version).where(table.c.id == self.user_id)
+        with self.database.engine.connect() as connection:
+            return connection.execute(statement).scalar()
+
+    def _read(self):
+        try:
+            with open(self.path, "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def _open(self, blob) -> list:
+        _, payload = self.ciphers.decrypt_snapshot(self.user_id, blob)
+        return decode_listing(payload)
+
+    def load(self):
+        """
+        (entry_id, felt)-par sortert på id, eller None hvis snapshotet mangler,
+        er utdatert eller ikke kan leses med nøklene. Et ubrukelig snapshot
+        slettes.
+        """
+        if not self.enabled:
+            return None
+        blob = self._read()
+        if blob is None:
+            return None
+        # Hodet sjekkes før noe dekrypteres
+        if snapshot_version(blob) != self.vault_version():
+            self.discard()
+            return None
+        try:
+            return self._open(blob)
+        except Exception:
+            # Andre nøkler (f.eks. etter passordbytte) eller en ødelagt fil
+            self.discard()
+            return None
+
+    def save(self, entries, vault_version):
+        """Lagre entries ((entry_id, felt)-par) som snapshot ved vault_version."""
+        blob = self.ciphers.encrypt_snapshot(
+            self.user_id, vault_version, encode_listing(entries)
+        )
+        # Skrives ferdig til en midlertidig fil først, så en halvskrevet fil
+        # aldri blir liggende som snapshot, og to skrivere ikke blandes
+        descriptor, temporary = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(blob)
+            os.replace(temporary, self.path)
+        except Exception:
+            os.remove(temporary)
+            raise
+
+    def discard(self):
+        if self.path is None:
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def refresh(self, should_stop=None, batch_size=SNAPSHOT_BATCH_SIZE) -> bool:
+        """
+        Lag snapshotet på nytt hvis det mangler eller er utdatert. Returnerer
+        True hvis det ble skrevet. Kan kjøres i en bakgrunnstråd; radene
+        dekrypteres i biter, og should_stop() sjekkes mellom hver bit.
+        """
+        if not self.enabled or self.load() is not None:
+            return False
+        # Versjonen leses før radene. Endres hvelvet imens, er snapshotet
+        # bare utdatert neste gang det lastes.
+        vault_version = self.vault_version()
+        table = PasswordEntry.__table__
+        statement = (
+            select(
+                table.c.id,
+                table.c.record,
+                *[table.c[name] for name in LISTING_ATTRIBUTES],
+            )
+            .where(table.c.user_id == self.user_id)
+            .order_by(table.c.id)
+        )
+        entries = []
+        with self.database.engine.connect() as connection:
+            result = connection.execution_options(yield_per=batch_size).execute(
+                statement
+            )
+            for rows in result.partitions():
+                if should_stop is not None and should_stop():
+                    return False
+                decrypted = decrypt_many(self.ciphers, rows, LISTING_ATTRIBUTES)
+                if decrypted.errors:
+                    # Rader som ikke kan leses vises med feilmelding i listen,
+                    # som ikke skal bli liggende i snapshotet
+                    return False
+                entries.extend(
+                    (row.id, dict(zip(LISTING_ATTRIBUTES, values)))
+                    for row, values in zip(rows, decrypted.values)
+                )
+        self.save(entries, vault_version)
+        return True
+
+    def patch(self, entry_id, fields=None) -> bool:
+        """
+        Oppdater én oppføring i snapshotet etter en endring denne prosessen
+        har lagret, eller fjern den med fields=None. Er det gjort andre
+        endringer siden snapshotet ble laget, slettes det i stedet.
+        Returnerer True hvis snapshotet ble oppdatert.
+        """
+        if not self.enabled:
+            return False
+        blob = self._read()
+        if blob is None:
+            return False
+        vault_version = self.vault_version()
+        # Endringen som ble lagret økte versjonen med én
+        if snapshot_version(blob) != vault_version - 1:
+            self.discard()
+            return False
+        try:
+            entries = dict(self._open(blob))
+        except Exception:
+            self.discard()
+            return False
+        if fields is None:
+            entries.pop(entry_id, None)
+        else:
+            entries[entry_id] = {
+                name: fields.get(name, "") for name in LISTING_ATTRIBUTES
+            }
+        self.save(sorted(entries.items()), vault_version)
+        return True
@@ -0,0 +1,110 @@
+from sqlalchemy import exists, func, select
+
+from .models import PasswordEntry
+
+
+class VaultStats:
+    """
+    Tellere for én brukers hvelv. Antallet og emnetellingen caches og holdes
+    oppdatert av hendelsene som endrer dem (lagt til, endret, slettet,
+    synkronisert). Uten cachet antall svarer has_entries med en EXISTS-
+    spørring, som stopper ved første treff i indeksen på passwords(user_id).
+    Svaret caches også og følger hendelsene.
+    """
+
+    def __init__(self, database, user_id, ciphers):
+        self.database = database
+        self.user_id = user_id
+        self.ciphers = ciphers
+        self._count = None
+        self._has_entries = None
+        self._tag_counts = None
+
+    def has_entries(self) -> bool:
+        if self._count is not None:
+            return self._count > 0
+        if self._has_entries is None:
+            table = PasswordEntry.__table__
+            statement = select(exists().where(table.c.user_id == self.user_id))
+            with self.database.engine.connect() as connection:
+                self._has_entries = bool(connection.execute(statement).scalar())
+        return self._has_entries
+
+    def count(self) -> int:
+        if self._count is None:
+            table = PasswordEntry.__table__
+            statement = (
+                select(func.count())
+                .select_from(table)
+                .where(table.c.user_id == self.user_id)
+            )
+            with self.database.engine.connect() as connection:
+                self._count = connection.execute(statement).scalar()
+        return self._count
+
+    def tag_counts(self) -> list:
+        """
+        (emne, antall) sortert på antall. Like emner grupperes på blind-
+        indeksen i SQL, så bare én oppføring per emne dekrypteres. Emnet vises
+        slik det er skrevet i den eldste av dem. Oppføringer uten blind-
+        indeks telles under None.
+        """
+        if self._tag_counts is None:
+            table = PasswordEntry.__table__
+            # Med min() henter SQLite de andre kolonnene uten aggregat fra
+            # raden som har minste id i gruppen
+            statement = (
+                select(
+                    table.c.tag_bidx,
+                    func.count(),
+                    func.min(table.c.id),
+                    table.c.record,
+                    table.c.tag,
+                )
+                .where(table.c.user_id == self.user_id)
+                .group_by(table.c.tag_bidx)
+            )
+            with self.database.engine.connect() as connection:
+                groups = connection.execute(statement).all()
+
+            counts = {}
+            for tag_bidx, count, entry_id, record, token in groups:
+                tag = None
+                if tag_bidx is not None:
+                    try:
+                        fields = self.ciphers.decrypt_entry(
+                            entry_id, record, {"tag": token}
+                        )
+                        tag = fields["tag"].strip()
+                    except Exception:
+                        # Telles sammen med oppføringene uten blind-indeks
+                        tag = None
+                counts[tag] = counts.get(tag, 0) + count
+            self._tag_counts = sorted(
+                counts.items(), key=lambda item: (-item[1], item[0] or "")
+            )
+        return self._tag_counts
+
+    def entries_added(self, count=1):
+        if self._count is not None:
+            self._count += count
+        if count:
+            self._has_entries = True
+        self._tag_counts = None
+
+    def entries_removed(self, count=1):
+        if self._count is not None:
+            self._count = max(self._count - count, 0)
+        elif count and self._has_entries:
+            # Uten antall vet vi ikke om det var den siste
+            self._has_entries = None
+        self._tag_counts = None
+
+    def entries_changed(self):
+        # En endret oppføring kan ha fått nytt emne
+        self._tag_counts = None
+
+    def invalidate(self):
+        self._count = None
+        self._has_entries = None
+        self._tag_counts = None
@@ -0,0 +1,226 @@
+import os
+from collections import namedtuple
+
+from sqlalchemy import bindparam, insert, update
+
+from .database import bulk_connection
+from .encryption import IDENTITY_COLUMNS, decrypt_many, entry_fingerprint
+from .models import ENCRYPTED_ATTRIBUTES, PasswordEntry
+from .repository import bump_vault_version, encrypt_entry
+
+# Antall rader som leses, dekrypteres og skrives om gangen
+SYNC_BATCH_SIZE = 500
+
+# added: antall nye oppføringer som ble lagt til
+# skipped: antall backuprader som ikke kunne dekrypteres med brukerens nøkler
+SyncResult = namedtuple("SyncResult", ["added", "skipped"])
+
+# De krypterte kolonnene som leses fra backupen, i samme rekkefølge som i spørringene
+TOKEN_COLUMNS = tuple(ENCRYPTED_ATTRIBUTES.values())
+
+
+def _stream(connection, sql, parameters=None, batch_size=SYNC_BATCH_SIZE):
+    """Kjør sql og gi radene i biter, uten å hente alt inn i minnet."""
+    result = connection.execution_options(yield_per=batch_size).exec_driver_sql(
+        sql, parameters or ()
+    )
+    yield from result.partitions()
+
+
+def _identify_with(ciphers):
+    """
+    Funksjonen som gir identiteten til en dekryptert oppføring. Uten
+    fingeravtrykksnøkkel (gammelt skjema) sammenlignes identitetsfeltene
+    nøklet med en tilfeldig nøkkel som bare gjelder denne synkroniseringen,
+    så klartekst aldri havner i de midlertidige tabellene.
+    """
+    if ciphers.has_fingerprint_key:
+        return ciphers.fingerprint
+    key = os.urandom(32)
+    return lambda data: entry_fingerprint(
+        key, [data.get(column, "") for column in IDENTITY_COLUMNS]
+    )
+
+
+def synchronize_from_backup(
+    engine, backup_path, user_id, ciphers, batch_size=SYNC_BATCH_SIZE
+) -> SyncResult:
+    """
+    Legg til oppføringene fra backupfilen som brukeren ikke har fra før.
+
+    Backupen kobles til hovedforbindelsen med ATTACH. Fingeravtrykkene samles
+    i en midlertidig tabell, og de nye radene finnes med en anti-join mot
+    indeksen på passwords(user_id, fingerprint). Bare nye rader og backuprader
+    uten lagret fingeravtrykk dekrypteres. De nye radene krypteres på nytt
+    etter innsetting, siden en post er bundet til oppføringens id. Alt leses
+    og skrives i biter, og alle innsettinger skjer i én transaksjon.
+
+    Har brukeren ingen fingeravtrykksnøkkel (gammelt skjema), dekrypteres
+    identitetene til både backupen og brukerens egne oppføringer og
+    sammenlignes i stedet.
+    """
+    identify = _identify_with(ciphers)
+    skipped = 0
+    added = 0
+    with bulk_connection(engine) as connection:
+        connection.exec_driver_sql("ATTACH DATABASE ? AS backup", (backup_path,))
+        try:
+            backup_columns = {
+                row[1]
+                for row in connection.exec_driver_sql(
+                    "PRAGMA backup.table_info(passwords)"
+                )
+            }
+            if not backup_columns:
+                return SyncResult(0, 0)
+            # Lagrede fingeravtrykk kan bare brukes med fingeravtrykksnøkkelen
+            fingerprint_column = (
+                "fingerprint"
+                if "fingerprint" in backup_columns and ciphers.has_fingerprint_key
+                else "NULL"
+            )
+            # Backuper fra før postformatet har bare tokens
+            record_column = "record" if "record" in backup_columns else "NULL"
+
+            connection.exec_driver_sql(
+                "CREATE TEMP TABLE sync_candidates "
+                "(backup_id INTEGER PRIMARY KEY, fingerprint TEXT NOT NULL)"
+            )
+            connection.exec_driver_sql(
+                "CREATE INDEX temp.ix_sync_candidates_fingerprint "
+                "ON sync_candidates (fingerprint)"
+            )
+
+            # 1. Fingeravtrykk som allerede er lagret i backupen
+            if fingerprint_column == "fingerprint":
+                connection.exec_driver_sql(
+                    "INSERT INTO temp.sync_candidates (backup_id, fingerprint) "
+                    "SELECT id, fingerprint FROM backup.passwords "
+                    "WHERE fingerprint IS NOT NULL"
+                )
+
+            # 2. Eldre backuprader uten fingeravtrykk dekrypteres og beregnes
+            identity = ", ".join(IDENTITY_COLUMNS)
+            for rows in _stream(
+                connection,
+                f"SELECT id, {record_column}, {identity} FROM backup.passwords "
+                f"WHERE {fingerprint_column} IS NULL",
+                batch_size=batch_size,
+            ):
+                result = decrypt_many(ciphers, rows, IDENTITY_COLUMNS)
+                skipped += len(result.errors)
+                parameters = [
+                    (row[0], identify(dict(zip(IDENTITY_COLUMNS, values))))
+                    for row, values in zip(rows, result.values)
+                    if values is not None
+                ]
+                if parameters:
+                    connection.exec_driver_sql(
+                        "INSERT INTO temp.sync_candidates (backup_id, fingerprint) "
+                        "VALUES (?, ?)",
+                        parameters,
+                    )
+
+            # Uten lagrede fingeravtrykk beregnes de for brukerens egne rader
+            if ciphers.has_fingerprint_key:
+                existing = (
+                    "SELECT 1 FROM main.passwords p "
+                    "WHERE p.user_id = ? AND p.fingerprint = c.fingerprint"
+                )
+                existing_parameters = (user_id,)
+            else:
+                connection.exec_driver_sql(
+                    "CREATE TEMP TABLE sync_existing (fingerprint TEXT PRIMARY KEY) "
+                    "WITHOUT ROWID"
+                )
+                for rows in _stream(
+                    connection,
+                    f"SELECT id, record, {identity} FROM main.passwords "
+                    "WHERE user_id = ?",
+                    (user_id,),
+                    batch_size=batch_size,
+                ):
+                    result = decrypt_many(ciphers, rows, IDENTITY_COLUMNS)
+                    parameters = [
+                        (identify(dict(zip(IDENTITY_COLUMNS, values))),)
+                        for values in result.values
+                        if values is not None
+                    ]
+                    if parameters:
+                        connection.exec_driver_sql(
+                            "INSERT OR IGNORE INTO temp.sync_existing (fingerprint) "
+                            "VALUES (?)",
+                            parameters,
+                        )
+                existing = (
+                    "SELECT 1 FROM temp.sync_existing p "
+                    "WHERE p.fingerprint = c.fingerprint"
+                )
+                existing_parameters = ()
+
+            # 3. Anti-join: de første backupradene med fingeravtrykk brukeren ikke har
+            connection.exec_driver_sql(
+                "CREATE TEMP TABLE sync_new AS "
+                "SELECT c.backup_id, c.fingerprint FROM temp.sync_candidates c "
+                "WHERE c.backup_id = ("
+                "  SELECT MIN(d.backup_id) FROM temp.sync_candidates d "
+                "  WHERE d.fingerprint = c.fingerprint"
+                f") AND NOT EXISTS ({existing})",
+                existing_parameters,
+            )
+
+            # 4. Bekreft de nye radene med brukerens nøkler og sett dem inn i biter
+            tokens = ", ".join(f"b.{column}" for column in TOKEN_COLUMNS)
+            record = "b.record" if record_column == "record" else "NULL"
+            columns = tuple(ENCRYPTED_ATTRIBUTES)
+            table = PasswordEntry.__table__
+            insert_rows = insert(table).returning(
+                table.c.id, sort_by_parameter_order=True
+            )
+            update_rows = update(table).where(table.c.id == bindparam("entry_id"))
+            for rows in _stream(
+                connection,
+                f"SELECT n.backup_id, {record}, {tokens}, n.fingerprint "
+                "FROM temp.sync_new n "
+                "JOIN backup.passwords b ON b.id = n.backup_id ORDER BY n.backup_id",
+                batch_size=batch_size,
+            ):
+                result = decrypt_many(ciphers, [row[:-1] for row in rows], columns)
+                new_entries = []
+                for row, values in zip(rows, result.values):
+                    if values is None:
+                        skipped += 1
+                        continue
+                    plaintext = dict(zip(columns, values))
+                    # Et lagret fingeravtrykk må stemme med brukerens egne nøkler
+                    if identify(plaintext) != row.fingerprint:
+                        skipped += 1
+                        continue
+                    new_entries.append(plaintext)
+                if not new_entries:
+                    continue
+                placeholder = dict.fromkeys(TOKEN_COLUMNS, b"")
+                placeholder["user_id"] = user_id
+                entry_ids = (
+                    connection.execute(insert_rows, [placeholder] * len(new_entries))
+                    .scalars()
+                    .all()
+                )
+                parameters = []
+                for entry_id, plaintext in zip(entry_ids, new_entries):
+                    attributes = encrypt_entry(ciphers, entry_id, plaintext)
+                    attributes["entry_id"] = entry_id
+                    parameters.append(attributes)
+                connection.execute(update_rows, parameters)
+                added += len(parameters)
+
+            if added:
+                bump_vault_version(connection, user_id)
+            connection.commit()
+        finally:
+            connection.rollback()
+            connection.exec_driver_sql("DROP TABLE IF EXISTS temp.sync_new")
+            connection.exec_driver_sql("DROP TABLE IF EXISTS temp.sync_candidates")
+            connection.exec_driver_sql("DROP TABLE IF EXISTS temp.sync_existing")
+            connection.exec_driver_sql("DETACH DATABASE backup")
+    return SyncResult(added, skipped)
@@ -13,20 +13,20 @@ from PySide2.QtWidgets import (
 )
 from PySide2.QtCore import Qt, Signal
 
-from data.encryption import encrypt_password
-from data.models import PasswordEntry
-
 
 class AddPasswordWidget(QWidget):
     # Definer en signal som emitteres når passordet er lagret
     password_saved = Signal(dict)
+    # Id-en til oppføringen som ble lagt til, og som ble lagt til eller endret
+    entry_added = Signal(int)
+    entry_changed = Signal(int)
 
-    def __init__(self, user, session, key, main_window, parent=None):
+    def __init__(self, user, repository, ciphers, main_window, parent=None):
         super().__init__(parent)
 
         self.user = user
-        self.session = session
-        self.key = key
+        self.repository = repository
+        self.ciphers = ciphers
         self.main_window = main_window
         self.entry_id = None
 
@@ -181,49 +181,43 @@ class AddPasswordWidget(QWidget):
             return
 
         try:
-            # Krypter hver relevant kolonne
-            encrypted_service = encrypt_password(data["service"], self.key["service"])
-            encrypted_email = encrypt_password(data["email"], self.key["email"])
-            encrypted_username = encrypt_password(
-                data["username"], self.key["username"]
-            )
-            encrypted_password = encrypt_password(
-                data["password"], self.key["password"]
-            )
-            encrypted_link = encrypt_password(data["link"], self.key["link"])
-            encrypted_tag = encrypt_password(data["tag"], self.key["tag"])
-
+            # Advar hvis det allerede finnes et passord for samme tjeneste og e-post.
+            # Oppslaget bruker blind-indeksene, så ingenting må dekrypteres.
+            if not self.entry_id and self.ciphers.has_blind_index:
+                duplicates = self.repository.find(
+                    self.ciphers, service=data["service"], email=data["email"]
+                )
+                if duplicates:
+                    reply = QMessageBox.question(
+                        self,
+                        "Finnes allerede",
+                        f"Det finnes allerede et passord for '{data['service']}' med denne e-posten. Vil du lagre likevel?",
+                        QMessageBox.Yes | QMessageBox.No,
+                        QMessageBox.No,
+                    )
+                    if reply != QMessageBox.Yes:
+                        return
+
+            # Repositoriet krypterer feltene og lager blind-indekser og fingeravtrykk
             if self.entry_id:
                 # Oppdater eksisterende oppføring
-                entry = self.session.query(PasswordEntry).get(self.entry_id)
-                if entry:
-                    entry.service = encrypted_service
-                    entry.email = encrypted_email
-                    entry.username = encrypted_username
-                    entry.encrypted_password = encrypted_password
-                    entry.link = encrypted_link
-                    entry.tag = encrypted_tag
-                    self.session.commit()
+                if self.repository.update(self.ciphers, self.entry_id, data):
+                    entry_id = self.entry_id
                     self.main_window.show_show_password_widget()
                 else:
+                    entry_id = None
                     QMessageBox.warning(self, "Feil", "Kunne ikke finne oppføringen.")
             else:
                 # Opprett ny oppføring
-                entry = PasswordEntry(
-                    service=encrypted_service,
-                    email=encrypted_email,
-                    username=encrypted_username,
-                    encrypted_password=encrypted_password,
-                    link=encrypted_link,
-                    tag=encrypted_tag,
-                    user_id=self.user.id,
-                )
-                self.session.add(entry)
-                self.session.commit()
+                entry_id = self.repository.add(self.ciphers, data)
+                self.entry_added.emit(entry_id)
 
-            # Emit signal med data inkludert bruker_id
+            # Emit signal med data inkludert bruker_id og id til oppføringen
             data["user_id"] = self.user.id
+            data["id"] = entry_id
             self.password_saved.emit(data)
+            if entry_id is not None:
+                self.entry_changed.emit(entry_id)
 
             # Tøm feltene etter lagring
             self.clear_fields()
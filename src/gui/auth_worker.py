@@ -0,0 +1,29 @@
+from PySide2.QtCore import QThread, Signal
+
+
+class AuthWorker(QThread):
+    """
+    Kjører innlogging eller registrering i en egen tråd slik at vinduet ikke
+    fryser mens nøklene utledes. Resultatet sendes tilbake med signaler.
+    """
+
+    result_ready = Signal(object)
+    error = Signal(str)
+
+    def __init__(self, function, *args, parent=None):
+        super().__init__(parent)
+        self.function = function
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        # PBKDF2 kan ikke avbrytes underveis, så resultatet forkastes i stedet
+        self.cancelled = True
+
+    def run(self):
+        try:
+            result = self.function(*self.args)
+        except Exception as e:
+            self.error.emit(str(e))
+            return
+        self.result_ready.emit(result)
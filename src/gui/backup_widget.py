@@ -1,6 +1,5 @@
 from datetime import datetime
 import os
-import shutil
 import tempfile
 import traceback
 import csv
@@ -15,9 +14,10 @@ from PySide2.QtWidgets import (
 from PySide2.QtCore import Qt, Signal
 from sqlalchemy.exc import SQLAlchemyError
 
-from data.encryption import decrypt_password
-from data.database import get_engine, create_tables, get_session
-from data.models import PasswordEntry
+from data.encryption import decrypt_many
+from data.backup import copy_database, create_user_backup
+from data.sync import synchronize_from_backup
+from data.models import ENCRYPTED_ATTRIBUTES
 
 
 class BackupWidget(QWidget):
@@ -28,8 +28,8 @@ class BackupWidget(QWidget):
 
         self.main_window = main_window
 
-        # Sjekk at encryption_key er gyldig
-        if not self.main_window.key:
+        # Sjekk at krypteringsnøklene er gyldige
+        if not self.main_window.ciphers:
             QMessageBox.critical(
                 self,
                 "Feil",
@@ -96,42 +96,12 @@ class BackupWidget(QWidget):
                     os.path.join(backup_dir, backup_filename)
                 )
 
-                # Opprett en midlertidig database med kun brukerens passord
-                with tempfile.NamedTemporaryFile(
-                    delete=False, suffix=".db"
-                ) as temp_db_file:
-                    temp_db_path = temp_db_file.name
-
-                temp_engine = get_engine(temp_db_path)
-                create_tables(temp_engine)
-                temp_session = get_session(temp_engine)
-
-                # Kopier kun brukerens passord til den midlertidige databasen
-                user_passwords = (
-                    self.main_window.session.query(PasswordEntry)
-                    .filter_by(user_id=self.main_window.user.id)
-                    .all()
+                # Kopier kun brukerens oppføringer rett over i backupfilen
+                create_user_backup(
+                    self.main_window.database.engine,
+                    self.main_window.user.id,
+                    backup_path,
                 )
-                for entry in user_passwords:
-                    new_entry = PasswordEntry(
-                        service=entry.service,
-                        email=entry.email,
-                        username=entry.username,
-                        encrypted_password=entry.encrypted_password,
-                        link=entry.link,
-                        tag=entry.tag,
-                        user_id=entry.user_id,
-                    )
-                    temp_session.add(new_entry)
-                temp_session.commit()
-
-                # Lagre databasen som backup
-                shutil.copy2(temp_db_path, backup_path)
-
-                # Rydd opp den midlertidige databasen
-                temp_session.close()
-                temp_engine.dispose()
-                os.remove(temp_db_path)
 
                 # Informer brukeren om suksess
                 QMessageBox.information(
@@ -161,12 +131,12 @@ class BackupWidget(QWidget):
         if not backup_file:
             return
 
-        # Velg en midlertidig mappe for dekryptering
+        # Velg en midlertidig mappe for kopien av backupen
         with tempfile.TemporaryDirectory() as temp_dir:
             decrypted_backup_path = os.path.join(temp_dir, "decrypted_backup.db")
             try:
-                # les inn kryptert tabell uten å dekryptere
-                shutil.copy2(backup_file, decrypted_backup_path)
+                # Konsistent kopi av backupen, også om den er i bruk
+                copy_database(backup_file, decrypted_backup_path)
             except Exception as e:
                 QMessageBox.critical(
                     self,
@@ -177,119 +147,14 @@ class BackupWidget(QWidget):
                 return
 
             try:
-                # Sett opp engine og session for backup databasen
-                backup_engine = get_engine(decrypted_backup_path)
-                backup_session = get_session(backup_engine)
-
-                # Hent alle passordoppføringer fra backup
-                backup_passwords = backup_session.query(PasswordEntry).all()
-                if not backup_passwords:
-                    QMessageBox.information(
-                        self,
-                        "Ingen Passord i Backup",
-                        "Backup-databasen inneholder ingen passord.",
-                        QMessageBox.Ok,
-                    )
-                    return
-
-                # Hent alle passordoppføringer fra current db
-                current_passwords = (
-                    self.main_window.session.query(PasswordEntry)
-                    .filter_by(user_id=self.main_window.user.id)
-                    .all()
-                )
-
-                # Lag en sett av unike identifikatorer for nåværende passord
-                current_identifiers = set(
-                    (
-                        decrypt_password(p.service, self.main_window.key["service"]),
-                        decrypt_password(p.email, self.main_window.key["email"]),
-                        decrypt_password(p.username, self.main_window.key["username"]),
-                        decrypt_password(p.link, self.main_window.key["link"]),
-                        decrypt_password(p.tag, self.main_window.key["tag"]),
-                    )
-                    for p in current_passwords
+                # Kobler kopien til hoveddatabasen og legger til de nye radene
+                # i én transaksjon, bit for bit
+                result = synchronize_from_backup(
+                    self.main_window.database.engine,
+                    decrypted_backup_path,
+                    self.main_window.user.id,
+                    self.main_window.ciphers,
                 )
-
-                # Legg til passord fra backup som ikke finnes i nåværende database
-                new_entries = []
-                for entry in backup_passwords:
-                    try:
-                        identifier = (
-                            decrypt_password(
-                                entry.service, self.main_window.key["service"]
-                            ),
-                            decrypt_password(
-                                entry.email, self.main_window.key["email"]
-                            ),
-                            decrypt_password(
-                                entry.username, self.main_window.key["username"]
-                            ),
-                            decrypt_password(entry.link, self.main_window.key["link"]),
-                            decrypt_password(entry.tag, self.main_window.key["tag"]),
-                        )
-                        if identifier not in current_identifiers:
-                            new_entries.append(entry)
-                    except Exception as e:
-                        traceback.print_exc()
-
-                if not new_entries:
-                    QMessageBox.information(
-                        self,
-                        "Ingen Nye Passord",
-                        "Backup-databasen inneholder ingen nye passord som ikke allerede er i den nåværende databasen.",
-                        QMessageBox.Ok,
-                    )
-                    return
-
-                # Legg til de nye passordene i den nåværende databasen
-                for entry in new_entries:
-                    try:
-                        new_entry = PasswordEntry(
-                            service=entry.service,
-                            email=entry.email,
-                            username=entry.username,
-                            encrypted_password=entry.encrypted_password,
-                            link=entry.link,
-                            tag=entry.tag,
-                            user_id=self.main_window.user.id,
-                        )
-                        self.main_window.session.add(new_entry)
-                        self.main_window.session.flush()
-                    except Exception as e:
-                        traceback.print_exc()
-
-                try:
-                    if len(new_entries) == 1:
-                        message = "1 nytt passord har blitt lagt til."
-                    else:
-                        message = f"{len(new_entries)} nye passord har blitt lagt til."
-                    QMessageBox.information(
-                        self,
-                        "Passord synkronisert!",
-                        message,
-                        QMessageBox.Ok,
-                    )
-                    self.main_window.session.commit()
-                except SQLAlchemyError as e:
-                    traceback.print_exc()
-                    QMessageBox.critical(
-                        self,
-                        "Database Feil",
-                        f"En feil oppstod under synkroniseringen:\n{str(e)}",
-                        QMessageBox.Ok,
-                    )
-                    return
-                except Exception as e:
-                    traceback.print_exc()
-                    QMessageBox.critical(
-                        self,
-                        "Feil",
-                        f"En uventet feil oppstod:\n{str(e)}",
-                        QMessageBox.Ok,
-                    )
-                    return
-
             except SQLAlchemyError as e:
                 traceback.print_exc()
                 QMessageBox.critical(
@@ -298,6 +163,7 @@ class BackupWidget(QWidget):
                     f"En feil oppstod under synkroniseringen:\n{str(e)}",
                     QMessageBox.Ok,
                 )
+                return
             except Exception as e:
                 traceback.print_exc()
                 QMessageBox.critical(
@@ -306,12 +172,34 @@ class BackupWidget(QWidget):
                     f"En uventet feil oppstod:\n{str(e)}",
                     QMessageBox.Ok,
                 )
-            finally:
-                try:
-                    backup_session.close()
-                    backup_engine.dispose()
-                except Exception as e:
-                    traceback.print_exc()
+                return
+
+        skipped_message = (
+            f"\n{result.skipped} oppføringer i backupen kunne ikke dekrypteres og ble hoppet over."
+            if result.skipped
+            else ""
+        )
+        if not result.added:
+            QMessageBox.information(
+                self,
+                "Ingen Nye Passord",
+                "Backup-databasen inneholder ingen nye passord som ikke allerede er i den nåværende databasen."
+                + skipped_message,
+                QMessageBox.Ok,
+            )
+            return
+
+        if result.added == 1:
+            message = "1 nytt passord har blitt lagt til."
+        else:
+            message = f"{result.added} nye passord har blitt lagt til."
+        QMessageBox.information(
+            self,
+            "Passord synkronisert!",
+            message + skipped_message,
+            QMessageBox.Ok,
+        )
+        self.sync_completed.emit(result.added)
 
     def backup_csv(self):
         # Informer brukeren om risikoen ved å lagre passord i klartekst
@@ -342,10 +230,8 @@ class BackupWidget(QWidget):
 
         try:
             # Hent alle passordoppføringer for den nåværende brukeren
-            password_entries = (
-                self.main_window.session.query(PasswordEntry)
-                .filter_by(user_id=self.main_window.user.id)
-                .all()
+            password_entries = self.main_window.repository.fetch_rows(
+                include_password=True
             )
 
             if not password_entries:
@@ -366,39 +252,19 @@ class BackupWidget(QWidget):
                     ["Service", "Email", "Username", "Password", "Link", "Tag"]
                 )
 
-                # Skriv hver passordoppføring til CSV
-                for entry in password_entries:
-                    try:
-                        service = decrypt_password(
-                            entry.service, self.main_window.key["service"]
-                        )
-                        email = decrypt_password(
-                            entry.email, self.main_window.key["email"]
-                        )
-                        username = decrypt_password(
-                            entry.username, self.main_window.key["username"]
-                        )
-                        password = decrypt_password(
-                            entry.encrypted_password, self.main_window.key["password"]
-                        )
-                        link = (
-                            decrypt_password(entry.link, self.main_window.key["link"])
-                            if entry.link
-                            else ""
-                        )
-                        tag = (
-                            decrypt_password(entry.tag, self.main_window.key["tag"])
-                            if entry.tag
-                            else ""
-                        )
-
-                        writer.writerow([service, email, username, password, link, tag])
-                    except Exception as e:
-                        # Logg feilen og hopp over denne oppføringen
-                        print(
-                            f"Feil ved dekryptering av passord for tjeneste '{entry.service}': {str(e)}"
-                        )
-                        continue
+                # Dekrypter alle oppføringene samlet og skriv dem til CSV
+                result = decrypt_many(
+                    self.main_window.ciphers,
+                    password_entries,
+                    tuple(ENCRYPTED_ATTRIBUTES),
+                )
+                writer.writerows(values for values in result.values if values)
+
+                # Logg feilene, oppføringene som feilet er hoppet over
+                for index, error in result.errors:
+                    print(
+                        f"Feil ved dekryptering av passord for oppføring {password_entries[index].id}: {str(error)}"
+                    )
 
             # Informer brukeren om at backupen ble fullført
             QMessageBox.information(
@@ -10,22 +10,25 @@ from PySide2.QtWidgets import (
     QMenu,
     QSizePolicy,
     QGridLayout,
+    QProgressBar,
 )
 from PySide2.QtCore import Qt, Signal
-from utils.login_manager import LoginManager
+from gui.auth_worker import AuthWorker
+from data.encryption import ColumnCipherSet
 
 
 class LoginWidget(QWidget):
     login_success = Signal()
 
-    def __init__(self, db_path, style_manager, existing=True, parent=None):
+    def __init__(self, login_manager, style_manager, existing=True, parent=None):
         super().__init__(parent)
-        self.db_path = db_path
-        self.login_manager = LoginManager(db_path)
+        self.login_manager = login_manager
+        self.db_path = login_manager.db_path
         self.style_manager = style_manager
         self.mode = "login" if existing else "register"
         self.user = None
-        self.key = None
+        self.ciphers = None
+        self.worker = None  # Bakgrunnstråd for innlogging/registrering
 
         # Create a button that will show the menu when clicked
         self.user_menu_button = QPushButton("Bytt Bruker")
@@ -90,6 +93,13 @@ class LoginWidget(QWidget):
         self.clear_fields_button.clicked.connect(self.clear_inputs)
         self.clear_fields_button.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
 
+        # Opptatt-indikator mens nøklene utledes
+        self.busy_indicator = QProgressBar()
+        self.busy_indicator.setRange(0, 0)
+        self.busy_indicator.setTextVisible(False)
+        self.busy_indicator.setMaximumWidth(200)
+        self.busy_indicator.hide()
+
         # Switch mode button
         self.switch_mode_button = QPushButton(
             "Opprett ny bruker" if existing else "Tilbake til innlogging"
@@ -123,6 +133,7 @@ class LoginWidget(QWidget):
         main_layout.addStretch()
 
         bottom_buttons_layout = QVBoxLayout()
+        bottom_buttons_layout.addWidget(self.busy_indicator, alignment=Qt.AlignHCenter)
         bottom_buttons_layout.addWidget(self.ok_button, alignment=Qt.AlignHCenter)
         bottom_buttons_layout.addWidget(
             self.switch_mode_button, alignment=Qt.AlignHCenter
@@ -162,6 +173,8 @@ class LoginWidget(QWidget):
         self.style_manager.apply_button_style_circle(self.toggle_password_button)
 
     def switch_mode(self):
+        # Bytter man modus mens en innlogging pågår, forkastes resultatet
+        self.cancel_authentication()
         if self.mode == "login":
             self.mode = "register"
             self.setWindowTitle("Opprett Bruker")
@@ -184,6 +197,10 @@ class LoginWidget(QWidget):
             self.user_menu_button.setVisible(True)  # Vis "Bytt Bruker"-knappen igjen
 
     def on_ok(self):
+        # Ignorer nye trykk mens en nøkkelutledning allerede pågår
+        if self.worker is not None:
+            return
+
         username = self.username_input.text().strip()
         password = self.password_input.text()
         confirm_password = self.confirm_password_input.text()
@@ -192,36 +209,87 @@ class LoginWidget(QWidget):
             return
 
         if self.mode == "login":
-            # Autentiser brukeren her
-            user, key, message = self.login_manager.authenticate_user(
-                username, password
+            # Autentiser brukeren i bakgrunnen
+            self.start_worker(
+                self.on_login_finished,
+                self.login_manager.authenticate_user,
+                username,
+                password,
             )
-            if user:
-                # Lagre bruker og nøkkel som instansvariabler
-                self.user = user
-                self.key = key
-                # Emittere signal om vellykket innlogging uten sensitive data
-                self.login_success.emit()
-                # Tømmer inputfeltene
-                self.clear_inputs()
-            else:
-                QMessageBox.critical(self, "Feil", message, QMessageBox.Ok)
         else:  # Registreringsmodus
-            if self.try_register_user(username, password):
-                QMessageBox.information(self, "Suksess", "Bruker opprettet!")
-                self.switch_mode()  # Bytt tilbake til innloggingsmodus
-                # Setter brukernavn etter man har byttet modus
-                self.username_input.setText(username)
-                self.password_input.setFocus()
-                # tømmer passord feltene
-                self.password_input.clear()
-                self.confirm_password_input.clear()
-                # Oppdater "Bytt Bruker"-menyen
-                self.populate_user_menu()
-            else:
-                QMessageBox.critical(
-                    self, "Feil", "Kunne ikke opprette bruker. Prøv igjen."
-                )
+            self.start_worker(
+                lambda success: self.on_register_finished(success, username),
+                self.try_register_user,
+                username,
+                password,
+            )
+
+    def start_worker(self, on_result, function, *args):
+        self.worker = AuthWorker(function, *args)
+        self.worker.result_ready.connect(on_result)
+        self.worker.error.connect(self.on_worker_error)
+        self.worker.finished.connect(self.on_worker_finished)
+        self.set_busy(True)
+        self.worker.start()
+
+    def cancel_authentication(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.set_busy(False)
+
+    def set_busy(self, busy):
+        self.busy_indicator.setVisible(busy)
+        self.switch_mode_button.setEnabled(not busy)
+        self.user_menu_button.setEnabled(not busy)
+        self.username_input.setEnabled(not busy)
+        self.password_input.setEnabled(not busy)
+        self.confirm_password_input.setEnabled(not busy)
+        # OK forblir deaktivert helt til tråden er ferdig, også etter avbrudd
+        self.ok_button.setEnabled(not busy and self.worker is None)
+
+    def on_worker_finished(self):
+        self.worker.deleteLater()
+        self.worker = None
+        self.set_busy(False)
+
+    def on_worker_error(self, message):
+        if self.worker.cancelled:
+            return
+        QMessageBox.critical(self, "Feil", message, QMessageBox.Ok)
+
+    def on_login_finished(self, result):
+        if self.worker.cancelled:
+            return
+        user, key, message = result
+        if user:
+            # Lagre bruker og krypteringsobjektene som instansvariabler
+            self.user = user
+            self.ciphers = ColumnCipherSet(key)
+            # Emittere signal om vellykket innlogging uten sensitive data
+            self.login_success.emit()
+            # Tømmer inputfeltene
+            self.clear_inputs()
+        else:
+            QMessageBox.critical(self, "Feil", message, QMessageBox.Ok)
+
+    def on_register_finished(self, success, username):
+        if self.worker.cancelled:
+            return
+        if success:
+            QMessageBox.information(self, "Suksess", "Bruker opprettet!")
+            self.switch_mode()  # Bytt tilbake til innloggingsmodus
+            # Setter brukernavn etter man har byttet modus
+            self.username_input.setText(username)
+            self.password_input.setFocus()
+            # tømmer passord feltene
+            self.password_input.clear()
+            self.confirm_password_input.clear()
+            # Oppdater "Bytt Bruker"-menyen
+            self.populate_user_menu()
+        else:
+            QMessageBox.critical(
+                self, "Feil", "Kunne ikke opprette bruker. Prøv igjen."
+            )
 
     def validate_inputs(self, username, password, confirm_password):
         """Validerer input-feltene for både innlogging og registrering."""
@@ -281,8 +349,11 @@ class LoginWidget(QWidget):
         self.password_input.setFocus()
 
     def clear_sensitive_data(self):
+        # Nøklene deles med de andre widgetene, så de slettes for alle
+        if self.ciphers:
+            self.ciphers.wipe()
         self.user = None
-        self.key = None
+        self.ciphers = None
 
     def toggle_password_visibility(self):
         """Vis eller skjul passordet basert på knappens tilstand."""
@@ -7,6 +7,9 @@ from PySide2.QtWidgets import (
     QMessageBox,
     QStackedWidget,
     QApplication,
+    QInputDialog,
+    QLineEdit,
+    QProgressDialog,
 )
 from PySide2.QtCore import Qt, Signal
 from PySide2.QtGui import QFont
@@ -17,7 +20,14 @@ from gui.settings_widget import SettingsWidget
 from gui.show_password_widget import ShowPasswordWidget
 from gui.backup_widget import BackupWidget
 from gui.login_widget import LoginWidget
-from data.models import PasswordEntry, Settings
+from gui.record_worker import RecordWorker
+from gui.rekey_worker import KeyRotationWorker, RekeyWorker
+from data.database import DEFAULT_PROFILE, set_connection_profile
+from data.records import record_progress
+from data.repository import PasswordRepository, save_user_settings
+from data.snapshot import ListingSnapshot
+from data.stats import VaultStats
+from utils.login_manager import LoginManager
 from utils.style_manager import StyleManager
 
 
@@ -25,17 +35,24 @@ class MainWindow(QMainWindow):
     logged_out = Signal()  # Dette signalet sender vi når brukeren logger ut
     theme_changed = Signal()  # Signal som sendes når temaet endres
 
-    def __init__(self, key, session, user, db_path):
+    def __init__(self, db_path, login_manager=None):
         super().__init__()
 
         self.style_manager = StyleManager()
 
         self.setWindowTitle("Passordskapet")
 
-        # Initialize key, session og user
-        self.key = key
-        self.session = session
-        self.user = user
+        # Én LoginManager for hele appen, og databasen den deler med widgetene.
+        # Widgetene bruker korte sesjoner via PasswordRepository.
+        self.login_manager = login_manager or LoginManager(db_path)
+        self.database = self.login_manager.database
+
+        # Settes ved innlogging
+        self.ciphers = None
+        self.user = None
+        self.repository = None
+        self.record_worker = None
+        self.rekey_worker = None
         self.db_path = db_path
 
         # Opprett hovedwidget og layout
@@ -57,12 +74,16 @@ class MainWindow(QMainWindow):
 
         # Opprett widgets uten å sette forelder
         self.login_widget = LoginWidget(
-            db_path=self.db_path, style_manager=self.style_manager, existing=True
+            login_manager=self.login_manager,
+            style_manager=self.style_manager,
+            existing=True,
         )
         self.placeholder_widget = PlaceholderWidget()
 
         # Kobler signaler
         self.login_widget.login_success.connect(self.handle_login)
+        # Kobles før widgetene som tømmer nøklene, så jobben er stoppet først
+        self.logged_out.connect(self.stop_record_migration)
         self.logged_out.connect(self.login_widget.clear_sensitive_data)
 
         # Legg widgets til stacken
@@ -128,13 +149,8 @@ class MainWindow(QMainWindow):
 
     def update_button_states(self):
         try:
-            # Filtrere passordene til den innloggede brukeren
-            password_count = (
-                self.session.query(PasswordEntry)
-                .filter_by(user_id=self.user.id)
-                .count()
-            )
-            if password_count > 0:
+            # Cachet antall, eller en EXISTS-spørring når cachen er kald
+            if self.stats.has_entries():
                 self.view_password_button.setVisible(True)
                 self.backup_button.setVisible(True)
             else:
@@ -162,39 +178,225 @@ class MainWindow(QMainWindow):
             self.add_password_widget.clear_fields()
 
     def show_show_password_widget(self):
-        # Last inn passordene når widgeten skal vises
-        self.show_password_widget.load_passwords()
+        # Passordene lastes første gang, deretter patches endringene inn
+        self.show_password_widget.ensure_loaded()
         self.stack.setCurrentWidget(self.show_password_widget)
 
     def switch_to_widget(self, widget):
         self.stack.setCurrentWidget(widget)
 
     def apply_settings_and_save(self, settings):
-        theme, font_size = settings
-        self.save_user_settings(theme, font_size)
+        theme, font_size, db_profile = settings
+        self.save_user_settings(theme, font_size, db_profile)
         self.apply_settings()
 
-    def save_user_settings(self, theme, font_size):
-        # Oppdater brukerinnstillingene i databasen
-        if self.user.settings:
-            self.user.settings.theme = theme
-            self.user.settings.font_size = font_size
-        else:
-            # Opprett standardinnstillinger hvis de ikke finnes
-            self.user.settings = Settings(theme=theme, font_size=font_size)
-            self.session.add(self.user.settings)
-        self.session.commit()
+    def save_user_settings(self, theme, font_size, db_profile=DEFAULT_PROFILE):
+        # Oppdater brukerinnstillingene i databasen, eller opprett dem
+        self.user.settings = save_user_settings(
+            self.database,
+            self.user.id,
+            theme=theme,
+            font_size=font_size,
+            db_profile=db_profile,
+        )
+
+    def confirm_backups_invalidated(self, title) -> bool:
+        # Backuper tatt før endringen kan ikke leses med de nye nøklene
+        answer = QMessageBox.warning(
+            self,
+            title,
+            "Backuper tatt før denne endringen kan ikke gjenopprettes etterpå. "
+            "Ta en ny backup når endringen er ferdig.\n\nVil du fortsette?",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.No,
+        )
+        return answer == QMessageBox.Yes
+
+    def retune_key_strength(self):
+        if not self.confirm_backups_invalidated("Juster nøkkelstyrke"):
+            return
+        password, ok = QInputDialog.getText(
+            self,
+            "Juster nøkkelstyrke",
+            "Skriv inn hovedpassordet for å kalibrere nøklene for denne maskinen:",
+            QLineEdit.Password,
+        )
+        if not ok or not password:
+            return
+
+        self.start_rekey(
+            "Juster nøkkelstyrke",
+            password,
+            password,
+            lambda: f"Nøklene bruker nå {self.user.kdf_iterations} iterasjoner.",
+            keep_salt=True,
+        )
+
+    def change_master_password(self):
+        if not self.confirm_backups_invalidated("Bytt hovedpassord"):
+            return
+        password, ok = QInputDialog.getText(
+            self,
+            "Bytt hovedpassord",
+            "Skriv inn det nåværende hovedpassordet:",
+            QLineEdit.Password,
+        )
+        if not ok or not password:
+            return
+        new_password, ok = QInputDialog.getText(
+            self, "Bytt hovedpassord", "Nytt hovedpassord:", QLineEdit.Password
+        )
+        if not ok or not new_password:
+            return
+        confirmation, ok = QInputDialog.getText(
+            self,
+            "Bytt hovedpassord",
+            "Gjenta det nye hovedpassordet:",
+            QLineEdit.Password,
+        )
+        if not ok:
+            return
+        if confirmation != new_password:
+            QMessageBox.warning(self, "Feil", "Passordene er ikke like.")
+            return
+
+        self.start_rekey(
+            "Bytt hovedpassord",
+            password,
+            new_password,
+            lambda: "Hovedpassordet er byttet.",
+        )
+
+    def rotate_keys(self):
+        if self.rekey_running():
+            return
+        # De gamle nøklene utledes ikke lenger når alle radene er kryptert om
+        if not self.confirm_backups_invalidated("Roter nøkler"):
+            return
+        password, ok = QInputDialog.getText(
+            self,
+            "Roter nøkler",
+            "Skriv inn hovedpassordet for å ta i bruk nye krypteringsnøkler:",
+            QLineEdit.Password,
+        )
+        if not ok or not password:
+            return
+
+        # Rotnøkkelen utledes i en egen tråd, så vinduet ikke fryser. Dialogen
+        # holder vinduet låst til den er ferdig; PBKDF2 kan ikke avbrytes.
+        dialog = QProgressDialog("Utleder nye nøkler...", None, 0, 0, self)
+        dialog.setWindowTitle("Roter nøkler")
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.setMinimumDuration(0)
+        dialog.setCancelButton(None)
+
+        user_id, ciphers = self.user.id, self.ciphers
+        worker = KeyRotationWorker(self.login_manager, self.user, password)
+        worker.result_ready.connect(
+            lambda result: self.on_keys_rotated(result, dialog, user_id, ciphers)
+        )
+        self.rekey_worker = worker
+        worker.start()
+
+    def rekey_running(self) -> bool:
+        # En ny jobb skal ikke erstatte en tråd som fortsatt kjører
+        return self.rekey_worker is not None and self.rekey_worker.isRunning()
+
+    def on_keys_rotated(self, result, dialog, user_id, ciphers):
+        dialog.close()
+        # Brukeren kan ha logget ut, eller en annen logget inn, imens
+        if self.ciphers is not ciphers or self.user is None or self.user.id != user_id:
+            return
+        new_keys, message = result
+        if not new_keys:
+            QMessageBox.critical(self, "Feil", message, QMessageBox.Ok)
+            return
+
+        # Nøkkelsettet kan fortsatt lese alt som er kryptert med de gamle
+        # nøklene, så listen trenger ikke lastes på nytt. Omgjøringen bruker
+        # det samme nøkkelsettet og må stoppes før det byttes.
+        self.stop_record_migration()
+        self.ciphers.rekey(new_keys)
+        self.start_record_migration()
+
+        done, total = record_progress(
+            self.database.engine, self.user.id, self.ciphers.generation
+        )
+        QMessageBox.information(
+            self,
+            "Roter nøkler",
+            f"Nye nøkler er tatt i bruk. {total - done} av {total} oppføringer "
+            "krypteres på nytt i bakgrunnen.",
+            QMessageBox.Ok,
+        )
+
+    def start_rekey(self, title, password, new_password, done_message, keep_salt=False):
+        # Kalibreringen, nøkkelutledningen og krypteringen av hvelvet går i en
+        # egen tråd med fremdrift og mulighet for å avbryte. Omgjøringen av
+        # postene skal ikke skrive med de gamle nøklene samtidig.
+        if self.rekey_running():
+            return
+        self.stop_record_migration()
+        dialog = QProgressDialog("Utleder nye nøkler...", "Avbryt", 0, 0, self)
+        dialog.setWindowTitle(title)
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.setMinimumDuration(0)
+
+        worker = RekeyWorker(
+            self.login_manager, self.user, password, new_password, keep_salt
+        )
+        worker.progress.connect(
+            lambda done, total: (
+                dialog.setLabelText("Krypterer oppføringene på nytt..."),
+                dialog.setMaximum(total),
+                dialog.setValue(done),
+            )
+        )
+        dialog.canceled.connect(worker.cancel)
+        worker.result_ready.connect(
+            lambda result: self.on_rekey_finished(result, dialog, title, done_message)
+        )
+        self.rekey_worker = worker
+        worker.start()
+
+    def on_rekey_finished(self, result, dialog, title, done_message):
+        dialog.close()
+        new_keys, message = result
+        if not new_keys:
+            # Omgjøringen ble stoppet da byttet startet og fortsetter med de
+            # gamle nøklene
+            self.start_record_migration()
+            QMessageBox.warning(self, title, message, QMessageBox.Ok)
+            return
+
+        # Alle widgets deler samme ColumnCipherSet, så én oppdatering holder
+        self.stop_record_migration()
+        self.ciphers.rekey(new_keys)
+        # Radene i listen er kryptert med de gamle nøklene, og snapshotet
+        # lages på nytt med den nye snapshotnøkkelen
+        self.show_password_widget.invalidate()
+        self.start_record_migration()
+
+        QMessageBox.information(self, title, done_message(), QMessageBox.Ok)
 
     def get_user_settings(self):
         settings = {
             "theme": self.user.settings.theme if self.user.settings else "default",
             "font_size": self.user.settings.font_size if self.user.settings else 16,
+            "db_profile": (
+                self.user.settings.db_profile
+                if self.user.settings and self.user.settings.db_profile
+                else DEFAULT_PROFILE
+            ),
         }
         return settings
 
     def apply_settings(self):
         settings = self.get_user_settings()
 
+        # Nye tilkoblinger får profilen via connect-hooken i data.database
+        set_connection_profile(self.database.engine, settings["db_profile"])
+
         # Sjekk om temaet faktisk har endret seg før vi bruker stiler på nytt
         current_theme = self.style_manager.theme
         current_font_size = QApplication.instance().font().pointSize()
@@ -234,8 +436,21 @@ class MainWindow(QMainWindow):
         # Skjul sidepanelet når brukeren logger ut
         self.side_panel.setVisible(False)
         self.logged_out.emit()
+        self.ciphers = None
         self.stack.setCurrentWidget(self.login_widget)
 
+    def closeEvent(self, event):
+        # Trådene som fortsatt kjører må være ferdige før vinduet lukkes. Et
+        # passordbytte avbrytes og rulles tilbake, en nøkkelutledning venter
+        # vi på.
+        self.stop_record_migration()
+        worker = self.rekey_worker
+        if worker is not None:
+            if isinstance(worker, RekeyWorker):
+                worker.cancel()
+            worker.wait()
+        super().closeEvent(event)
+
     def log_out_quit(self):
         self.logged_out.emit()
         # Lukk applikasjonen helt
@@ -244,14 +459,17 @@ class MainWindow(QMainWindow):
     def handle_login(self):
         # Hent bruker og nøkkel fra login_widget
         self.user = self.login_widget.user
-        self.key = self.login_widget.key
+        self.ciphers = self.login_widget.ciphers
+        self.repository = PasswordRepository(self.database, self.user.id)
+        self.stats = VaultStats(self.database, self.user.id, self.ciphers)
+        self.snapshot = ListingSnapshot(self.database, self.user.id, self.ciphers)
 
         # Oppdater widgets som trenger nøkkelen
         self.add_password_widget = AddPasswordWidget(
-            self.user, self.session, self.key, self
+            self.user, self.repository, self.ciphers, self
         )
         self.show_password_widget = ShowPasswordWidget(
-            self.session, self.key, self.user, self
+            self.repository, self.ciphers, self.user, self
         )
         self.backup_widget = BackupWidget(self)
         self.settings_widget = SettingsWidget(
@@ -262,16 +480,50 @@ class MainWindow(QMainWindow):
             current_font_size=(
                 self.user.settings.font_size if self.user.settings else 16
             ),
+            current_db_profile=self.get_user_settings()["db_profile"],
         )
 
-        # Koble signalene fra de nye widgetene til de riktige funksjonene
+        # Koble signalene fra de nye widgetene til de riktige funksjonene.
+        # Tellerne oppdateres først, så knappene og visningene leser nye tall.
+        self.add_password_widget.entry_added.connect(
+            lambda entry_id: self.stats.entries_added()
+        )
+        self.add_password_widget.entry_changed.connect(
+            lambda entry_id: self.stats.entries_changed()
+        )
+        self.show_password_widget.row_deleted.connect(self.stats.entries_removed)
+        self.backup_widget.sync_completed.connect(self.stats.entries_added)
         self.add_password_widget.password_saved.connect(self.update_button_states)
         self.backup_widget.sync_completed.connect(self.update_button_states)
         self.show_password_widget.row_deleted.connect(self.update_button_states)
+        self.show_password_widget.row_deleted.connect(
+            self.show_password_widget.update_tag_summary
+        )
+        self.add_password_widget.password_saved.connect(
+            self.show_password_widget.on_password_saved
+        )
+        self.add_password_widget.entry_changed.connect(
+            self.show_password_widget.on_entry_changed
+        )
+        self.backup_widget.sync_completed.connect(
+            self.show_password_widget.invalidate_search_index
+        )
+        self.backup_widget.sync_completed.connect(self.show_password_widget.invalidate)
+        self.backup_widget.sync_completed.connect(
+            lambda added: added and self.start_record_migration()
+        )
+        # Dekrypterte rader og søkeindeksen skal ikke overleve utlogging
+        self.logged_out.connect(self.show_password_widget.clear_sensitive_data)
+        self.logged_out.connect(self.stats.invalidate)
         self.settings_widget.settings_changed.connect(self.apply_settings_and_save)
         self.settings_widget.settings_cancelled.connect(
             lambda: self.switch_to_widget(self.placeholder_widget)
         )
+        self.settings_widget.retune_requested.connect(self.retune_key_strength)
+        self.settings_widget.password_change_requested.connect(
+            self.change_master_password
+        )
+        self.settings_widget.key_rotation_requested.connect(self.rotate_keys)
 
         # Legg de oppdaterte widgets til stacken
         self.stack.addWidget(self.add_password_widget)  # Indeks 2
@@ -287,6 +539,7 @@ class MainWindow(QMainWindow):
 
         # Sjekk antall passord og oppdater knappene
         self.update_button_states()
+        self.start_record_migration()
 
         self.setMinimumSize(0, 0)
         self.showMaximized()
@@ -294,6 +547,40 @@ class MainWindow(QMainWindow):
         # Bytt til placeholder widget eller hovedvisningen etter login
         self.stack.setCurrentWidget(self.placeholder_widget)
 
+    def start_record_migration(self):
+        # Oppføringer i det gamle formatet (ett Fernet-token per kolonne) gjøres
+        # om til poster, og base64-tekst til rå byte, i bakgrunnen. Etter en
+        # nøkkelrotasjon krypteres postene om med den nye generasjonen. Rader
+        # visningen allerede har lastet kan fortsatt dekrypteres.
+        if not self.ciphers.has_record_key:
+            return
+        # Den forrige jobben kan ha startet med gamle nøkler eller et eldre hvelv
+        self.stop_record_migration()
+        worker = RecordWorker(
+            self.database.engine, self.user.id, self.ciphers, self.snapshot
+        )
+        worker.error.connect(self.on_record_migration_error)
+        self.record_worker = worker
+        worker.start()
+
+    def stop_record_migration(self):
+        # Venter til biten som skrives er ferdig, så tråden aldri slippes mens
+        # den kjører og ingen rad skrives etter at nøklene er byttet eller tømt
+        worker = self.record_worker
+        if worker is None:
+            return
+        worker.cancel()
+        worker.wait()
+        self.record_worker = None
+
+    def on_record_migration_error(self, message):
+        QMessageBox.warning(
+            self,
+            "Feil",
+            f"Kunne ikke gjøre om oppføringene: {message}",
+            QMessageBox.Ok,
+        )
+
     def init_ui(self):
         self.style_manager.apply_button_style_1(self.add_password_button)
         self.style_manager.apply_button_style(self.view_password_button)
@@ -0,0 +1,201 @@
+from PySide2.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+from data.encryption import decrypt_many
+from data.repository import PAGE_SIZE
+
+
+class PasswordTableModel(QAbstractTableModel):
+    """
+    Tabellmodell som bare holder id, post og krypterte felt for hver oppføring.
+    En rad dekrypteres først når visningen ber om den, og resultatet caches
+    til modellen tømmes. Med set_page_source hentes radene side for side når
+    visningen ber om flere (canFetchMore/fetchMore).
+    """
+
+    HEADERS = ["Tjeneste", "E-post", "Brukernavn", "Passord", "Link", "Emne"]
+    # Feltet som vises i hver kolonne. Passordet vises aldri (None).
+    COLUMNS = ("service", "email", "username", None, "link", "tag")
+    FIELDS = ("service", "email", "username", "link", "tag")
+    PASSWORD_PLACEHOLDER = "*" * 4
+
+    def __init__(self, ciphers, parent=None):
+        super().__init__(parent)
+        self.ciphers = ciphers
+        self._ids = []
+        # entry_id -> (post, krypterte felt i samme rekkefølge som FIELDS), eller
+        # None for rader som kom ferdig dekryptert (set_values)
+        self._tokens = {}
+        self._decrypted = {}  # entry_id -> dekrypterte felt (dict)
+        self._fetch_page = None  # fetch_page(after_id, limit) når modellen pagineres
+        self._after_id = 0  # høyeste id som er hentet
+        self._exhausted = True
+        self.page_size = PAGE_SIZE
+
+    def _reset(self, fetch_page=None):
+        self._ids = []
+        self._tokens = {}
+        self._decrypted = {}
+        self._fetch_page = fetch_page
+        self._after_id = 0
+        self._exhausted = fetch_page is None
+
+    def set_entries(self, entries):
+        """
+        Erstatt innholdet med (entry_id, (post, tokens...))-par. Ingenting
+        dekrypteres her.
+        """
+        self.beginResetModel()
+        self._reset()
+        for entry_id, tokens in entries:
+            self._ids.append(entry_id)
+            self._tokens[entry_id] = tuple(tokens)
+        self.endResetModel()
+
+    def set_values(self, entries):
+        """
+        Erstatt innholdet med (entry_id, felt)-par som allerede er dekryptert,
+        f.eks. fra et snapshot. Ingenting hentes eller dekrypteres.
+        """
+        self.beginResetModel()
+        self._reset()
+        for entry_id, values in entries:
+            self._ids.append(entry_id)
+            self._tokens[entry_id] = None
+            self._decrypted[entry_id] = values
+        self.endResetModel()
+
+    def set_page_source(self, fetch_page, page_size=PAGE_SIZE):
+        """
+        Last rader side for side med fetch_page(after_id, limit), som gir rader
+        (id, post, felt i samme rekkefølge som FIELDS) sortert på id. Bare første
+        side hentes her.
+        """
+        self.beginResetModel()
+        self._reset(fetch_page)
+        self.page_size = page_size
+        self.endResetModel()
+        self.fetchMore()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        rows = self._fetch_page(self._after_id, self.page_size)
+        if len(rows) < self.page_size:
+            self._exhausted = True
+        if not rows:
+            return
+        first = len(self._ids)
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        for row in rows:
+            entry_id = row[0]
+            self._ids.append(entry_id)
+            self._tokens[entry_id] = tuple(row[1:])
+        self.endInsertRows()
+        self._after_id = rows[-1][0]
+
+    def fetch_all(self):
+        """Hent resten av sidene, f.eks. før et søk i hele hvelvet."""
+        while self.canFetchMore():
+            self.fetchMore()
+
+    def clear(self):
+        self.set_entries([])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._ids)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            field = self.COLUMNS[index.column()]
+            if field is None:
+                return self.PASSWORD_PLACEHOLDER
+            return self.row_values(index.row())[field]
+        if role == Qt.UserRole:
+            return self._ids[index.row()]
+        return None
+
+    def entry_id(self, row):
+        return self._ids[row]
+
+    def row_values(self, row) -> dict:
+        """Dekrypterte felt for raden, dekryptert ved første oppslag."""
+        entry_id = self._ids[row]
+        values = self._decrypted.get(entry_id)
+        if values is None:
+            try:
+                record, *tokens = self._tokens[entry_id]
+                values = self.ciphers.decrypt_entry(
+                    entry_id, record, dict(zip(self.FIELDS, tokens))
+                )
+            except Exception as e:
+                values = dict.fromkeys(self.FIELDS, "")
+                values["service"] = "(kunne ikke dekrypteres)"
+            self._decrypted[entry_id] = values
+        return values
+
+    def decrypt_all(self):
+        """
+        Dekrypter alle hentede rader som ikke allerede er dekryptert, samlet på
+        en trådpool, og returner (entry_id, felt)-par for dem.
+        """
+        missing = [
+            entry_id for entry_id in self._ids if entry_id not in self._decrypted
+        ]
+        result = decrypt_many(
+            self.ciphers,
+            [(entry_id,) + self._tokens[entry_id] for entry_id in missing],
+            self.FIELDS,
+        )
+        for entry_id, values in zip(missing, result.values):
+            if values is None:
+                values = ("(kunne ikke dekrypteres)",) + ("",) * (len(self.FIELDS) - 1)
+            self._decrypted[entry_id] = dict(zip(self.FIELDS, values))
+        return [(entry_id, self._decrypted[entry_id]) for entry_id in self._ids]
+
+    def update_entry(self, entry_id, tokens):
+        """
+        Oppdater eller legg til én oppføring med ny post og nye tokens. Bare
+        denne raden endres, og den dekrypteres igjen først når den vises.
+        """
+        tokens = tuple(tokens)
+        if entry_id in self._tokens:
+            row = self._ids.index(entry_id)
+            self._tokens[entry_id] = tokens
+            self._decrypted.pop(entry_id, None)
+            self.dataChanged.emit(
+                self.index(row, 0), self.index(row, len(self.COLUMNS) - 1)
+            )
+        elif self._exhausted:
+            # Nye oppføringer har høyest id og hører hjemme nederst. Er ikke
+            # alle sidene hentet, kommer oppføringen med en senere side.
+            row = len(self._ids)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self._ids.append(entry_id)
+            self._tokens[entry_id] = tokens
+            self.endInsertRows()
+            self._after_id = max(self._after_id, entry_id)
+
+    def remove_entry(self, entry_id):
+        if entry_id in self._tokens:
+            self.remove_row(self._ids.index(entry_id))
+
+    def remove_row(self, row):
+        entry_id = self._ids[row]
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._ids[row]
+        self._tokens.pop(entry_id, None)
+        self._decrypted.pop(entry_id, None)
+        self.endRemoveRows()
@@ -0,0 +1,41 @@
+from PySide2.QtCore import QThread, Signal
+
+from data.records import RECORD_BATCH_SIZE, upgrade_entries
+
+
+class RecordWorker(QThread):
+    """
+    Gjør om oppføringene til poster med gjeldende nøkkelgenerasjon
+    (data.records.upgrade_entries) i en egen tråd, og lager snapshotet av
+    listen når radene er à jour. cancel() stopper etter biten som skrives.
+    """
+
+    error = Signal(str)
+
+    def __init__(self, engine, user_id, ciphers, snapshot, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.user_id = user_id
+        self.ciphers = ciphers
+        self.snapshot = snapshot
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            upgrade_entries(
+                self.engine,
+                self.user_id,
+                self.ciphers,
+                RECORD_BATCH_SIZE,
+                lambda: self.cancelled,
+            )
+            # Snapshotet lages når radene er à jour, så neste visning eller
+            # innlogging slipper å dekryptere rad for rad. Det stoppes mellom
+            # bitene, så stop_record_migration ikke venter på hele hvelvet.
+            if not self.cancelled:
+                self.snapshot.refresh(should_stop=lambda: self.cancelled)
+        except Exception as e:
+            self.error.emit(str(e))
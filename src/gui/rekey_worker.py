@@ -0,0 +1,66 @@
+from PySide2.QtCore import QThread, Signal
+
+
+class RekeyWorker(QThread):
+    """
+    Kjører et passordbytte i en egen tråd så vinduet ikke fryser, både
+    kalibreringen og PBKDF2-utledningene (LoginManager.start_rekey) og
+    krypteringen av hvelvet (data.rekey.VaultRekey). cancel() stopper etter
+    biten som skrives, og byttet rulles da tilbake.
+    """
+
+    progress = Signal(int, int)  # ferdige rader, alle rader
+    result_ready = Signal(object)  # (nye nøkler eller None, feilmelding)
+
+    def __init__(
+        self, login_manager, user, password, new_password, keep_salt=False, parent=None
+    ):
+        super().__init__(parent)
+        self.login_manager = login_manager
+        self.user = user
+        self.password = password
+        self.new_password = new_password
+        self.keep_salt = keep_salt
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        job, message = self.login_manager.start_rekey(
+            self.user, self.password, self.new_password, keep_salt=self.keep_salt
+        )
+        # Passordene trengs ikke lenger
+        self.password = self.new_password = None
+        if job is None:
+            self.result_ready.emit((None, message))
+            return
+        # Ble det avbrutt under utledningen, ruller run_rekey byttet tilbake
+        result = self.login_manager.run_rekey(
+            self.user,
+            job,
+            should_stop=lambda: self.cancelled,
+            on_progress=lambda progress: self.progress.emit(*progress),
+        )
+        self.result_ready.emit(result)
+
+
+class KeyRotationWorker(QThread):
+    """
+    Sjekker hovedpassordet og går over til en ny generasjon nøkler
+    (LoginManager.rotate_keys) i en egen tråd, så vinduet ikke fryser mens
+    rotnøkkelen utledes.
+    """
+
+    result_ready = Signal(object)  # (nye nøkler eller None, feilmelding)
+
+    def __init__(self, login_manager, user, password, parent=None):
+        super().__init__(parent)
+        self.login_manager = login_manager
+        self.user = user
+        self.password = password
+
+    def run(self):
+        result = self.login_manager.rotate_keys(self.user, self.password)
+        self.password = None
+        self.result_ready.emit(result)
@@ -9,16 +9,22 @@ from PySide2.QtWidgets import (
 )
 from PySide2.QtCore import Signal, Qt
 
+from data.database import DEFAULT_PROFILE, USER_PROFILES
+
 
 class SettingsWidget(QWidget):
-    settings_changed = Signal(tuple)  # Signal for tema og font-størrelse
+    settings_changed = Signal(tuple)  # Signal for tema, font-størrelse og profil
     settings_cancelled = Signal()
+    retune_requested = Signal()  # Signal for å kalibrere nøkkelstyrken på nytt
+    password_change_requested = Signal()  # Signal for å bytte hovedpassord
+    key_rotation_requested = Signal()  # Signal for å rotere krypteringsnøklene
 
     def __init__(
         self,
         main_window,
         current_theme="default",
         current_font_size=16,
+        current_db_profile=DEFAULT_PROFILE,
         parent=None,
     ):
         super().__init__(parent)
@@ -53,9 +59,28 @@ class SettingsWidget(QWidget):
         font_size_layout.addWidget(self.font_size_label)
         font_size_layout.addWidget(self.font_size_spin)
 
+        # Layout for databaseprofil (PRAGMA-innstillinger for SQLite)
+        db_profile_layout = QHBoxLayout()
+        db_profile_layout.setSpacing(10)
+        self.db_profile_label = QLabel("Databaseprofil")
+        self.db_profile_combo = QComboBox()
+        self.db_profile_combo.addItems(USER_PROFILES)
+        self.db_profile_combo.setCurrentText(current_db_profile)
+        db_profile_layout.addWidget(self.db_profile_label)
+        db_profile_layout.addWidget(self.db_profile_combo)
+
+        # Knapp for å kalibrere nøkkelstyrken (PBKDF2-iterasjoner) for denne maskinen
+        self.retune_button = QPushButton("Juster nøkkelstyrke")
+        self.change_password_button = QPushButton("Bytt hovedpassord")
+        self.rotate_keys_button = QPushButton("Roter nøkler")
+
         # Legg til innstillingslayouts i hovedlayouten
         main_layout.addLayout(theme_layout)
         main_layout.addLayout(font_size_layout)
+        main_layout.addLayout(db_profile_layout)
+        main_layout.addWidget(self.retune_button, alignment=Qt.AlignHCenter)
+        main_layout.addWidget(self.change_password_button, alignment=Qt.AlignHCenter)
+        main_layout.addWidget(self.rotate_keys_button, alignment=Qt.AlignHCenter)
 
         # Knapper (Lagre og Avbryt)
         buttons_layout = QHBoxLayout()
@@ -70,6 +95,9 @@ class SettingsWidget(QWidget):
 
         self.save_button.clicked.connect(self.save_settings)
         self.cancel_button.clicked.connect(self.cancel_settings)
+        self.retune_button.clicked.connect(self.retune_requested.emit)
+        self.change_password_button.clicked.connect(self.password_change_requested.emit)
+        self.rotate_keys_button.clicked.connect(self.key_rotation_requested.emit)
 
         buttons_layout.addWidget(self.save_button)
         buttons_layout.addWidget(self.cancel_button)
@@ -83,16 +111,22 @@ class SettingsWidget(QWidget):
     def init_ui_settings(self):
         self.main_window.style_manager.apply_label_style(self.theme_label)
         self.main_window.style_manager.apply_label_style(self.font_size_label)
+        self.main_window.style_manager.apply_label_style(self.db_profile_label)
         self.main_window.style_manager.apply_line_edit_style(self.theme_combo)
         self.main_window.style_manager.apply_line_edit_style(self.font_size_spin)
+        self.main_window.style_manager.apply_line_edit_style(self.db_profile_combo)
         self.main_window.style_manager.apply_button_style_1(self.save_button)
         self.main_window.style_manager.apply_button_style_2(self.cancel_button)
+        self.main_window.style_manager.apply_button_style(self.retune_button)
+        self.main_window.style_manager.apply_button_style(self.change_password_button)
+        self.main_window.style_manager.apply_button_style(self.rotate_keys_button)
 
     def save_settings(self):
         theme = self.theme_combo.currentText()
         font_size = self.font_size_spin.value()
+        db_profile = self.db_profile_combo.currentText()
         self.init_ui_settings()
-        self.settings_changed.emit((theme, font_size))
+        self.settings_changed.emit((theme, font_size, db_profile))
 
     def cancel_settings(self):
         self.settings_cancelled.emit()
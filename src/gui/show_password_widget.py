@@ -1,9 +1,10 @@
 import webbrowser
 from PySide2.QtWidgets import (
     QWidget,
+    QLabel,
     QLineEdit,
-    QTableWidget,
-    QTableWidgetItem,
+    QTableView,
+    QAbstractItemView,
     QVBoxLayout,
     QHBoxLayout,
     QPushButton,
@@ -12,23 +13,32 @@ from PySide2.QtWidgets import (
     QSizePolicy,
     QHeaderView,
 )
-from PySide2.QtCore import Signal, Qt
+from PySide2.QtCore import Signal, Qt, QTimer
 
-from data.models import PasswordEntry
-from data.encryption import decrypt_password
+from gui.password_table_model import PasswordTableModel
+from utils.search_index import SearchIndex
 
 
 class ShowPasswordWidget(QWidget):
     row_deleted = Signal()
 
-    def __init__(self, session, key, user, main_window):
+    def __init__(self, repository, ciphers, user, main_window):
         super().__init__()
 
-        self.session = session
-        self.key = key
+        self.repository = repository
+        self.ciphers = ciphers
         self.user = user
         self.main_window = main_window
 
+        # Søkeindeksen bygges første gang brukeren søker og oppdateres deretter
+        # for hver endring. Den finnes bare i minnet.
+        self.search_index = SearchIndex()
+        self.search_index_ready = False
+
+        # Modellen og de dekrypterte radene beholdes mellom visninger i økten.
+        # Endringer patches inn rad for rad, se on_entry_changed.
+        self.loaded = False
+
         self.setStyleSheet("background-color: #d1e8e2;")
         self.setWindowTitle("Vis Passord")
 
@@ -41,11 +51,16 @@ class ShowPasswordWidget(QWidget):
         search_layout.addWidget(self.search_input)
         search_layout.setAlignment(Qt.AlignTop)
 
+        # Antall oppføringer per emne, fra VaultStats
+        self.tag_summary_label = QLabel()
+        self.tag_summary_label.setWordWrap(True)
+
         # Sett opp hovedlayout
         main_layout = QVBoxLayout()
         main_layout.setContentsMargins(20, 20, 20, 20)
         main_layout.setSpacing(30)
         main_layout.addLayout(search_layout)
+        main_layout.addWidget(self.tag_summary_label)
 
         self.setLayout(main_layout)
 
@@ -82,10 +97,10 @@ class ShowPasswordWidget(QWidget):
         button_layout.addLayout(button_layout_2)
 
         main_layout.addLayout(button_layout)
-        main_layout.addStretch()
 
     def init_ui_show_pw(self):
         self.main_window.style_manager.apply_line_edit_style(self.search_input)
+        self.main_window.style_manager.apply_label_style(self.tag_summary_label)
         self.main_window.style_manager.apply_table_style(self.table)
         self.main_window.style_manager.apply_button_style_1(self.copy_button)
         self.main_window.style_manager.apply_button_style_1(self.go_to_web_button)
@@ -97,19 +112,18 @@ class ShowPasswordWidget(QWidget):
         )
 
     def setup_table(self):
-        # Opprett tabell
-        self.table = QTableWidget()
-        self.table.setColumnCount(6)
-        self.table.setHorizontalHeaderLabels(
-            ["Tjeneste", "E-post", "Brukernavn", "Passord", "Link", "Emne"]
-        )
+        # Opprett tabell med en modell som dekrypterer rader ved behov
+        self.model = PasswordTableModel(self.ciphers, self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
 
         header = self.table.horizontalHeader()
 
-        # Sett resize mode for hver kolonne
+        # Sett resize mode for hver kolonne. Ingen kolonner bruker
+        # ResizeToContents, siden det ville dekryptert alle radene for å måle dem.
         header.setSectionResizeMode(0, QHeaderView.Stretch)  # Tjeneste
         header.setSectionResizeMode(1, QHeaderView.Stretch)  # E-post
-        header.setSectionResizeMode(2, QHeaderView.ResizeToContents)  # Brukernavn
+        header.setSectionResizeMode(2, QHeaderView.Interactive)  # Brukernavn
         header.setSectionResizeMode(3, QHeaderView.Fixed)  # Passord
         header.setSectionResizeMode(4, QHeaderView.Stretch)  # Link
         header.setSectionResizeMode(5, QHeaderView.Fixed)  # Emne
@@ -124,27 +138,53 @@ class ShowPasswordWidget(QWidget):
         # Sett sizePolicy for å fylle plassen dynamisk
         self.table.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
 
-        # Sett en standard radhøyde
+        # Lik radhøyde for alle rader, slik at bare synlige rader blir spurt om data
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.table.verticalHeader().setDefaultSectionSize(60)
 
         # Tillat valg av celler, ikke bare rader
-        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
-        self.table.setSelectionBehavior(QTableWidget.SelectRows)
-        self.table.setSelectionMode(QTableWidget.SingleSelection)
-        self.table.cellDoubleClicked.connect(self.view_password)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.doubleClicked.connect(
+            lambda index: self.view_password(index.row(), index.column())
+        )
 
-        # Legg til tabellen i layouten
+        # Legg til tabellen i layouten, den får all ledig plass og egen scrollbar
         main_layout = self.layout()
-        main_layout.addWidget(self.table)
-        main_layout.addStretch()
+        main_layout.addWidget(self.table, 1)
+
+        # Neste side hentes når hendelsesløkken er ledig og de synlige radene
+        # nærmer seg slutten av det som er lastet. Visningen selv henter også
+        # mer når brukeren scroller helt ned.
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(0)
+        self.prefetch_timer.timeout.connect(self.prefetch_page)
+        self.table.verticalScrollBar().valueChanged.connect(self.prefetch_timer.start)
 
     def load_passwords(self):
-        self.table.setRowCount(0)  # Tøm tabellen først
-        # Filtrer passordene til den innloggede brukeren
-        passwords = (
-            self.session.query(PasswordEntry).filter_by(user_id=self.user.id).all()
-        )
-        if not passwords:
+        # Med et gyldig snapshot kommer hele listen ferdig dekryptert fra én
+        # blob. Ellers henter modellen bare første side med krypterte felt,
+        # resten etter hvert som det trengs.
+        entries = self.main_window.snapshot.load()
+        if entries is not None:
+            self.model.set_values(entries)
+        else:
+            self.model.set_page_source(self.repository.fetch_page)
+        self.loaded = True
+        # Søkeindeksen holdes oppdatert ved lagring og sletting, men må bygges
+        # på nytt hvis hvelvet er endret på annen måte
+        if (
+            self.search_index_ready
+            and len(self.search_index) != self.main_window.stats.count()
+        ):
+            self.invalidate_search_index()
+        if self.search_input.text():
+            self.filter_passwords(self.search_input.text())
+        else:
+            self.prefetch_timer.start()
+        if not self.model.rowCount():
             QMessageBox.information(
                 self,
                 "Ingen Passord",
@@ -152,83 +192,113 @@ class ShowPasswordWidget(QWidget):
                 QMessageBox.Ok,
             )
             return  # Avslutt funksjonen tidlig hvis ingen passord finnes
-        for entry in passwords:
-            try:
-                decrypted_service = decrypt_password(entry.service, self.key["service"])
-                decrypted_email = decrypt_password(entry.email, self.key["email"])
-                decrypted_username = decrypt_password(
-                    entry.username, self.key["username"]
-                )
-                decrypted_link = decrypt_password(entry.link, self.key["link"])
-                decrypted_tag = decrypt_password(entry.tag, self.key["tag"])
-
-                self.add_table_row(
-                    {
-                        "id": entry.id,
-                        "service": decrypted_service,
-                        "email": decrypted_email,
-                        "username": decrypted_username,
-                        "link": decrypted_link,
-                        "tag": decrypted_tag,
-                    }
-                )
-            except Exception as e:
-                QMessageBox.critical(
-                    self, "Feil", f"Kunne ikke dekryptere passord: {str(e)}"
-                )
 
-        # Etter radene er lagt til, juster høyden på tabellen basert på antall rader
-        row_count = self.table.rowCount()
-        row_height = self.table.verticalHeader().defaultSectionSize()
-        header_height = self.table.horizontalHeader().height()
-        total_height = row_count * row_height + header_height + 2  # Juster for marginer
-
-        # Sett tabellens høyde basert på antall rader
-        self.table.setMinimumHeight(total_height)
-        self.table.setMaximumHeight(total_height)
-
-    def add_table_row(self, entry):
-        row_position = self.table.rowCount()
-        self.table.insertRow(row_position)
-
-        # Liste over feltene
-        columns = ["service", "email", "username", "*", "link", "tag"]
-        for col_index, field in enumerate(columns):
-            if field == "*":
-                item = QTableWidgetItem("*" * 4)  # Placeholder for passord
-            else:
-                item = QTableWidgetItem(entry[field])
-
-            # Lagre entry.id i den første cellen
-            if col_index == 0:
-                item.setData(Qt.UserRole, entry["id"])
+    def ensure_loaded(self):
+        # Uendret liste vises som den er, uten spørringer eller dekryptering
+        if not self.loaded:
+            self.load_passwords()
+        self.update_tag_summary()
+
+    def update_tag_summary(self):
+        # Tellingen er cachet til hvelvet endres, så dette er gratis ved ny visning
+        parts = []
+        for tag, count in self.main_window.stats.tag_counts():
+            if tag is None:
+                tag = "(ukjent)"
+            elif not tag:
+                tag = "(uten emne)"
+            parts.append(f"{tag} ({count})")
+        self.tag_summary_label.setText("Emner: " + " · ".join(parts) if parts else "")
+
+    def invalidate(self):
+        # Hele listen lastes på nytt neste gang den vises, f.eks. etter
+        # synkronisering eller nye nøkler
+        self.loaded = False
+
+    def on_entry_changed(self, entry_id):
+        # Patch bare raden som er endret. Er listen ikke lastet, tar neste
+        # lasting med endringen uansett.
+        if not self.loaded:
+            return
+        row = self.repository.fetch_row(entry_id)
+        if row is None:
+            self.model.remove_entry(entry_id)
+            self.search_index.remove(entry_id)
+        else:
+            self.model.update_entry(row.id, row[1:])
+        if self.search_input.text():
+            self.filter_passwords(self.search_input.text())
+        self.update_tag_summary()
+
+    def selected_row(self):
+        """Raden som er valgt i tabellen, eller None."""
+        rows = self.table.selectionModel().selectedRows()
+        return rows[0].row() if rows else None
+
+    def prefetch_page(self):
+        if not self.model.canFetchMore():
+            return
+        last_visible = self.table.rowAt(self.table.viewport().height() - 1)
+        if last_visible < 0:
+            # Alle radene får plass i visningen
+            last_visible = self.model.rowCount() - 1
+        if self.model.rowCount() - last_visible <= self.model.page_size:
+            self.model.fetchMore()
+
+    def ensure_search_index(self):
+        if self.search_index_ready:
+            return
+        self.search_index.clear()
+        for entry_id, values in self.model.decrypt_all():
+            self.search_index.add(entry_id, values.values())
+        self.search_index_ready = True
+
+    def invalidate_search_index(self):
+        self.search_index.clear()
+        self.search_index_ready = False
+
+    def on_password_saved(self, data):
+        # Oppdater søkeindeksen og snapshotet for oppføringen som ble lagt til
+        # eller endret
+        if data.get("id") is None:
+            return
+        if self.search_index_ready:
+            self.search_index.add(
+                data["id"], [data[field] for field in self.model.FIELDS]
+            )
+        self.main_window.snapshot.patch(data["id"], data)
 
-            self.table.setItem(row_position, col_index, item)
+    def clear_sensitive_data(self):
+        self.model.clear()
+        self.tag_summary_label.clear()
+        self.loaded = False
+        self.invalidate_search_index()
 
     def filter_passwords(self, text):
-        for row in range(self.table.rowCount()):
-            match = False
-            for column in range(self.table.columnCount()):
-                item = self.table.item(row, column)
-                if text.lower() in item.text().lower():
-                    match = True
-                    break
-            self.table.setRowHidden(row, not match)
+        if text:
+            # Søket gjelder hele hvelvet, så resten av sidene må hentes
+            self.model.fetch_all()
+            self.ensure_search_index()
+            matches = self.search_index.search(text)
+        else:
+            matches = None
+
+        # Endre bare rader som faktisk bytter synlighet
+        for row in range(self.model.rowCount()):
+            hidden = matches is not None and self.model.entry_id(row) not in matches
+            if self.table.isRowHidden(row) != hidden:
+                self.table.setRowHidden(row, hidden)
 
     def view_password(self, row, column):
         try:
             # Hvis brukeren dobbeltklikker på passord-kolonnen (kolonne 3)
             if column == 3:
-                service_item = self.table.item(row, 0)
-                entry_id = service_item.data(Qt.UserRole)
-                entry = self.session.query(PasswordEntry).filter_by(id=entry_id).first()
-
-                if entry:
-                    # Dekrypter passordet
-                    decrypted_password = decrypt_password(
-                        entry.encrypted_password, self.key["password"]
-                    )
+                entry_id = self.model.entry_id(row)
+                decrypted_password = self.repository.get_password(
+                    self.ciphers, entry_id
+                )
 
+                if decrypted_password:
                     # Kopier det dekrypterte passordet til utklippstavlen
                     QApplication.clipboard().setText(decrypted_password)
                     copied_text = QApplication.clipboard().text()
@@ -245,7 +315,7 @@ class ShowPasswordWidget(QWidget):
                     )
             else:
                 # For alle andre kolonner, kopier innholdet som det er
-                cell_text = self.table.item(row, column).text()
+                cell_text = self.model.row_values(row)[self.model.COLUMNS[column]]
                 QApplication.clipboard().setText(cell_text)
                 copied_text = QApplication.clipboard().text()
 
@@ -259,22 +329,17 @@ class ShowPasswordWidget(QWidget):
             QMessageBox.critical(self, "Feil", f"Kunne ikke kopiere tekst: {str(e)}")
 
     def copy_password(self):
-        selected_items = self.table.selectedItems()
-        if not selected_items:
+        row = self.selected_row()
+        if row is None:
             QMessageBox.warning(
                 self, "Ingen Valgt", "Vennligst velg et passord fra tabellen."
             )
             return
 
-        row = selected_items[0].row()
-        service_item = self.table.item(row, 0)
-        entry_id = service_item.data(Qt.UserRole)
+        entry_id = self.model.entry_id(row)
         try:
-            entry = self.session.query(PasswordEntry).filter_by(id=entry_id).first()
-            if entry:
-                decrypted_password = decrypt_password(
-                    entry.encrypted_password, self.key["password"]
-                )
+            decrypted_password = self.repository.get_password(self.ciphers, entry_id)
+            if decrypted_password:
                 QApplication.clipboard().setText(decrypted_password)
                 copied_text = QApplication.clipboard().text()
                 QMessageBox.information(
@@ -284,17 +349,16 @@ class ShowPasswordWidget(QWidget):
             QMessageBox.critical(self, "Feil", f"Kunne ikke kopiere passord: {str(e)}")
 
     def delete_row(self):
-        selected_items = self.table.selectedItems()
-        if not selected_items:
+        row = self.selected_row()
+        if row is None:
             QMessageBox.warning(
                 self, "Ingen Valgt", "Vennligst velg et passord fra tabellen."
             )
             return
 
-        # Hent raden og entry_id fra tabellen
-        row = selected_items[0].row()
-        entry_id = self.table.item(row, 0).data(Qt.UserRole)
-        service = self.table.item(row, 0).text()
+        # Hent entry_id og tjenesten fra modellen
+        entry_id = self.model.entry_id(row)
+        service = self.model.row_values(row)["service"]
 
         # Bekreft sletting
         reply = QMessageBox.question(
@@ -307,11 +371,10 @@ class ShowPasswordWidget(QWidget):
 
         if reply == QMessageBox.Yes:
             try:
-                entry = self.session.query(PasswordEntry).get(entry_id)
-                if entry:
-                    self.session.delete(entry)
-                    self.session.commit()
-                    self.table.removeRow(row)
+                if self.repository.delete(entry_id):
+                    self.model.remove_row(row)
+                    self.search_index.remove(entry_id)
+                    self.main_window.snapshot.patch(entry_id, None)
                     self.row_deleted.emit()
                 else:
                     QMessageBox.warning(
@@ -323,42 +386,20 @@ class ShowPasswordWidget(QWidget):
                 )
 
     def edit_row(self):
-        selected_items = self.table.selectedItems()
-        if not selected_items:
+        row = self.selected_row()
+        if row is None:
             QMessageBox.warning(
                 self, "Ingen Valgt", "Vennligst velg et passord fra tabellen."
             )
             return
 
         # Hent raden som er valgt
-        row = selected_items[0].row()
-        service_item = self.table.item(row, 0)
-        entry_id = service_item.data(Qt.UserRole)
+        entry_id = self.model.entry_id(row)
 
         try:
-            entry = self.session.query(PasswordEntry).filter_by(id=entry_id).first()
-            if entry:
-                # Dekrypter feltene
-                decrypted_service = decrypt_password(entry.service, self.key["service"])
-                decrypted_email = decrypt_password(entry.email, self.key["email"])
-                decrypted_username = decrypt_password(
-                    entry.username, self.key["username"]
-                )
-                decrypted_password = decrypt_password(
-                    entry.encrypted_password, self.key["password"]
-                )
-                decrypted_link = decrypt_password(entry.link, self.key["link"])
-                decrypted_tag = decrypt_password(entry.tag, self.key["tag"])
-
-                # Sett dataene i redigeringswidgeten (AddPasswordWidget eller liknende)
-                password_data = {
-                    "service": decrypted_service,
-                    "email": decrypted_email,
-                    "username": decrypted_username,
-                    "password": decrypted_password,
-                    "link": decrypted_link,
-                    "tag": decrypted_tag,
-                }
+            # Dekrypter feltene og sett dataene i redigeringswidgeten
+            password_data = self.repository.get_fields(self.ciphers, entry_id)
+            if password_data:
                 self.main_window.show_add_password_widget()
                 self.main_window.add_password_widget.fill_fields(
                     password_data, entry_id
@@ -371,18 +412,15 @@ class ShowPasswordWidget(QWidget):
             QMessageBox.critical(self, "Feil", f"Kunne ikke hente passordet: {str(e)}")
 
     def go_to_web(self):
-        selected_items = self.table.selectedItems()
-        if not selected_items:
+        row = self.selected_row()
+        if row is None:
             QMessageBox.warning(
                 self, "Ingen Valgt", "Vennligst velg et passord fra tabellen."
             )
             return
 
-        # Hent raden som er valgt
-        row = selected_items[0].row()
-
-        # Hent data fra den nødvendige kolonnen
-        link = self.table.item(row, 4).text()
+        # Hent linken fra den valgte raden
+        link = self.model.row_values(row)["link"]
 
         # Sjekk at linken ikke er tom
         if not link:
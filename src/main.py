@@ -26,8 +26,7 @@ def main():
     login_manager = LoginManager(db_path)
 
     # Opprett hovedvinduet
-    main_window = MainWindow(None, login_manager.session, None, db_path)
-    main_window.login_manager = login_manager
+    main_window = MainWindow(db_path, login_manager=login_manager)
     main_window.show()
 
     sys.exit(app.exec_())
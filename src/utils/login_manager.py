@@ -1,23 +1,61 @@
 import base64
 import datetime
 import os
-from data.encryption import derive_key_for_column, hash_password
-from data.database import get_engine, create_tables, get_session
-from data.models import User, Settings
+from sqlalchemy import or_
+from data.encryption import (
+    KEY_SCHEME_HKDF,
+    IDENTITY_COLUMNS,
+    LEGACY_KEYS,
+    TARGET_UNLOCK_MS,
+    calibrate_iterations,
+    derive_keys_from_root,
+    derive_legacy_keys,
+    derive_root_key,
+    hash_root_key,
+    pack_legacy_keys,
+    unpack_legacy_keys,
+    unwrap_key,
+    verify_hash,
+    wrap_key,
+    ColumnCipherSet,
+)
+from data.database import get_database
+from data.models import (
+    User,
+    Settings,
+    PasswordEntry,
+    RekeyState,
+    ENCRYPTED_ATTRIBUTES,
+)
+from data.rekey import VaultRekey, rekey_label
+from data.repository import encrypt_entry, load_user
+
+
+def legacy_label(user_id) -> str:
+    """Label for wrap_key/unwrap_key av nøklene fra gammelt skjema."""
+    return f"legacy/{user_id}"
 
 
 class LoginManager:
-    def __init__(self, db_path):
+    def __init__(self, db_path, kdf_workers=None):
         self.db_path = db_path
-        self.engine = get_engine(db_path)
-        create_tables(self.engine)
-        self.session = get_session(self.engine)
+        # Antall tråder for nøkkelutledning i gammelt skjema (1 slår av parallellitet)
+        self.kdf_workers = kdf_workers
+        # Engine og skjema deles med resten av prosessen via registeret
+        self.database = get_database(db_path)
+        self.engine = self.database.engine
 
     def authenticate_user(self, username: str, password: str) -> tuple:
         """
         Authenticate user and return (user, derived_key) if successful, else (None, None)
+
+        Brukeren returneres frakoblet sesjonen, med innstillingene lastet.
         """
-        user = self.session.query(User).filter_by(username=username).first()
+        with self.database.session_scope() as session:
+            return self._authenticate(session, username, password)
+
+    def _authenticate(self, session, username: str, password: str) -> tuple:
+        user = load_user(session, username=username)
         if not user:
             return (None, None, "Bruker eksisterer ikke.")
 
@@ -31,21 +69,38 @@ class LoginManager:
 
         try:
             salt = base64.b64decode(user.salt)
-            computed_hash = hash_password(password, salt)
-            if computed_hash == user.password_hash:
-                # Utlede nøkler for hver kolonne som trenger kryptering
-                derived_keys = {
-                    "service": derive_key_for_column(password, salt, "service"),
-                    "email": derive_key_for_column(password, salt, "email"),
-                    "username": derive_key_for_column(password, salt, "username"),
-                    "password": derive_key_for_column(password, salt, "password"),
-                    "link": derive_key_for_column(password, salt, "link"),
-                    "tag": derive_key_for_column(password, salt, "tag"),
-                }
+            if user.key_scheme == KEY_SCHEME_HKDF:
+                # Én strekking av hovedpassordet, resten utledes med HKDF
+                root_key = derive_root_key(password, salt, user.kdf_iterations)
+                valid = verify_hash(hash_root_key(root_key), user.password_hash)
+                if user.rekey_state is not None:
+                    root_key, valid = self.recover_rekey(
+                        session, user, password, root_key if valid else None
+                    )
+            else:
+                # Gammelt skjema: alle syv PBKDF2-kjøringene går samtidig
+                computed_hash, legacy_keys = derive_legacy_keys(
+                    password,
+                    salt,
+                    iterations=user.kdf_iterations,
+                    workers=self.kdf_workers,
+                )
+                valid = verify_hash(computed_hash, user.password_hash)
+
+            if valid:
+                if user.key_scheme == KEY_SCHEME_HKDF:
+                    # Også rett etter en rotasjon: eldre generasjoner er bare
+                    # noen flere HKDF-kall, radene krypteres om i bakgrunnen
+                    derived_keys = self.user_keys(user, root_key)
+                else:
+                    derived_keys = self.upgrade_key_scheme(
+                        session, user, password, legacy_keys
+                    )
+                self.backfill_derived_columns(session, user.id, derived_keys)
                 # Reseter mislykket forsøk når man klarer å logge inn
                 user.failed_attempts = 0
                 user.lockout_until = None
-                self.session.commit()
+                session.commit()
                 return (user, derived_keys, None)
             else:
                 user.failed_attempts += 1
@@ -58,34 +113,328 @@ class LoginManager:
                     )
                     user.lockout_until = current_time + lockout_duration
 
-                self.session.commit()
+                session.commit()
                 return (None, None, "Ugyldig passord.")
         except Exception as e:
+            session.rollback()
             return (None, None, "En feil oppstod under autentisering.")
 
-    def register_user(self, username: str, password: str) -> bool:
-        existing_user = self.session.query(User).filter_by(username=username).first()
+    def upgrade_key_scheme(
+        self, session, user, password: str, legacy_keys: dict
+    ) -> dict:
+        """
+        Flytt en bruker fra gammelt nøkkelskjema (én PBKDF2 per kolonne) til
+        skjema 2. Alle oppføringer krypteres på nytt med de nye nøklene.
+        Returnerer nøklene brukeren skal bruke videre i denne økten.
+        """
+        # Nytt salt: det gamle verifikatoret er PBKDF2(passord, salt), altså
+        # det samme som rotnøkkelen ville blitt med gammelt salt.
+        new_salt = os.urandom(16)
+        root_key = derive_root_key(password, new_salt, user.kdf_iterations)
+        new_keys = derive_keys_from_root(root_key, generation=user.key_generation)
+
+        # Backuper fra før oppgraderingen er kryptert med de gamle nøklene.
+        # De lagres kryptert under den nye rotnøkkelen, så de kan leses uten
+        # passordet. Det gamle saltet kan ikke brukes videre: da ville
+        # rotnøkkelen vært lik verifikatoren som ligger i eldre kopier av
+        # databasen.
+        wrapped_legacy_keys = wrap_key(
+            root_key, pack_legacy_keys(legacy_keys), legacy_label(user.id)
+        )
+        new_keys[LEGACY_KEYS] = legacy_keys
+
+        try:
+            self.reencrypt_entries(session, user.id, legacy_keys, new_keys)
+        except Exception as e:
+            # Behold gammelt skjema og prøv igjen ved neste innlogging
+            session.rollback()
+            # rollback utløper brukeren, last den inn igjen med innstillingene
+            # så den kan brukes etter at sesjonen er lukket
+            session.refresh(user)
+            session.refresh(user, ["settings"])
+            return legacy_keys
+
+        user.salt = base64.b64encode(new_salt).decode()
+        user.password_hash = hash_root_key(root_key)
+        user.key_scheme = KEY_SCHEME_HKDF
+        user.legacy_keys = wrapped_legacy_keys
+        return new_keys
+
+    def user_keys(self, user, root_key, wrapped_legacy_keys=None) -> dict:
+        """
+        Nøkkelsettet til en bruker i skjema 2. Det utledes fra rotnøkkelen med
+        brukerens nøkkelgenerasjon, og de eldre generasjonene som fortsatt har
+        rader. Har brukeren nøkler fra gammelt skjema,
+        kommer de med. De ligger kryptert under rotnøkkelen, i
+        wrapped_legacy_keys eller ellers i users.legacy_keys.
+        """
+        keys = derive_keys_from_root(
+            root_key,
+            generation=user.key_generation,
+            oldest_generation=user.oldest_key_generation,
+        )
+        if wrapped_legacy_keys is None:
+            wrapped_legacy_keys = user.legacy_keys
+        if wrapped_legacy_keys:
+            keys[LEGACY_KEYS] = unpack_legacy_keys(
+                unwrap_key(root_key, wrapped_legacy_keys, legacy_label(user.id))
+            )
+        return keys
+
+    def start_rekey(
+        self,
+        user,
+        password: str,
+        new_password: str,
+        iterations=None,
+        target_ms=TARGET_UNLOCK_MS,
+        keep_salt=False,
+    ) -> tuple:
+        """
+        Begynn et bytte til nye nøkler fra new_password med nytt salt (eller
+        det gamle med keep_salt) og iterasjoner (kalibrert hvis None).
+        Returnerer (VaultRekey, None) eller (None, feilmelding). Oppføringene
+        krypteres først når jobben kjøres, og brukeren beholder det gamle
+        passordet til den er fullført.
+        """
+        if user.key_scheme != KEY_SCHEME_HKDF:
+            return (None, "Brukeren må logge inn på nytt før nøklene kan byttes.")
+
+        try:
+            salt = base64.b64decode(user.salt)
+            root_key = derive_root_key(password, salt, user.kdf_iterations)
+            if not verify_hash(hash_root_key(root_key), user.password_hash):
+                return (None, "Ugyldig passord.")
+
+            if iterations is None:
+                iterations = calibrate_iterations(target_ms)
+            if keep_salt and new_password == password:
+                if iterations == user.kdf_iterations:
+                    # Samme salt, passord og kostnad gir de samme nøklene
+                    return (None, "Nøklene er allerede kalibrert for denne maskinen.")
+            new_salt = salt if keep_salt else os.urandom(16)
+            new_root_key = derive_root_key(new_password, new_salt, iterations)
+
+            old_keys = self.user_keys(user, root_key)
+            # Nøklene fra gammelt skjema følger med til den nye rotnøkkelen
+            new_legacy_keys = None
+            if LEGACY_KEYS in old_keys:
+                new_legacy_keys = wrap_key(
+                    new_root_key,
+                    pack_legacy_keys(old_keys[LEGACY_KEYS]),
+                    legacy_label(user.id),
+                )
+
+            label = rekey_label(user.id)
+            with self.database.session_scope() as session:
+                if session.get(RekeyState, user.id) is not None:
+                    return (None, "Et passordbytte pågår allerede.")
+                session.add(
+                    RekeyState(
+                        user_id=user.id,
+                        salt=base64.b64encode(new_salt).decode(),
+                        password_hash=hash_root_key(new_root_key),
+                        kdf_iterations=iterations,
+                        legacy_keys=new_legacy_keys,
+                        old_root=wrap_key(new_root_key, root_key, label),
+                        new_root=wrap_key(root_key, new_root_key, label),
+                    )
+                )
+            new_keys = self.user_keys(user, new_root_key, new_legacy_keys or b"")
+        except Exception as e:
+            return (None, "En feil oppstod under bytte av nøklene.")
+
+        job = VaultRekey(self.database, user.id, old_keys, new_keys)
+        return (job, None)
+
+    def rotate_keys(self, user, password: str) -> tuple:
+        """
+        Gå over til en ny generasjon krypteringsnøkler. Returnerer (nye
+        nøkler, None) eller (None, feilmelding). Ingen rader skrives her:
+        nøklene fra eldre generasjoner er med i nøkkelsettet, så hvelvet kan
+        leses mens upgrade_entries krypterer det om i bakgrunnen.
+        """
+        if user.key_scheme != KEY_SCHEME_HKDF:
+            return (None, "Brukeren må logge inn på nytt før nøklene kan byttes.")
+
+        try:
+            salt = base64.b64decode(user.salt)
+            root_key = derive_root_key(password, salt, user.kdf_iterations)
+            if not verify_hash(hash_root_key(root_key), user.password_hash):
+                return (None, "Ugyldig passord.")
+
+            with self.database.session_scope() as session:
+                if session.get(RekeyState, user.id) is not None:
+                    return (None, "Et passordbytte pågår allerede.")
+                stored = session.get(User, user.id)
+                stored.key_generation += 1
+                generation = stored.key_generation
+        except Exception as e:
+            return (None, "En feil oppstod under rotasjon av nøklene.")
+
+        user.key_generation = generation
+        return (self.user_keys(user, root_key), None)
+
+    def change_master_password(
+        self, user, password: str, new_password: str, iterations=None
+    ) -> tuple:
+        """
+        Bytt hovedpassord og krypter hvelvet på nytt. Returnerer
+        (nye nøkler, None) eller (None, feilmelding). Den frakoblede user
+        oppdateres først når byttet er fullført.
+        """
+        job, message = self.start_rekey(user, password, new_password, iterations)
+        if job is None:
+            return (None, message)
+        return self.run_rekey(user, job)
+
+    def retune_kdf(self, user, password: str, target_ms=TARGET_UNLOCK_MS) -> tuple:
+        """
+        Kalibrer PBKDF2-kostnaden for denne maskinen på nytt og utled nye
+        nøkler. Saltet beholdes, men nøklene følger iterasjonene, så backuper
+        tatt før endringen kan ikke gjenopprettes etterpå. Returnerer (nye
+        nøkler, None) eller (None, feilmelding). Den frakoblede user
+        oppdateres først når endringen er lagret.
+        """
+        job, message = self.start_rekey(
+            user, password, password, target_ms=target_ms, keep_salt=True
+        )
+        if job is None:
+            return (None, message)
+        return self.run_rekey(user, job)
+
+    def run_rekey(self, user, job, should_stop=None, on_progress=None) -> tuple:
+        """
+        Kjør et passordbytte ferdig. Feiler det, rulles det tilbake så langt
+        det lar seg gjøre; resten tas ved neste innlogging (recover_rekey).
+        Stoppes det med should_stop, rulles det tilbake.
+        """
+        try:
+            if job.run(should_stop, on_progress):
+                for name, value in job.credentials.items():
+                    setattr(user, name, value)
+                return (job.new_keys, None)
+            message = "Byttet av nøklene ble avbrutt."
+        except Exception as e:
+            message = "En feil oppstod under bytte av nøklene."
+        try:
+            job.rollback(on_progress=on_progress)
+        except Exception as e:
+            pass
+        return (None, message)
+
+    def recover_rekey(self, session, user, password: str, root_key) -> tuple:
+        """
+        Gjør ferdig et passordbytte som ble avbrutt, f.eks. av at appen
+        krasjet. Med det nye passordet fullføres byttet, med det gamle
+        (root_key er da rotnøkkelen det ga) rulles det tilbake. Returnerer
+        (rotnøkkel, gyldig) for passordet brukeren ender opp med.
+        """
+        state = user.rekey_state
+        label = rekey_label(user.id)
+        if root_key is not None:
+            old_root_key = root_key
+            new_root_key = unwrap_key(old_root_key, state.new_root, label)
+        else:
+            new_root_key = derive_root_key(
+                password, base64.b64decode(state.salt), state.kdf_iterations
+            )
+            if not verify_hash(hash_root_key(new_root_key), state.password_hash):
+                return (None, False)
+            old_root_key = unwrap_key(new_root_key, state.old_root, label)
+
+        job = VaultRekey(
+            self.database,
+            user.id,
+            self.user_keys(user, old_root_key),
+            self.user_keys(user, new_root_key, state.legacy_keys or b""),
+        )
+        if root_key is not None:
+            job.rollback()
+        else:
+            job.run()
+        # Jobben har endret users og rekey_state utenom sesjonen
+        session.refresh(user)
+        session.refresh(user, ["settings", "rekey_state"])
+        return (old_root_key if root_key is not None else new_root_key, True)
+
+    def reencrypt_entries(self, session, user_id, old_keys: dict, new_keys: dict):
+        """Krypter alle brukerens oppføringer på nytt. Committer ikke."""
+        old_ciphers = ColumnCipherSet(old_keys)
+        new_ciphers = ColumnCipherSet(new_keys)
+        entries = session.query(PasswordEntry).filter_by(user_id=user_id).all()
+        for entry in entries:
+            tokens = {
+                column: getattr(entry, attribute)
+                for column, attribute in ENCRYPTED_ATTRIBUTES.items()
+            }
+            plaintext = old_ciphers.decrypt_entry(entry.id, entry.record, tokens)
+            # Blind-indekser og fingeravtrykk avhenger også av nøklene
+            for name, value in encrypt_entry(new_ciphers, entry.id, plaintext).items():
+                setattr(entry, name, value)
+
+    def backfill_derived_columns(self, session, user_id, keys: dict):
+        """
+        Fyll inn blind-indekser og fingeravtrykk for oppføringer som mangler
+        dem, f.eks. rader fra før kolonnene fantes. Committer ikke.
+        """
+        ciphers = ColumnCipherSet(keys)
+        if not ciphers.has_blind_index:
+            return
+        entries = (
+            session.query(PasswordEntry)
+            .filter(
+                PasswordEntry.user_id == user_id,
+                or_(
+                    PasswordEntry.service_bidx.is_(None),
+                    PasswordEntry.email_bidx.is_(None),
+                    PasswordEntry.tag_bidx.is_(None),
+                    PasswordEntry.fingerprint.is_(None),
+                ),
+            )
+            .all()
+        )
+        for entry in entries:
+            try:
+                plaintext = ciphers.decrypt_entry(
+                    entry.id,
+                    entry.record,
+                    {column: getattr(entry, column) for column in IDENTITY_COLUMNS},
+                )
+            except Exception as e:
+                # En ødelagt oppføring skal ikke stoppe innloggingen
+                continue
+            for attribute, value in ciphers.derived_columns(plaintext).items():
+                setattr(entry, attribute, value)
+
+    def register_user(self, username: str, password: str, iterations=None) -> bool:
+        with self.database.session_scope() as session:
+            existing_user = session.query(User.id).filter_by(username=username).first()
         if existing_user:
             return False
 
         try:
+            if iterations is None:
+                iterations = calibrate_iterations()
             salt = os.urandom(16)
-            hashed_password = hash_password(password, salt)
             new_user = User(
                 username=username,
-                password_hash=hashed_password,
+                password_hash=hash_root_key(
+                    derive_root_key(password, salt, iterations)
+                ),
                 salt=base64.b64encode(salt).decode(),
+                key_scheme=KEY_SCHEME_HKDF,
+                kdf_iterations=iterations,
             )
 
             # Opprett standard innstillinger for ny bruker
             new_settings = Settings(theme="default", font_size=16)
             new_user.settings = new_settings
 
-            self.session.add(new_user)
-            self.session.commit()
+            with self.database.session_scope() as session:
+                session.add(new_user)
             return True
         except Exception as e:
-            self.session.rollback()
             return False
 
     def get_all_users(self):
@@ -93,7 +442,7 @@ class LoginManager:
         Hent alle brukernavn fra databasen.
         """
         try:
-            users = self.session.query(User.username).all()
-            return [user.username for user in users]
+            with self.database.session_scope() as session:
+                return [username for (username,) in session.query(User.username)]
         except Exception as e:
             return []
@@ -0,0 +1,90 @@
+import unicodedata
+from collections import defaultdict
+
+# Skiller feltene i den normaliserte teksten slik at treff ikke går på tvers av felt
+FIELD_SEPARATOR = "\x00"
+
+
+def normalize(text: str) -> str:
+    return unicodedata.normalize("NFC", text).casefold()
+
+
+def trigrams(text: str) -> set:
+    return {
+        text[i : i + 3]
+        for i in range(len(text) - 2)
+        if FIELD_SEPARATOR not in text[i : i + 3]
+    }
+
+
+class SearchIndex:
+    """
+    Søkeindeks i minnet over dekrypterte felt. Teksten normaliseres én gang,
+    og trigrammer peker til oppføringene de finnes i. Et søk som utvider
+    forrige søk filtrerer bare forrige resultat. Indeksen lagres aldri.
+    """
+
+    def __init__(self):
+        self._texts = {}  # entry_id -> normalisert tekst
+        self._postings = defaultdict(set)  # trigram -> entry_id-er
+        self._last_query = None
+        self._last_result = None
+
+    def __len__(self):
+        return len(self._texts)
+
+    def __contains__(self, entry_id):
+        return entry_id in self._texts
+
+    def add(self, entry_id, fields):
+        """Legg til eller oppdater en oppføring med feltene som skal være søkbare."""
+        self.remove(entry_id)
+        text = FIELD_SEPARATOR.join(normalize(field or "") for field in fields)
+        self._texts[entry_id] = text
+        for trigram in trigrams(text):
+            self._postings[trigram].add(entry_id)
+        if self._last_query is not None and self._last_query in text:
+            self._last_result.add(entry_id)
+
+    def remove(self, entry_id):
+        text = self._texts.pop(entry_id, None)
+        if text is None:
+            return
+        for trigram in trigrams(text):
+            postings = self._postings[trigram]
+            postings.discard(entry_id)
+            if not postings:
+                del self._postings[trigram]
+        if self._last_result is not None:
+            self._last_result.discard(entry_id)
+
+    def clear(self):
+        self._texts.clear()
+        self._postings.clear()
+        self._last_query = None
+        self._last_result = None
+
+    def search(self, query: str) -> set:
+        """Returner id-ene til oppføringene der et av feltene inneholder query."""
+        query = normalize(query)
+        if not query:
+            self._last_query = None
+            self._last_result = None
+            return set(self._texts)
+
+        if self._last_query is not None and self._last_query in query:
+            # Et lengre søk kan bare gi færre treff enn det forrige
+            candidates = self._last_result
+        elif len(query) >= 3:
+            postings = sorted(
+                (self._postings.get(trigram, set()) for trigram in trigrams(query)),
+                key=len,
+            )
+            candidates = set(postings[0]).intersection(*postings[1:])
+        else:
+            candidates = self._texts.keys()
+
+        result = {entry_id for entry_id in candidates if query in self._texts[entry_id]}
+        self._last_query = query
+        self._last_result = result
+        return set(result)
@@ -0,0 +1,74 @@
+import sys
+import os
+
+# Legg til src i sys.path slik at modulene importeres som i appen
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+src_root = os.path.join(project_root, "src")
+if src_root not in sys.path:
+    sys.path.insert(0, src_root)
+
+from data.backup import copy_database, create_user_backup
+from data.database import get_engine, create_tables, get_session
+from data.models import PasswordEntry
+
+
+def open_session(path):
+    engine = get_engine(str(path))
+    create_tables(engine)
+    return engine, get_session(engine)
+
+
+def make_entry(user_id, service, **fields):
+    return PasswordEntry(
+        user_id=user_id,
+        service=service.encode(),
+        email=b"e",
+        encrypted_password=b"x",
+        **fields,
+    )
+
+
+def test_create_user_backup_copies_only_the_users_entries(tmp_path):
+    engine, session = open_session(tmp_path / "passwords.db")
+    session.add_all(
+        [
+            make_entry(1, "a", fingerprint="f1"),
+            make_entry(1, "b"),
+            make_entry(2, "c"),
+        ]
+    )
+    session.commit()
+
+    backup_path = str(tmp_path / "backup.db")
+    assert create_user_backup(engine, 1, backup_path) == 2
+    assert not os.path.exists(f"{backup_path}.tmp")
+
+    backup_engine, backup_session = open_session(backup_path)
+    rows = backup_session.query(PasswordEntry).order_by(PasswordEntry.service).all()
+    assert [(row.user_id, row.service, row.fingerprint) for row in rows] == [
+        (1, b"a", "f1"),
+        (1, b"b", None),
+    ]
+    backup_session.close()
+    backup_engine.dispose()
+
+    # Hoveddatabasen kan fortsatt brukes etterpå
+    assert session.query(PasswordEntry).count() == 3
+    session.close()
+    engine.dispose()
+
+
+def test_copy_database_makes_a_complete_copy(tmp_path):
+    engine, session = open_session(tmp_path / "passwords.db")
+    session.add(make_entry(1, "a"))
+    session.commit()
+
+    copy_path = tmp_path / "copy.db"
+    copy_database(str(tmp_path / "passwords.db"), str(copy_path))
+    session.close()
+    engine.dispose()
+
+    copy_engine, copy_session = open_session(copy_path)
+    assert copy_session.query(PasswordEntry.service).scalar() == b"a"
+    copy_session.close()
+    copy_engine.dispose()
@@ -0,0 +1,98 @@
+import sys
+import os
+
+import pytest
+
+# Legg til src i sys.path slik at modulene importeres som i appen
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+src_root = os.path.join(project_root, "src")
+if src_root not in sys.path:
+    sys.path.insert(0, src_root)
+
+from data.database import (
+    apply_attached_pragmas,
+    bulk_connection,
+    close_databases,
+    get_connection_profile,
+    get_database,
+    get_engine,
+    set_connection_profile,
+)
+from data.models import User
+
+
+def pragma(connection, name):
+    return connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+
+def test_desktop_profile_is_applied_on_connect(tmp_path):
+    engine = get_engine(str(tmp_path / "passwords.db"))
+    with engine.connect() as connection:
+        assert pragma(connection, "journal_mode") == "wal"
+        assert pragma(connection, "synchronous") == 1  # NORMAL
+        assert pragma(connection, "temp_store") == 2  # MEMORY
+        assert pragma(connection, "busy_timeout") == 5000
+    engine.dispose()
+
+
+def test_bulk_connection_restores_the_engine_profile(tmp_path):
+    engine = get_engine(str(tmp_path / "passwords.db"))
+    with bulk_connection(engine) as connection:
+        # Hvelvet beholder fsync, bare cachen økes
+        assert pragma(connection, "synchronous") == 1  # NORMAL
+        assert pragma(connection, "cache_size") == -64000
+    with engine.connect() as connection:
+        assert pragma(connection, "synchronous") == 1
+        assert pragma(connection, "cache_size") == -16000
+    engine.dispose()
+
+
+def test_attached_pragmas_leave_the_vault_alone(tmp_path):
+    engine = get_engine(str(tmp_path / "passwords.db"))
+    with bulk_connection(engine) as connection:
+        connection.exec_driver_sql(
+            "ATTACH DATABASE ? AS backup", (str(tmp_path / "backup.db"),)
+        )
+        apply_attached_pragmas(connection, "backup")
+        assert pragma(connection, "backup.synchronous") == 0  # OFF
+        assert pragma(connection, "backup.cache_size") == -64000
+        assert pragma(connection, "main.synchronous") == 1
+        connection.exec_driver_sql("DETACH DATABASE backup")
+    engine.dispose()
+
+
+def test_set_connection_profile(tmp_path):
+    engine = get_engine(str(tmp_path / "passwords.db"))
+    set_connection_profile(engine, "sikker")
+    assert get_connection_profile(engine) == "sikker"
+    with engine.connect() as connection:
+        assert pragma(connection, "synchronous") == 2  # FULL
+
+    with pytest.raises(ValueError):
+        set_connection_profile(engine, "ukjent")
+    engine.dispose()
+
+
+def test_get_database_shares_one_engine_per_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    database = get_database("passwords.db")
+    assert get_database(str(tmp_path / "passwords.db")) is database
+    assert get_database("annen.db") is not database
+    close_databases()
+    assert get_database("passwords.db") is not database
+    close_databases()
+
+
+def test_session_scope_commits_or_rolls_back(tmp_path):
+    database = get_database(str(tmp_path / "passwords.db"))
+    with database.session_scope() as session:
+        session.add(User(username="ola", password_hash="h", salt="s"))
+
+    with pytest.raises(RuntimeError):
+        with database.session_scope() as session:
+            session.add(User(username="kari", password_hash="h", salt="s"))
+            raise RuntimeError
+
+    with database.session_scope() as session:
+        assert [name for (name,) in session.query(User.username)] == ["ola"]
+    close_databases()
@@ -2,16 +2,36 @@ import base64
 import sys
 import os
 
+import pytest
+
 # Legg til prosjektets rotkatalog til sys.path
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
 from src.data.encryption import (
+    KEY_GENERATION,
+    RECORD_KEY,
+    RETIRED_KEYS,
+    SUBKEYS,
+    ColumnCipherSet,
+    ENCRYPTED_COLUMNS,
+    MAX_ITERATIONS,
+    MIN_ITERATIONS,
+    calibrate_iterations,
+    derive_column_keys,
     derive_key_for_column,
+    derive_legacy_keys,
+    derive_keys_from_root,
+    derive_root_key,
+    hash_root_key,
     hash_password,
     encrypt_password,
     decrypt_password,
+    rotate_password,
+    decrypt_many,
+    decode_record_fields,
+    encode_record_fields,
 )
 
 
@@ -39,3 +59,180 @@ def test_encrypt_decrypt_password():
     assert encrypted is not None
     decrypted = decrypt_password(encrypted, key)
     assert decrypted == password
+
+
+def test_root_key_hierarchy():
+    salt = b"this_is_a_test_salt"
+    root_key = derive_root_key("test_password", salt)
+    keys = derive_keys_from_root(root_key)
+    assert set(keys) == set(ENCRYPTED_COLUMNS) | set(SUBKEYS) | {
+        KEY_GENERATION,
+        RETIRED_KEYS,
+    }
+    # Hver kolonne får sin egen nøkkel, og verifikatoren er ikke rotnøkkelen
+    secrets = [keys[name] for name in ENCRYPTED_COLUMNS + SUBKEYS]
+    assert len(set(secrets)) == len(secrets)
+    assert hash_root_key(root_key) != base64.b64encode(root_key).decode()
+    assert derive_keys_from_root(derive_root_key("test_password", salt)) == keys
+
+
+def test_derive_column_keys_parallel_matches_serial():
+    password = "test_password"
+    salt = b"this_is_a_test_salt"
+    serial = derive_column_keys(password, salt, workers=1)
+    parallel = derive_column_keys(password, salt, workers=4)
+    assert serial == parallel
+    assert serial["email"] == derive_key_for_column(password, salt, "email")
+
+    password_hash, keys = derive_legacy_keys(password, salt, workers=4)
+    assert password_hash == hash_password(password, salt)
+    assert keys == serial
+
+
+def test_calibrate_iterations_is_clamped():
+    assert calibrate_iterations(target_ms=0) == MIN_ITERATIONS
+    assert calibrate_iterations(target_ms=10**9) == MAX_ITERATIONS
+
+
+def test_column_cipher_set():
+    keys = derive_keys_from_root(derive_root_key("test_password", b"salt"))
+    ciphers = ColumnCipherSet(keys)
+    token = ciphers.encrypt("service", "Google")
+    assert ciphers.decrypt("service", token) == "Google"
+    # Tokens er kompatible med de frittstående funksjonene
+    assert decrypt_password(token, keys["service"]) == "Google"
+    assert ciphers.decrypt("link", None) == ""
+    # Tokens lagret som base64-tekst før kolonnene ble binære
+    text = base64.urlsafe_b64encode(token).decode()
+    assert ciphers.decrypt("service", text) == decrypt_password(text, keys["service"])
+
+    fields = {"email": "ola@example.com", "tag": ""}
+    assert ciphers.decrypt_fields(ciphers.encrypt_fields(fields)) == fields
+    tokens = ciphers.encrypt_values("email", ["a", "b"])
+    assert ciphers.decrypt_values("email", tokens) == ["a", "b"]
+
+    ciphers.wipe()
+    assert not ciphers
+    with pytest.raises(ValueError):
+        ciphers.decrypt("service", token)
+
+
+def test_decrypt_many_keeps_order_and_collects_errors():
+    keys = derive_keys_from_root(derive_root_key("test_password", b"salt"))
+    ciphers = ColumnCipherSet(keys)
+    columns = ("service", "email")
+    rows = [
+        (
+            i,
+            None,
+            ciphers.encrypt("service", f"tjeneste{i}"),
+            ciphers.encrypt("email", f"{i}@x"),
+        )
+        for i in range(25)
+    ]
+    rows[7] = (7, None, "ugyldig", rows[7][3])
+    # Rader med post dekrypteres fra den, uansett hva som står i kolonnene
+    record = ciphers.encrypt_record(24, {"service": "tjeneste24", "email": "24@x"})
+    rows[24] = (24, record, "", "")
+
+    result = decrypt_many(ciphers, rows, columns, workers=4, chunk_size=4)
+    assert len(result.values) == 25
+    assert result.values[0] == ("tjeneste0", "0@x")
+    assert result.values[24] == ("tjeneste24", "24@x")
+    assert result.values[7] is None
+    assert [index for index, _ in result.errors] == [7]
+
+    assert decrypt_many(ciphers, rows, columns, workers=1).values == result.values
+
+
+def test_record_round_trip_is_bound_to_the_entry_id():
+    ciphers = ColumnCipherSet(derive_keys_from_root(derive_root_key("pw", b"salt")))
+    data = {
+        "service": "Google",
+        "email": "ola@example.com",
+        "username": "",
+        "password": "æøå" * 100,  # Lengde over 127 byte gir varint på to byte
+        "link": "https://example.com",
+        "tag": "Jobb",
+    }
+    assert decode_record_fields(encode_record_fields(data)) == data
+    assert decode_record_fields(encode_record_fields({"service": "a"}))["tag"] == ""
+
+    record = ciphers.encrypt_record(5, data)
+    assert ciphers.decrypt_record(5, record) == data
+    assert ciphers.decrypt_entry(5, record, {"password": ""}) == {
+        "password": data["password"]
+    }
+    # Samme post under en annen oppføring, eller endret, avvises
+    with pytest.raises(Exception):
+        ciphers.decrypt_record(6, record)
+    tampered = bytearray(record)
+    tampered[-1] ^= 1
+    with pytest.raises(Exception):
+        ciphers.decrypt_record(5, bytes(tampered))
+    # Poster lagret som base64-tekst før kolonnene ble binære kan fortsatt leses
+    text = base64.urlsafe_b64encode(record).decode()
+    assert ciphers.decrypt_record(5, text) == data
+
+    # Én post er mye mindre enn seks Fernet-tokens for en vanlig oppføring
+    data["password"] = "hemmelig"
+    tokens = ciphers.encrypt_fields(data)
+    record = ciphers.encrypt_record(5, data)
+    assert len(record) * 3 < sum(len(token) for token in tokens.values())
+
+    ciphers.wipe()
+    assert not ciphers.has_record_key
+    with pytest.raises(ValueError):
+        ciphers.decrypt_record(5, record)
+
+
+def test_blind_index_is_normalized_and_keyed():
+    keys = derive_keys_from_root(derive_root_key("test_password", b"salt"))
+    ciphers = ColumnCipherSet(keys)
+    assert ciphers.blind_index("service", " Google ") == ciphers.blind_index(
+        "service", "google"
+    )
+    assert ciphers.blind_index("service", "google") != ciphers.blind_index(
+        "tag", "google"
+    )
+    other = ColumnCipherSet(derive_keys_from_root(derive_root_key("annet", b"salt")))
+    assert other.blind_index("service", "google") != ciphers.blind_index(
+        "service", "google"
+    )
+    legacy = ColumnCipherSet({"service": keys["service"]})
+    assert not legacy.has_blind_index
+    assert legacy.blind_index("service", "google") is None
+
+
+def test_key_rotation_keeps_older_generations_readable():
+    root_key = derive_root_key("test_password", b"salt")
+    first = derive_keys_from_root(root_key)
+    rotated = derive_keys_from_root(root_key, generation=2)
+    assert first[RETIRED_KEYS] == []
+    assert len(rotated[RETIRED_KEYS]) == 2
+    assert rotated[RETIRED_KEYS][-1][RECORD_KEY] == first[RECORD_KEY]
+    assert rotated["service"] != first["service"]
+    # Blind-indekser og fingeravtrykk er de samme i alle generasjoner
+    assert rotated["blind_index"] == first["blind_index"]
+
+    old = ColumnCipherSet(first)
+    new = ColumnCipherSet(rotated)
+    data = {"service": "Google", "password": "hemmelig"}
+    record = old.encrypt_record(3, data)
+    token = old.encrypt("service", "Google")
+    assert new.open_record(3, record) == (old.decrypt_record(3, record), 0)
+    assert new.decrypt("service", token) == "Google"
+    assert new.open_record(3, new.encrypt_record(3, data))[1] == 2
+    with pytest.raises(Exception):
+        old.decrypt_record(3, new.encrypt_record(3, data))
+    assert new.derived_columns(data) == old.derived_columns(data)
+
+    # MultiFernet for enkeltfeltene: nyeste nøkkel først
+    ring = [rotated["password"], first["password"]]
+    rotated_token = rotate_password(
+        encrypt_password("hemmelig", first["password"]), ring
+    )
+    assert decrypt_password(rotated_token, rotated["password"]) == "hemmelig"
+    assert decrypt_password(encrypt_password("x", ring), ring[0]) == "x"
+    with pytest.raises(Exception):
+        decrypt_password(rotated_token, first["password"])
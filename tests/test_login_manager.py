@@ -0,0 +1,166 @@
+import base64
+import sys
+import os
+
+# Legg til src i sys.path slik at modulene importeres som i appen
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+src_root = os.path.join(project_root, "src")
+if src_root not in sys.path:
+    sys.path.insert(0, src_root)
+
+from data.encryption import (
+    KEY_SCHEME_HKDF,
+    KEY_SCHEME_LEGACY,
+    ENCRYPTED_COLUMNS,
+    derive_key_for_column,
+    hash_password,
+    encrypt_password,
+)
+from data.backup import create_user_backup
+from data.encryption import ColumnCipherSet
+from data.models import User, PasswordEntry
+from data.repository import PasswordRepository, find_entries
+from data.sync import synchronize_from_backup
+from utils.login_manager import LoginManager
+
+
+def create_legacy_user(login_manager, username, password):
+    salt = os.urandom(16)
+    keys = {
+        column: derive_key_for_column(password, salt, column)
+        for column in ENCRYPTED_COLUMNS
+    }
+    user = User(
+        username=username,
+        password_hash=hash_password(password, salt),
+        salt=base64.b64encode(salt).decode(),
+        key_scheme=KEY_SCHEME_LEGACY,
+    )
+    with login_manager.database.session_scope() as session:
+        session.add(user)
+        session.flush()
+        session.add(
+            PasswordEntry(
+                service=encrypt_password("Google", keys["service"]),
+                email=encrypt_password("ola@example.com", keys["email"]),
+                username=encrypt_password("ola", keys["username"]),
+                encrypted_password=encrypt_password("hemmelig", keys["password"]),
+                link=encrypt_password("", keys["link"]),
+                tag=encrypt_password("Arbeid", keys["tag"]),
+                user_id=user.id,
+            )
+        )
+    return user
+
+
+def test_register_and_authenticate(tmp_path):
+    login_manager = LoginManager(str(tmp_path / "passwords.db"))
+    assert login_manager.register_user("ola", "passord")
+
+    user, keys, message = login_manager.authenticate_user("ola", "passord")
+    assert message is None
+    assert user.key_scheme == KEY_SCHEME_HKDF
+    assert set(ENCRYPTED_COLUMNS) <= set(keys)
+
+    user, keys, message = login_manager.authenticate_user("ola", "feil")
+    assert user is None and keys is None
+
+
+def test_legacy_user_is_migrated_on_login(tmp_path):
+    login_manager = LoginManager(str(tmp_path / "passwords.db"))
+    legacy_user = create_legacy_user(login_manager, "kari", "passord")
+    old_salt = legacy_user.salt
+
+    user, keys, message = login_manager.authenticate_user("kari", "passord")
+    assert message is None
+    assert user.key_scheme == KEY_SCHEME_HKDF
+    assert user.salt != old_salt
+
+    with login_manager.database.session_scope() as session:
+        entry = session.query(PasswordEntry).filter_by(user_id=user.id).one()
+        # Oppføringen er kryptert på nytt som én post
+        ciphers = ColumnCipherSet(keys)
+        fields = ciphers.decrypt_record(entry.id, entry.record)
+        assert fields["service"] == "Google"
+        assert fields["password"] == "hemmelig"
+        assert entry.service == entry.encrypted_password == b""
+
+        # Blind-indeksene er fylt inn, så oppføringen kan slås opp uten dekryptering
+        assert find_entries(session, user.id, ciphers, service="google ")
+        assert find_entries(
+            session, user.id, ciphers, email="OLA@example.com", tag="arbeid"
+        )
+        assert not find_entries(session, user.id, ciphers, service="Goog")
+
+    # Neste innlogging bruker det nye skjemaet og gir de samme nøklene
+    _, keys_again, _ = login_manager.authenticate_user("kari", "passord")
+    assert keys_again == keys
+
+
+def test_retune_kdf_keeps_vault_readable(tmp_path):
+    login_manager = LoginManager(str(tmp_path / "passwords.db"))
+    assert login_manager.register_user("ola", "passord", iterations=150000)
+    user, keys, _ = login_manager.authenticate_user("ola", "passord")
+    with login_manager.database.session_scope() as session:
+        session.add(
+            PasswordEntry(
+                service=encrypt_password("Google", keys["service"]),
+                email=encrypt_password("ola@example.com", keys["email"]),
+                encrypted_password=encrypt_password("hemmelig", keys["password"]),
+                user_id=user.id,
+            )
+        )
+
+    salt = user.salt
+    new_keys, message = login_manager.retune_kdf(user, "passord", target_ms=1)
+    assert message is None
+    assert new_keys != keys
+    assert user.kdf_iterations == 100000
+    assert user.salt == salt
+
+    with login_manager.database.session_scope() as session:
+        entry = session.query(PasswordEntry).filter_by(user_id=user.id).one()
+        fields = ColumnCipherSet(new_keys).decrypt_record(entry.id, entry.record)
+        assert fields["service"] == "Google"
+    _, keys_again, _ = login_manager.authenticate_user("ola", "passord")
+    assert keys_again == new_keys
+
+    # Uendret kostnad gir de samme nøklene, og ingenting å gjøre
+    assert login_manager.retune_kdf(user, "passord", target_ms=1) == (
+        None,
+        "Nøklene er allerede kalibrert for denne maskinen.",
+    )
+    assert login_manager.retune_kdf(user, "feil") == (None, "Ugyldig passord.")
+
+
+def test_backup_from_before_the_upgrade_can_be_restored(tmp_path):
+    login_manager = LoginManager(str(tmp_path / "passwords.db"))
+    legacy_user = create_legacy_user(login_manager, "kari", "passord")
+    backup_path = str(tmp_path / "backup.db")
+    assert create_user_backup(login_manager.engine, legacy_user.id, backup_path) == 1
+
+    user, keys, _ = login_manager.authenticate_user("kari", "passord")
+    assert user.key_scheme == KEY_SCHEME_HKDF and user.legacy_keys
+    repository = PasswordRepository(login_manager.database, user.id)
+    [row] = repository.fetch_rows()
+    assert repository.delete(row.id)
+
+    ciphers = ColumnCipherSet(keys)
+    result = synchronize_from_backup(
+        login_manager.engine, backup_path, user.id, ciphers
+    )
+    assert result == (1, 0)
+    [row] = repository.fetch_rows()
+    assert repository.get_fields(ciphers, row.id)["password"] == "hemmelig"
+
+    # Nøklene fra gammelt skjema følger med ved neste innlogging og passordbytte
+    _, keys_again, _ = login_manager.authenticate_user("kari", "passord")
+    assert keys_again == keys
+    new_keys, _ = login_manager.change_master_password(
+        user, "passord", "nytt", iterations=100000
+    )
+    assert repository.delete(row.id)
+    result = synchronize_from_backup(
+        login_manager.engine, backup_path, user.id, ColumnCipherSet(new_keys)
+    )
+    assert result == (1, 0)
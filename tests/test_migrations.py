@@ -0,0 +1,71 @@
+import sqlite3
+import sys
+import os
+
+from sqlalchemy import event
+
+# Legg til src i sys.path slik at modulene importeres som i appen
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+src_root = os.path.join(project_root, "src")
+if src_root not in sys.path:
+    sys.path.insert(0, src_root)
+
+from data.database import create_tables, get_engine
+from data.migrations import SCHEMA_VERSION, migrate
+
+
+def test_migrate_upgrades_an_unversioned_database(tmp_path):
+    path = tmp_path / "passwords.db"
+    # Skjemaet slik det så ut før versjonering og blind-indekser
+    connection = sqlite3.connect(path)
+    connection.executescript(
+        """
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY, username VARCHAR NOT NULL UNIQUE,
+            password_hash VARCHAR NOT NULL, salt VARCHAR NOT NULL
+        );
+        CREATE TABLE passwords (
+            id INTEGER PRIMARY KEY, service VARCHAR NOT NULL,
+            email VARCHAR NOT NULL, username VARCHAR,
+            encrypted_password VARCHAR NOT NULL, link VARCHAR, tag VARCHAR,
+            user_id INTEGER REFERENCES users (id)
+        );
+        INSERT INTO users VALUES (1, 'ola', 'hash', 'salt');
+        INSERT INTO passwords (service, email, encrypted_password, user_id)
+        VALUES ('s', 'e', 'p', 1);
+        """
+    )
+    connection.close()
+
+    engine = get_engine(str(path))
+    assert migrate(engine) == SCHEMA_VERSION
+    engine.dispose()
+
+    connection = sqlite3.connect(path)
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(passwords)")}
+    assert {"service_bidx", "fingerprint"} <= columns
+    indexes = {row[1] for row in connection.execute("PRAGMA index_list(passwords)")}
+    assert "ix_passwords_user_id" in indexes
+    plan = connection.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM passwords WHERE user_id = 1 ORDER BY id"
+    ).fetchall()
+    assert "ix_passwords_user_id" in str(plan)
+    assert connection.execute("SELECT count(*) FROM settings").fetchone()[0] == 0
+    assert connection.execute("SELECT key_scheme FROM users").fetchone()[0] == 1
+    connection.close()
+
+
+def test_current_schema_costs_one_statement(tmp_path):
+    engine = get_engine(str(tmp_path / "passwords.db"))
+    create_tables(engine)
+
+    statements = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def record(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    create_tables(engine)
+    assert statements == ["PRAGMA user_version"]
+    engine.dispose()
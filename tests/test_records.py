@@ -0,0 +1,103 @@
+import base64
+import sys
+import os
+
+# Legg til src i sys.path slik at modulene importeres som i appen
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+src_root = os.path.join(project_root, "src")
+if src_root not in sys.path:
+    sys.path.insert(0, src_root)
+
+from data.database import get_database
+from data.encryption import ColumnCipherSet, derive_keys_from_root, derive_root_key
+from data.models import ENCRYPTED_ATTRIBUTES
+from data.records import (
+    migrate_records,
+    pack_text_columns,
+    pending_record_count,
+    pending_text_count,
+    upgrade_entries,
+)
+from data.repository import PasswordRepository
+
+
+def legacy_entry(ciphers, user_id, **fields):
+    # Oppføring i det gamle formatet, med ett Fernet-token per kolonne
+    # lagret som base64-tekst
+    data = dict.fromkeys(ENCRYPTED_ATTRIBUTES, "")
+    data.update(fields)
+    attributes = {
+        ENCRYPTED_ATTRIBUTES[column]: base64.urlsafe_b64encode(token).decode()
+        for column, token in ciphers.encrypt_fields(data).items()
+    }
+    attributes.update(ciphers.derived_columns(data))
+    attributes["user_id"] = user_id
+    return attributes
+
+
+def insert_rows(engine, rows):
+    # Rå SQL, siden modellen bare tar byte i de krypterte kolonnene
+    with engine.begin() as connection:
+        for row in rows:
+            names = ", ".join(row)
+            marks = ", ".join("?" for _ in row)
+            connection.exec_driver_sql(
+                f"INSERT INTO passwords ({names}) VALUES ({marks})", tuple(row.values())
+            )
+
+
+def test_migrate_records_converts_legacy_rows_in_batches(tmp_path):
+    database = get_database(str(tmp_path / "passwords.db"))
+    ciphers = ColumnCipherSet(derive_keys_from_root(derive_root_key("pw", b"salt")))
+    repository = PasswordRepository(database, 1)
+    engine = database.engine
+    insert_rows(
+        engine,
+        [
+            legacy_entry(ciphers, 1, service=f"s{number}", password=f"p{number}")
+            for number in range(5)
+        ]
+        + [
+            {"user_id": 1, "service": "ødelagt", "email": "", "encrypted_password": ""},
+            legacy_entry(ciphers, 2, service="annen"),
+        ],
+    )
+    repository.add(ciphers, {"service": "ny"})
+    assert pending_record_count(engine, 1) == 6
+    assert pending_text_count(engine) == 7
+
+    # Radene i det gamle formatet kan leses som før
+    assert repository.get_password(ciphers, 1) == "p0"
+
+    # Stoppes etter første bit, og fortsetter der det slapp
+    batches = []
+    stop_after_first = lambda: bool(batches.append(None) or len(batches) > 1)
+    assert (
+        migrate_records(engine, 1, ciphers, batch_size=2, should_stop=stop_after_first)
+        == 2
+    )
+    assert pending_record_count(engine, 1) == 4
+    assert migrate_records(engine, 1, ciphers, batch_size=2) == 3
+
+    # Den ødelagte raden og den andre brukerens rad står urørt
+    assert pending_record_count(engine, 1) == 1
+    assert pending_record_count(engine, 2) == 1
+
+    for number in range(5):
+        entry_id = number + 1
+        row = repository.fetch_row(entry_id, include_password=True)
+        assert row.record and row.service == row.encrypted_password == b""
+        fields = repository.get_fields(ciphers, entry_id)
+        assert (fields["service"], fields["password"]) == (f"s{number}", f"p{number}")
+    assert repository.find(ciphers, service="S3") == [4]
+    assert migrate_records(engine, 1, ciphers) == 0
+
+    # Resten av teksten gjøres om til rå byte uten nøkler
+    assert pending_text_count(engine) == 2
+    assert pack_text_columns(engine, batch_size=1) == 2
+    assert pending_text_count(engine) == 0
+    other = PasswordRepository(database, 2)
+    [other_row] = other.fetch_rows()
+    assert isinstance(other_row.service, bytes)
+    assert other.get_fields(ciphers, other_row.id)["service"] == "annen"
+    assert upgrade_entries(engine, 1, ciphers) == 0
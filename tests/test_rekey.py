@@ -0,0 +1,127 @@
+import sys
+import os
+
+# Legg til src i sys.path slik at modulene importeres som i appen
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+src_root = os.path.join(project_root, "src")
+if src_root not in sys.path:
+    sys.path.insert(0, src_root)
+
+from data.database import QueryCounter
+from data.encryption import RETIRED_KEYS, ColumnCipherSet
+from data.models import RekeyState
+from data.records import migrate_records, record_progress
+from data.repository import PasswordRepository
+from utils.login_manager import LoginManager
+
+
+def login_with_entries(tmp_path, count):
+    login_manager = LoginManager(str(tmp_path / "passwords.db"))
+    login_manager.register_user("ola", "gammelt", iterations=100000)
+    user, keys, _ = login_manager.authenticate_user("ola", "gammelt")
+    repository = PasswordRepository(login_manager.database, user.id)
+    ciphers = ColumnCipherSet(keys)
+    for number in range(count):
+        repository.add(ciphers, {"service": f"s{number}", "password": f"p{number}"})
+    return login_manager, user, repository
+
+
+def passwords(repository, keys):
+    ciphers = ColumnCipherSet(keys)
+    return sorted(
+        repository.get_fields(ciphers, row.id)["password"]
+        for row in repository.fetch_rows()
+    )
+
+
+def test_change_master_password_rekeys_the_vault(tmp_path):
+    login_manager, user, repository = login_with_entries(tmp_path, 5)
+    expected = sorted(f"p{number}" for number in range(5))
+
+    assert login_manager.change_master_password(user, "feil", "nytt") == (
+        None,
+        "Ugyldig passord.",
+    )
+    new_keys, message = login_manager.change_master_password(
+        user, "gammelt", "nytt", iterations=100000
+    )
+    assert message is None
+    assert passwords(repository, new_keys) == expected
+
+    assert login_manager.authenticate_user("ola", "gammelt")[0] is None
+    user, keys, _ = login_manager.authenticate_user("ola", "nytt")
+    assert keys == new_keys and user.rekey_state is None
+
+
+def test_interrupted_rekey_resumes_with_the_new_password(tmp_path):
+    login_manager, user, repository = login_with_entries(tmp_path, 7)
+    job, _ = login_manager.start_rekey(user, "gammelt", "nytt", iterations=100000)
+    job.batch_size = 2
+
+    # Stoppes etter to biter, som om appen ble lukket midt i
+    reports = []
+    assert not job.run(lambda: len(reports) >= 2, reports.append)
+    assert [report.done for report in reports] == [2, 4]
+    assert job.progress() == (4, 7)
+    assert login_manager.start_rekey(user, "gammelt", "annet", iterations=100000) == (
+        None,
+        "Et passordbytte pågår allerede.",
+    )
+
+    user, keys, message = login_manager.authenticate_user("ola", "nytt")
+    assert message is None and user.rekey_state is None
+    assert keys == job.new_keys
+    assert passwords(repository, keys) == sorted(f"p{number}" for number in range(7))
+    with login_manager.database.session_scope() as session:
+        assert session.query(RekeyState).count() == 0
+
+
+def test_interrupted_rekey_rolls_back_with_the_old_password(tmp_path):
+    login_manager, user, repository = login_with_entries(tmp_path, 5)
+    old_hash = user.password_hash
+    job, _ = login_manager.start_rekey(user, "gammelt", "nytt", iterations=100000)
+    job.batch_size = 3
+    reports = []
+    assert not job.run(lambda: len(reports) >= 1, reports.append)
+
+    assert login_manager.authenticate_user("ola", "feil")[0] is None
+    user, keys, message = login_manager.authenticate_user("ola", "gammelt")
+    assert message is None and user.password_hash == old_hash
+    assert keys == job.old_keys
+    assert passwords(repository, keys) == sorted(f"p{number}" for number in range(5))
+    assert login_manager.authenticate_user("ola", "nytt")[0] is None
+
+
+def test_rotate_keys_reencrypts_lazily(tmp_path):
+    login_manager, user, repository = login_with_entries(tmp_path, 5)
+    engine = login_manager.engine
+    assert login_manager.rotate_keys(user, "feil") == (None, "Ugyldig passord.")
+
+    new_keys, message = login_manager.rotate_keys(user, "gammelt")
+    assert message is None and user.key_generation == 1
+    # Ingen rader er skrevet ennå, og innloggingen koster det samme som før
+    assert record_progress(engine, user.id, 1) == (0, 5)
+    with QueryCounter(engine) as counter:
+        user, keys, _ = login_manager.authenticate_user("ola", "gammelt")
+    assert counter.count == 3 and keys == new_keys
+    assert len(keys[RETIRED_KEYS]) == 1
+
+    # En rad som leses krypteres om med den nye generasjonen
+    ciphers = ColumnCipherSet(keys)
+    assert repository.get_password(ciphers, 1) == "p0"
+    assert record_progress(engine, user.id, 1) == (1, 5)
+
+    # Resten tas av bakgrunnsjobben
+    assert migrate_records(engine, user.id, ciphers, batch_size=2) == 4
+    assert record_progress(engine, user.id, 1) == (5, 5)
+    current_only = {name: key for name, key in keys.items() if name != RETIRED_KEYS}
+    assert passwords(repository, current_only) == sorted(
+        f"p{number}" for number in range(5)
+    )
+
+    # Generasjon 0 har ingen rader igjen og utledes ikke lenger
+    user, keys, _ = login_manager.authenticate_user("ola", "gammelt")
+    assert user.oldest_key_generation == 1
+    assert keys[RETIRED_KEYS] == []
+    new_keys, _ = login_manager.rotate_keys(user, "gammelt")
+    assert len(new_keys[RETIRED_KEYS]) == 1
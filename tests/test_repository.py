@@ -0,0 +1,121 @@
+import sys
+import os
+
+# Legg til src i sys.path slik at modulene importeres som i appen
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+src_root = os.path.join(project_root, "src")
+if src_root not in sys.path:
+    sys.path.insert(0, src_root)
+
+from data.database import QueryCounter
+from data.encryption import ColumnCipherSet
+from data.repository import PasswordRepository, save_user_settings
+from utils.login_manager import LoginManager
+
+
+def test_login_returns_a_detached_user_with_settings(tmp_path):
+    login_manager = LoginManager(str(tmp_path / "passwords.db"))
+    login_manager.register_user("ola", "passord", iterations=100000)
+    engine = login_manager.engine
+
+    with QueryCounter(engine) as counter:
+        user, keys, _ = login_manager.authenticate_user("ola", "passord")
+    # Brukeren, innstillingene og sjekken for manglende blind-indekser
+    assert counter.count == 3
+
+    # Ingen skjulte SELECT-er etter at sesjonen er lukket
+    with QueryCounter(engine) as counter:
+        assert user.id and user.settings.theme == "default"
+    assert counter.count == 0
+
+    database = login_manager.database
+    with QueryCounter(engine) as counter:
+        user.settings = save_user_settings(
+            database, user.id, theme="vintage", db_profile="sikker"
+        )
+        assert user.settings.theme == "vintage"
+    assert counter.count == 2  # SELECT og UPDATE
+
+    user, _, _ = login_manager.authenticate_user("ola", "passord")
+    assert (user.settings.theme, user.settings.db_profile) == ("vintage", "sikker")
+
+
+def test_repository_operations_issue_one_statement_each(tmp_path):
+    login_manager = LoginManager(str(tmp_path / "passwords.db"))
+    login_manager.register_user("ola", "passord", iterations=100000)
+    user, keys, _ = login_manager.authenticate_user("ola", "passord")
+    ciphers = ColumnCipherSet(keys)
+    repository = PasswordRepository(login_manager.database, user.id)
+    engine = login_manager.engine
+
+    with QueryCounter(engine) as counter:
+        entry_id = repository.add(
+            ciphers, {"service": "Google", "password": "hemmelig"}
+        )
+    # INSERT, UPDATE med posten bundet til id-en, og hvelvversjonen
+    assert counter.count == 3
+
+    with QueryCounter(engine) as counter:
+        assert repository.count() == 1
+        [row] = repository.fetch_rows()
+        password = repository.get_password(ciphers, entry_id)
+        assert repository.find(ciphers, service="google") == [entry_id]
+        assert repository.update(ciphers, entry_id, {"service": "GitHub"})
+    assert counter.count == 6  # UPDATE gir også ny hvelvversjon
+    assert row.id == entry_id and "encrypted_password" not in row._fields
+    assert ciphers.decrypt_record(row.id, row.record)["service"] == "Google"
+    assert row.service == b""
+    assert password == "hemmelig"
+    [full_row] = repository.fetch_rows(include_password=True)
+    assert repository.get_fields(ciphers, entry_id)["service"] == "GitHub"
+    assert repository.fetch_row(entry_id) == tuple(full_row[:5]) + full_row[6:]
+
+    # Andre brukeres oppføringer kan ikke endres eller slettes
+    other = PasswordRepository(login_manager.database, user.id + 1)
+    assert not other.delete(entry_id)
+    assert other.fetch_row(entry_id) is None
+    assert repository.get(entry_id).user_id == user.id
+
+    with QueryCounter(engine) as counter:
+        assert repository.delete(entry_id)
+    assert counter.count == 2  # DELETE og hvelvversjonen
+    assert repository.fetch_rows(include_password=True) == []
+    assert repository.fetch_row(entry_id) is None
+
+
+def test_fetch_page_walks_the_vault_in_id_order(tmp_path):
+    login_manager = LoginManager(str(tmp_path / "passwords.db"))
+    login_manager.register_user("ola", "passord", iterations=100000)
+    user, keys, _ = login_manager.authenticate_user("ola", "passord")
+    ciphers = ColumnCipherSet(keys)
+    repository = PasswordRepository(login_manager.database, user.id)
+    other = PasswordRepository(login_manager.database, user.id + 1)
+    ids = []
+    for number in range(7):
+        ids.append(repository.add(ciphers, {"service": f"s{number}"}))
+        other.add(ciphers, {"service": "annen"})
+
+    pages = []
+    after_id = 0
+    with QueryCounter(login_manager.engine) as counter:
+        while True:
+            page = repository.fetch_page(after_id, limit=3)
+            pages.append([row.id for row in page])
+            if len(page) < 3:
+                break
+            after_id = page[-1].id
+    assert counter.count == len(pages) == 3
+    assert pages == [ids[0:3], ids[3:6], ids[6:]]
+    assert (
+        "encrypted_password"
+        in repository.fetch_page(limit=1, include_password=True)[0]._fields
+    )
+
+    # Siden finnes med indeksen på passwords(user_id), uten sortering
+    statement = counter.statements[-1]
+    with login_manager.engine.connect() as connection:
+        plan = connection.exec_driver_sql(
+            f"EXPLAIN QUERY PLAN {statement}", (user.id, 0, 3, 0)
+        ).all()
+    assert "ix_passwords_user_id" in str(plan)
+    assert "TEMP B-TREE" not in str(plan)
@@ -0,0 +1,54 @@
+import sys
+import os
+
+# Legg til src i sys.path slik at modulene importeres som i appen
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+src_root = os.path.join(project_root, "src")
+if src_root not in sys.path:
+    sys.path.insert(0, src_root)
+
+from utils.search_index import SearchIndex
+
+
+def build_index():
+    index = SearchIndex()
+    index.add(1, ["Google", "ola@gmail.com", "ola", "https://google.com", "Privat"])
+    index.add(2, ["GitHub", "ola@jobb.no", "", "https://github.com", "Arbeid"])
+    index.add(3, ["Ærlig Bank", "kari@bank.no", "kari", "", "Økonomi"])
+    return index
+
+
+def test_search_matches_substrings_case_insensitive():
+    index = build_index()
+    assert index.search("") == {1, 2, 3}
+    assert index.search("g") == {1, 2, 3}
+    assert index.search("GOO") == {1}
+    assert index.search("ola@") == {1, 2}
+    assert index.search("ærlig") == {3}
+    assert index.search("økonomi") == {3}
+    assert index.search("finnes ikke") == set()
+
+
+def test_search_does_not_match_across_fields():
+    index = build_index()
+    # "privat" slutter feltet og "ola" starter et annet
+    assert index.search("com" + "privat") == set()
+
+
+def test_narrowing_and_incremental_updates():
+    index = build_index()
+    assert index.search("ola") == {1, 2}
+    assert index.search("ola@j") == {2}
+
+    index.add(4, ["Jottacloud", "ola@jobb.no", "", "", ""])
+    assert index.search("ola@jo") == {2, 4}
+
+    index.add(2, ["GitHub", "kari@jobb.no", "", "", ""])
+    assert index.search("ola@jo") == {4}
+
+    index.remove(4)
+    assert index.search("ola") == {1}
+    assert len(index) == 3
+
+    index.clear()
+    assert index.search("ola") == set()
@@ -0,0 +1,65 @@
+import sys
+import os
+
+# Legg til src i sys.path slik at modulene importeres som i appen
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+src_root = os.path.join(project_root, "src")
+if src_root not in sys.path:
+    sys.path.insert(0, src_root)
+
+from data.database import QueryCounter
+from data.encryption import ColumnCipherSet, derive_keys_from_root, derive_root_key
+from data.repository import PasswordRepository
+from data.snapshot import ListingSnapshot
+from utils.login_manager import LoginManager
+
+
+def test_snapshot_follows_the_vault_version(tmp_path):
+    login_manager = LoginManager(str(tmp_path / "passwords.db"))
+    login_manager.register_user("ola", "passord", iterations=100000)
+    user, keys, _ = login_manager.authenticate_user("ola", "passord")
+    ciphers = ColumnCipherSet(keys)
+    repository = PasswordRepository(login_manager.database, user.id)
+    for service in ("Google", "GitHub", "Bank"):
+        repository.add(ciphers, {"service": service, "password": "hemmelig"})
+
+    snapshot = ListingSnapshot(login_manager.database, user.id, ciphers)
+    assert snapshot.load() is None
+    # Stoppes det mellom bitene, skrives ingenting
+    assert not snapshot.refresh(should_stop=lambda: True, batch_size=2)
+    assert not os.path.exists(snapshot.path)
+    assert snapshot.refresh(batch_size=2)
+    assert not snapshot.refresh()
+    with open(snapshot.path, "rb") as file:
+        blob = file.read()
+    assert b"Google" not in blob and b"hemmelig" not in blob
+
+    # Hele listen fra én blob og én spørring etter hvelvversjonen
+    with QueryCounter(login_manager.engine) as counter:
+        entries = snapshot.load()
+    assert counter.count == 1
+    assert [fields["service"] for _, fields in entries] == ["Google", "GitHub", "Bank"]
+    assert [entry_id for entry_id, _ in entries] == [1, 2, 3]
+    assert "password" not in entries[0][1]
+
+    # Endringer denne prosessen gjør patches inn
+    data = {"service": "Gmail", "email": "ola@example.com", "password": "nytt"}
+    assert repository.update(ciphers, 1, data)
+    assert snapshot.patch(1, data)
+    assert repository.delete(3)
+    assert snapshot.patch(3, None)
+    entries = dict(snapshot.load())
+    assert sorted(entries) == [1, 2]
+    assert (entries[1]["service"], entries[1]["email"]) == ("Gmail", "ola@example.com")
+
+    # En endring uten patch gjør snapshotet utdatert, og det slettes
+    repository.add(ciphers, {"service": "Ny"})
+    assert snapshot.load() is None
+    assert not os.path.exists(snapshot.path)
+    assert not snapshot.patch(4, {"service": "Ny"})
+
+    # Andre nøkler kan ikke lese det
+    assert snapshot.refresh()
+    other = ColumnCipherSet(derive_keys_from_root(derive_root_key("x", b"salt")))
+    assert ListingSnapshot(login_manager.database, user.id, other).load() is None
+    assert not os.path.exists(snapshot.path)
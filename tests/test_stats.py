@@ -0,0 +1,63 @@
+import sys
+import os
+
+# Legg til src i sys.path slik at modulene importeres som i appen
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+src_root = os.path.join(project_root, "src")
+if src_root not in sys.path:
+    sys.path.insert(0, src_root)
+
+from data.database import QueryCounter, get_database
+from data.encryption import ColumnCipherSet, derive_keys_from_root, derive_root_key
+from data.repository import PasswordRepository
+from data.stats import VaultStats
+
+
+def test_counts_are_cached_and_follow_events(tmp_path):
+    database = get_database(str(tmp_path / "passwords.db"))
+    ciphers = ColumnCipherSet(derive_keys_from_root(derive_root_key("pw", b"salt")))
+    repository = PasswordRepository(database, 1)
+    stats = VaultStats(database, 1, ciphers)
+
+    with QueryCounter(database.engine) as counter:
+        assert not stats.has_entries()
+    assert counter.count == 1 and "EXISTS" in counter.statements[0]
+
+    repository.add(ciphers, dict(service="a", tag="Jobb"))
+    repository.add(ciphers, dict(service="b", tag="jobb "))
+    repository.add(ciphers, dict(service="c", tag="Privat"))
+    repository.add(ciphers, dict(service="d"))
+    PasswordRepository(database, 2).add(ciphers, dict(service="e", tag="Jobb"))
+
+    # Svaret er cachet og følger hendelsene
+    with QueryCounter(database.engine) as counter:
+        assert not stats.has_entries()
+        stats.entries_added(4)
+        assert stats.has_entries()
+    assert counter.count == 0
+
+    # En sletting kan ha tømt hvelvet, så det spørres på nytt én gang
+    stats.entries_removed()
+    with QueryCounter(database.engine) as counter:
+        assert stats.has_entries() and stats.has_entries()
+    assert counter.count == 1
+    assert stats.count() == 4
+    tags = stats.tag_counts()
+    assert tags[0][1] == 2 and tags[0][0].casefold() == "jobb"
+    assert sorted(tags[1:]) == [("", 1), ("Privat", 1)]
+
+    # Hendelsene holder tallene oppdatert uten nye spørringer
+    with QueryCounter(database.engine) as counter:
+        stats.entries_removed()
+        stats.entries_added(3)
+        assert stats.count() == 6 and stats.has_entries()
+    assert counter.count == 0
+
+    # Emnetellingen regnes ut på nytt etter en endring
+    stats.entries_changed()
+    with QueryCounter(database.engine) as counter:
+        assert stats.tag_counts() == tags
+    assert counter.count == 1
+
+    stats.invalidate()
+    assert stats.count() == 4
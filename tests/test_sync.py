@@ -0,0 +1,167 @@
+import sqlite3
+import sys
+import os
+
+# Legg til src i sys.path slik at modulene importeres som i appen
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+src_root = os.path.join(project_root, "src")
+if src_root not in sys.path:
+    sys.path.insert(0, src_root)
+
+from data.database import get_engine, create_tables, get_session
+from data.encryption import (
+    ENCRYPTED_COLUMNS,
+    ColumnCipherSet,
+    derive_keys_from_root,
+    derive_root_key,
+)
+from data.models import PasswordEntry, ENCRYPTED_ATTRIBUTES
+from data.repository import encrypt_entry
+from data.sync import synchronize_from_backup
+
+
+def make_entry(ciphers, user_id, with_derived=True, **fields):
+    data = {
+        "service": "",
+        "email": "",
+        "username": "",
+        "password": "hemmelig",
+        "link": "",
+        "tag": "",
+    }
+    data.update(fields)
+    attributes = {
+        ENCRYPTED_ATTRIBUTES[column]: token
+        for column, token in ciphers.encrypt_fields(data).items()
+    }
+    if with_derived:
+        attributes.update(ciphers.derived_columns(data))
+    return PasswordEntry(user_id=user_id, **attributes)
+
+
+def make_record_entry(ciphers, user_id, entry_id, **fields):
+    data = {"password": "hemmelig", **fields}
+    return PasswordEntry(
+        id=entry_id, user_id=user_id, **encrypt_entry(ciphers, entry_id, data)
+    )
+
+
+def service_of(ciphers, entry):
+    return ciphers.decrypt_entry(entry.id, entry.record, {"service": entry.service})[
+        "service"
+    ]
+
+
+def open_session(path):
+    engine = get_engine(str(path))
+    create_tables(engine)
+    return engine, get_session(engine)
+
+
+def test_synchronize_from_backup_adds_only_new_entries(tmp_path):
+    ciphers = ColumnCipherSet(derive_keys_from_root(derive_root_key("pw", b"salt")))
+    foreign = ColumnCipherSet(derive_keys_from_root(derive_root_key("x", b"salt")))
+
+    engine, session = open_session(tmp_path / "passwords.db")
+    session.add(make_entry(ciphers, 1, service="Google", email="ola@gmail.com"))
+    session.add(make_entry(ciphers, 2, service="GitHub", email="ola@jobb.no"))
+    session.commit()
+
+    backup_path = tmp_path / "backup.db"
+    backup_engine, backup_session = open_session(backup_path)
+    backup_session.add_all(
+        [
+            # Finnes fra før (samme identitet, annen skrivemåte)
+            make_entry(ciphers, 1, service="google", email="OLA@gmail.com"),
+            # Ny, med og uten lagret fingeravtrykk. Posten er bundet til id-en
+            # i backupen og må krypteres på nytt for den nye id-en.
+            make_record_entry(ciphers, 1, 10, service="GitHub", email="ola@jobb.no"),
+            make_entry(ciphers, 1, with_derived=False, service="Finn", email="a@b"),
+            # Duplikat i selve backupen
+            make_entry(ciphers, 1, with_derived=False, service="finn", email="a@b"),
+            # Laget med andre nøkler
+            make_entry(foreign, 1, service="Annen", email="c@d"),
+            make_entry(foreign, 1, with_derived=False, service="Annen", email="e@f"),
+        ]
+    )
+    backup_session.commit()
+    backup_session.close()
+    backup_engine.dispose()
+
+    result = synchronize_from_backup(engine, str(backup_path), 1, ciphers, batch_size=2)
+    assert result == (2, 2)
+
+    session.expire_all()
+    entries = session.query(PasswordEntry).filter_by(user_id=1).all()
+    services = sorted(service_of(ciphers, e) for e in entries)
+    assert services == ["Finn", "GitHub", "Google"]
+    assert all(e.fingerprint and e.service_bidx for e in entries)
+    assert all(e.record for e in entries if e.id > 2)
+
+    # En ny synkronisering legger ikke til noe, og backupen er koblet fra igjen
+    assert synchronize_from_backup(engine, str(backup_path), 1, ciphers) == (0, 2)
+
+
+def test_synchronize_from_backup_without_fingerprint_column(tmp_path):
+    ciphers = ColumnCipherSet(derive_keys_from_root(derive_root_key("pw", b"salt")))
+    engine, session = open_session(tmp_path / "passwords.db")
+
+    # Backup med skjemaet fra før blind-indekser og fingeravtrykk fantes
+    backup_path = tmp_path / "old_backup.db"
+    entry = make_entry(ciphers, 1, with_derived=False, service="Finn", email="a@b")
+    connection = sqlite3.connect(backup_path)
+    connection.execute(
+        "CREATE TABLE passwords (id INTEGER PRIMARY KEY, service VARCHAR NOT NULL, "
+        "email VARCHAR NOT NULL, username VARCHAR, encrypted_password VARCHAR NOT NULL, "
+        "link VARCHAR, tag VARCHAR, user_id INTEGER)"
+    )
+    connection.execute(
+        "INSERT INTO passwords (service, email, username, encrypted_password, link, tag, user_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, 1)",
+        (
+            entry.service,
+            entry.email,
+            entry.username,
+            entry.encrypted_password,
+            entry.link,
+            entry.tag,
+        ),
+    )
+    connection.commit()
+    connection.close()
+
+    assert synchronize_from_backup(engine, str(backup_path), 1, ciphers) == (1, 0)
+
+
+def test_synchronize_from_backup_with_legacy_keys(tmp_path):
+    # Bare kolonnenøkler, som etter en mislykket oppgradering fra gammelt
+    # skjema: ingen fingeravtrykksnøkkel, så identitetene sammenlignes
+    keys = derive_keys_from_root(derive_root_key("pw", b"salt"))
+    ciphers = ColumnCipherSet({column: keys[column] for column in ENCRYPTED_COLUMNS})
+    foreign = ColumnCipherSet(derive_keys_from_root(derive_root_key("x", b"salt")))
+    assert not ciphers.has_fingerprint_key
+
+    engine, session = open_session(tmp_path / "passwords.db")
+    session.add(make_entry(ciphers, 1, service="Google", email="ola@gmail.com"))
+    session.commit()
+
+    backup_path = tmp_path / "backup.db"
+    backup_engine, backup_session = open_session(backup_path)
+    backup_session.add_all(
+        [
+            make_entry(ciphers, 1, service="google", email="OLA@gmail.com"),
+            make_entry(ciphers, 1, service="Finn", email="a@b"),
+            make_entry(ciphers, 1, service="finn", email="a@b"),
+            # Lagret fingeravtrykk fra andre nøkler brukes ikke
+            make_entry(foreign, 1, service="Annen", email="c@d"),
+        ]
+    )
+    backup_session.commit()
+    backup_session.close()
+    backup_engine.dispose()
+
+    assert synchronize_from_backup(engine, str(backup_path), 1, ciphers) == (1, 1)
+    session.expire_all()
+    entries = session.query(PasswordEntry).filter_by(user_id=1).all()
+    assert sorted(service_of(ciphers, e) for e in entries) == ["Finn", "Google"]
+    assert synchronize_from_backup(engine, str(backup_path), 1, ciphers) == (0, 1)